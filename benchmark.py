@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+"""
+视频合成服务端到端压测
+启动桩GPT-SoVITS / MuseTalk服务和真实的 server/main.py，并发提交任务，
+统计吞吐、各阶段延迟分位数、服务端内存和文件描述符峰值，结果输出为JSON便于版本间对比
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import tempfile
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import psutil
+import requests
+from test_client import TestClient
+
+PROJECT_ROOT = Path(__file__).parent
+SERVER_DIR = PROJECT_ROOT / "server"
+
+# 任务时间线中的阶段：(名称, 起点, 终点)
+STAGES = (
+    ("upload", "submit_start", "submitted"),
+    ("first_segment", "submitted", "first_video"),
+    ("generation", "submitted", "merging"),
+    ("merge", "merging", "merged"),
+    ("finalize", "merged", "completed"),
+    ("end_to_end", "submit_start", "completed")
+)
+
+# 从服务端 /metrics 读取的单次调用耗时直方图
+SERVER_HISTOGRAMS = ("job_queue_wait_seconds", "tts_request_seconds", "musetalk_request_seconds", "merge_seconds")
+
+def make_text(task_index: int, segment: int, min_chars: int) -> str:
+    """生成每个任务、每段都不同的文本，按句重复到至少min_chars个字符"""
+    sentences = []
+    while not sentences or len("".join(sentences)) < min_chars:
+        sentences.append(f"压测任务{task_index}的第{segment}段第{len(sentences)}句文本，用于测量端到端延迟。")
+    return "".join(sentences)
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """线性插值的分位数"""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+def summarize(values: List[float]) -> dict:
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": max(values) if values else None
+    }
+
+def histogram_quantiles(metrics_text: str, name: str) -> dict:
+    """
+    从Prometheus文本中汇总某个直方图所有标签的桶，按桶内线性插值估算分位数
+    """
+    buckets: Dict[float, float] = {}
+    total, count = 0.0, 0.0
+    for line in metrics_text.splitlines():
+        if line.startswith(f"{name}_bucket{{"):
+            labels, value = line.rsplit(" ", 1)
+            le = labels.split('le="', 1)[1].split('"', 1)[0]
+            bound = float("inf") if le == "+Inf" else float(le)
+            buckets[bound] = buckets.get(bound, 0.0) + float(value)
+        elif line.startswith(f"{name}_sum"):
+            total += float(line.rsplit(" ", 1)[1])
+        elif line.startswith(f"{name}_count"):
+            count += float(line.rsplit(" ", 1)[1])
+
+    result = {"count": int(count), "mean": total / count if count else None}
+    bounds = sorted(buckets)
+    for label, q in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99)):
+        if not count:
+            result[label] = None
+            continue
+        rank, previous_bound, previous_count = q * count, 0.0, 0.0
+        for bound in bounds:
+            if buckets[bound] >= rank:
+                if bound == float("inf"):
+                    # 落在最后一个桶，只能给出其下界
+                    result[label] = previous_bound
+                else:
+                    fraction = (rank - previous_count) / max(buckets[bound] - previous_count, 1e-9)
+                    result[label] = previous_bound + (bound - previous_bound) * fraction
+                break
+            previous_bound, previous_count = bound, buckets[bound]
+    return result
+
+class ResourceSampler(threading.Thread):
+    """定期采样服务端进程（含子进程）的常驻内存和打开的文件描述符数"""
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        super().__init__(daemon=True)
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_fds = 0
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def sample(self):
+        rss, fds = 0, 0
+        for process in [self.process] + self.process.children(recursive=True):
+            try:
+                rss += process.memory_info().rss
+                fds += process.num_fds() if hasattr(process, "num_fds") else process.num_handles()
+            except psutil.NoSuchProcess:
+                continue
+        return rss, fds
+
+    def run(self):
+        while not self._stop_event.is_set():
+            rss, fds = self.sample()
+            self.peak_rss = max(self.peak_rss, rss)
+            self.peak_fds = max(self.peak_fds, fds)
+            self.samples.append((time.time(), rss, fds))
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+class BenchmarkClient(TestClient):
+    """在TestClient基础上记录每个任务各阶段的时间点"""
+
+    def submit(self, video_path: str, texts: List[str], timeline: dict) -> str:
+        timeline["submit_start"] = time.time()
+        with open(video_path, 'rb') as video:
+            response = self.session.post(
+                f"{self.server_url}/synthesize",
+                files={'video': video},
+                data={'texts': '\n'.join(texts), 'language': 'zh'}
+            )
+        response.raise_for_status()
+        timeline["submitted"] = time.time()
+        return response.json()['task_id']
+
+    def run_task(self, video_path: str, texts: List[str], timeout: float) -> dict:
+        timeline = {}
+        record = {"segments": len(texts), "status": "error", "error": None, "timeline": timeline}
+        try:
+            task_id = self.submit(video_path, texts, timeline)
+            record["task_id"] = task_id
+            for event, payload in self.iter_task_events(task_id, timeout):
+                now = time.time()
+                if event == "segment" and payload["stage"] == "video":
+                    timeline.setdefault("first_video", now)
+                elif event == "merged":
+                    timeline["merged"] = now
+                elif event == "status" and "status" in payload:
+                    if payload.get("completed_segments"):
+                        # 独立工作进程模式下收不到segment事件，以状态中的完成段数为准
+                        timeline.setdefault("first_video", now)
+                    timeline.setdefault(payload["status"], now)
+                    record["status"] = payload["status"]
+                    if payload["status"] == "failed":
+                        record["error"] = payload.get("message")
+        except Exception as e:
+            record["error"] = str(e)
+
+        record["stages"] = {
+            name: timeline[end] - timeline[start]
+            for name, start, end in STAGES
+            if start in timeline and end in timeline
+        }
+        return record
+
+class BenchmarkEnvironment:
+    """启动桩后端和服务端，所有数据写入独立的临时目录"""
+
+    def __init__(self, args):
+        self.args = args
+        self.workspace = Path(tempfile.mkdtemp(prefix="vs_benchmark_"))
+        self.processes: List[subprocess.Popen] = []
+        self.server_process: Optional[subprocess.Popen] = None
+        self.server_url = None
+
+    def _spawn(self, cmd, cwd=None, env=None, log_name=None) -> subprocess.Popen:
+        log_file = open(self.workspace / f"{log_name}.log", 'w')
+        process = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+        self.processes.append(process)
+        return process
+
+    def _wait_healthy(self, url: str, timeout: float = 60):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            for process in self.processes:
+                if process.poll() is not None:
+                    raise Exception(f"进程提前退出，日志见 {self.workspace}")
+            try:
+                if requests.get(f"{url}/health", timeout=2).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.2)
+        raise Exception(f"等待 {url} 就绪超时")
+
+    def start(self):
+        args = self.args
+        backend_urls = {}
+        for kind, latency, sigma, size, size_sigma, char_latency in (
+            ("gpt_sovits", args.tts_latency, args.tts_latency_sigma, args.tts_size, args.size_sigma, args.tts_char_latency),
+            ("musetalk", args.video_latency, args.video_latency_sigma, args.video_size, args.size_sigma, 0.0)
+        ):
+            port = free_port()
+            self._spawn(
+                [
+                    sys.executable, str(PROJECT_ROOT / "benchmark_stubs.py"), kind,
+                    "--port", str(port),
+                    "--latency", str(latency), "--latency-sigma", str(sigma),
+                    "--size", str(size), "--size-sigma", str(size_sigma),
+                    "--char-latency", str(char_latency),
+                    "--seed", str(args.seed)
+                ],
+                log_name=kind
+            )
+            backend_urls[kind] = f"http://127.0.0.1:{port}"
+            self._wait_healthy(backend_urls[kind])
+
+        port = free_port()
+        env = dict(
+            os.environ,
+            GPT_SOVITS_API_URL=backend_urls["gpt_sovits"],
+            MUSETALK_API_URL=backend_urls["musetalk"],
+            TEMP_DIR=str(self.workspace / "temp"),
+            OUTPUT_DIR=str(self.workspace / "output"),
+            ASSETS_DIR=str(self.workspace / "assets"),
+            TASK_DB_PATH=str(self.workspace / "tasks.db"),
+            TTS_CACHE_DIR=str(self.workspace / "tts_cache"),
+            TTS_CACHE_ENABLED="true" if args.tts_cache else "false",
+            PYTHONUNBUFFERED="1"
+        )
+        if args.workers:
+            # 任务由独立的工作进程执行，各进程的计数通过多进程目录汇总到服务端的 /metrics
+            metrics_dir = self.workspace / "metrics"
+            metrics_dir.mkdir()
+            env.update(
+                JOB_BROKER_URL=f"sqlite://{self.workspace / 'jobs.db'}",
+                PROMETHEUS_MULTIPROC_DIR=str(metrics_dir)
+            )
+        self.server_process = self._spawn(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+            cwd=str(SERVER_DIR),
+            env=env,
+            log_name="server"
+        )
+        self.server_url = f"http://127.0.0.1:{port}"
+        self._wait_healthy(self.server_url)
+        for i in range(args.workers):
+            self._spawn([sys.executable, "worker.py"], cwd=str(SERVER_DIR), env=env, log_name=f"worker_{i}")
+
+    def stop(self):
+        for process in reversed(self.processes):
+            if process.poll() is None:
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+        if not self.args.keep_workspace:
+            import shutil
+            shutil.rmtree(self.workspace, ignore_errors=True)
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=PROJECT_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+def run_benchmark(args) -> dict:
+    env = BenchmarkEnvironment(args)
+    try:
+        env.start()
+        video_path = env.workspace / "reference.mp4"
+        with open(video_path, 'wb') as f:
+            f.write(os.urandom(args.reference_size))
+
+        sampler = ResourceSampler(env.server_process.pid)
+        idle_rss, idle_fds = sampler.sample()
+        sampler.start()
+
+        def worker(task_index: int) -> dict:
+            client = BenchmarkClient(env.server_url)
+            # 每个任务的文本不同，避免TTS缓存命中影响结果
+            texts = [make_text(task_index, i, args.text_chars) for i in range(args.segments)]
+            return client.run_task(str(video_path), texts, args.timeout)
+
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            records = list(executor.map(worker, range(args.tasks)))
+        wall_time = time.time() - start_time
+
+        sampler.stop()
+        metrics_text = requests.get(f"{env.server_url}/metrics", timeout=10).text
+    finally:
+        env.stop()
+
+    completed = [r for r in records if r["status"] == "completed"]
+    stage_names = [name for name, _, _ in STAGES]
+    return {
+        "revision": git_revision(),
+        "timestamp": time.time(),
+        "platform": {"python": platform.python_version(), "system": platform.platform(), "cpus": os.cpu_count()},
+        "config": {
+            key: value for key, value in vars(args).items()
+            if key not in ("output", "baseline", "max_regression", "keep_workspace")
+        },
+        "summary": {
+            "tasks": len(records),
+            "completed": len(completed),
+            "failed": len(records) - len(completed),
+            "wall_seconds": wall_time,
+            "tasks_per_second": len(completed) / wall_time,
+            "segments_per_second": sum(r["segments"] for r in completed) / wall_time,
+            "latency": {
+                name: summarize([r["stages"][name] for r in completed if name in r["stages"]])
+                for name in stage_names
+            },
+            "server_calls": {name: histogram_quantiles(metrics_text, name) for name in SERVER_HISTOGRAMS},
+            "resources": {
+                "idle_rss_mb": idle_rss / 1024 ** 2,
+                "peak_rss_mb": sampler.peak_rss / 1024 ** 2,
+                "idle_fds": idle_fds,
+                "peak_fds": sampler.peak_fds
+            }
+        },
+        "errors": [r["error"] for r in records if r["error"]][:20],
+        "tasks": records
+    }
+
+def format_seconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.3f}"
+
+def print_report(result: dict):
+    summary = result["summary"]
+    print("=" * 72)
+    print(f"版本: {result['revision']}  任务: {summary['completed']}/{summary['tasks']} 完成  "
+          f"耗时: {summary['wall_seconds']:.2f}s")
+    print(f"吞吐: {summary['tasks_per_second']:.3f} 任务/秒, {summary['segments_per_second']:.3f} 段/秒")
+    print("-" * 72)
+    print(f"{'阶段(秒)':<24}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for name, stats in summary["latency"].items():
+        print(f"{name:<24}{format_seconds(stats['p50']):>10}{format_seconds(stats['p95']):>10}"
+              f"{format_seconds(stats['p99']):>10}{format_seconds(stats['max']):>10}")
+    for name, stats in summary["server_calls"].items():
+        print(f"{name:<24}{format_seconds(stats['p50']):>10}{format_seconds(stats['p95']):>10}"
+              f"{format_seconds(stats['p99']):>10}{'':>10}")
+    print("-" * 72)
+    resources = summary["resources"]
+    print(f"服务端内存: 空闲 {resources['idle_rss_mb']:.1f}MB, 峰值 {resources['peak_rss_mb']:.1f}MB; "
+          f"文件描述符: 空闲 {resources['idle_fds']}, 峰值 {resources['peak_fds']}")
+    for error in result["errors"][:5]:
+        print(f"[✗] {error}")
+    print("=" * 72)
+
+def compare_with_baseline(result: dict, baseline: dict, max_regression: float) -> bool:
+    """
+    与基线结果对比关键指标，任一指标变差超过阈值时返回False
+    """
+    checks = [
+        ("tasks_per_second", result["summary"]["tasks_per_second"], baseline["summary"]["tasks_per_second"], True),
+        ("end_to_end.p95", result["summary"]["latency"]["end_to_end"]["p95"],
+         baseline["summary"]["latency"]["end_to_end"]["p95"], False),
+        ("first_segment.p95", result["summary"]["latency"]["first_segment"]["p95"],
+         baseline["summary"]["latency"]["first_segment"]["p95"], False),
+        ("peak_rss_mb", result["summary"]["resources"]["peak_rss_mb"],
+         baseline["summary"]["resources"]["peak_rss_mb"], False),
+        ("peak_fds", result["summary"]["resources"]["peak_fds"],
+         baseline["summary"]["resources"]["peak_fds"], False)
+    ]
+    passed = True
+    print(f"与基线 {baseline.get('revision')} 对比（阈值 {max_regression:.0%}）:")
+    for name, current, previous, higher_is_better in checks:
+        if current is None or not previous:
+            continue
+        change = (current - previous) / previous
+        regressed = -change > max_regression if higher_is_better else change > max_regression
+        passed &= not regressed
+        print(f"  {'[✗]' if regressed else '[✓]'} {name}: {previous:.3f} -> {current:.3f} ({change:+.1%})")
+    return passed
+
+def main():
+    parser = argparse.ArgumentParser(description="视频合成服务端到端压测（使用桩后端，无需GPU）")
+    parser.add_argument("--tasks", type=int, default=8, help="任务总数")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时进行的任务数")
+    parser.add_argument("--segments", type=int, default=5, help="每个任务的段数")
+    parser.add_argument("--tts-latency", type=float, default=0.3, help="TTS耗时中位数（秒）")
+    parser.add_argument("--tts-latency-sigma", type=float, default=0.3, help="TTS耗时的对数标准差")
+    parser.add_argument("--video-latency", type=float, default=1.0, help="MuseTalk耗时中位数（秒）")
+    parser.add_argument("--video-latency-sigma", type=float, default=0.3, help="MuseTalk耗时的对数标准差")
+    parser.add_argument("--tts-char-latency", type=float, default=0.0, help="TTS每个字符额外的耗时（秒）")
+    parser.add_argument("--text-chars", type=int, default=0, help="每段文本的最少字符数，用于测试长文本")
+    parser.add_argument("--tts-size", type=int, default=100 * 1024, help="TTS输出大小中位数（字节）")
+    parser.add_argument("--video-size", type=int, default=1024 * 1024, help="MuseTalk输出大小中位数（字节）")
+    parser.add_argument("--size-sigma", type=float, default=0.2, help="输出大小的对数标准差")
+    parser.add_argument("--reference-size", type=int, default=5 * 1024 * 1024, help="参考视频大小（字节）")
+    parser.add_argument("--tts-cache", action="store_true", help="启用服务端TTS缓存")
+    parser.add_argument("--workers", type=int, default=0, help="独立工作进程数，0为由服务端进程执行任务")
+    parser.add_argument("--timeout", type=float, default=600, help="单个任务超时（秒）")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子")
+    parser.add_argument("--output", help="将结果写入JSON文件")
+    parser.add_argument("--baseline", help="与之前的JSON结果对比")
+    parser.add_argument("--max-regression", type=float, default=0.1, help="允许的最大退化比例")
+    parser.add_argument("--keep-workspace", action="store_true", help="保留临时目录和日志")
+    args = parser.parse_args()
+
+    result = run_benchmark(args)
+    print_report(result)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if not compare_with_baseline(result, baseline, args.max_regression):
+            sys.exit(1)
+
+    if result["summary"]["failed"]:
+        sys.exit(2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+压测用的GPT-SoVITS / MuseTalk桩服务
+按配置的对数正态分布模拟推理耗时和输出大小，无需GPU和模型
+"""
+
+import io
+import sys
+import math
+import struct
+import random
+import shutil
+import asyncio
+import hashlib
+import zipfile
+import argparse
+import subprocess
+import tempfile
+from aiohttp import web
+
+class Distribution:
+    """对数正态分布：median为中位数，sigma为对数标准差，sigma=0时为定值"""
+
+    def __init__(self, median: float, sigma: float = 0.0, minimum: float = 0.0):
+        self.median = median
+        self.sigma = sigma
+        self.minimum = minimum
+
+    def sample(self) -> float:
+        if self.sigma <= 0:
+            return max(self.median, self.minimum)
+        return max(random.lognormvariate(math.log(self.median), self.sigma), self.minimum)
+
+def make_wav(num_bytes: int, sample_rate: int = 32000) -> bytes:
+    """生成指定数据长度的静音WAV（16位单声道）"""
+    num_bytes -= num_bytes % 2
+    header = struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + num_bytes, b"WAVE",
+        b"fmt ", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b"data", num_bytes
+    )
+    return header + b"\0" * num_bytes
+
+def make_base_clip(duration: float = 2.0) -> bytes:
+    """
+    用ffmpeg生成一段有音视频的小MP4作为MuseTalk输出模板，没有ffmpeg时返回空模板
+    """
+    if shutil.which("ffmpeg") is None:
+        print("[桩服务] 未找到ffmpeg，输出不是有效视频，服务端合并会失败", file=sys.stderr)
+        return b""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = f"{tmp_dir}/clip.mp4"
+        result = subprocess.run(
+            [
+                'ffmpeg', '-v', 'error',
+                '-f', 'lavfi', '-i', f'testsrc=size=256x256:rate=25:duration={duration}',
+                '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+                '-c:v', 'libx264', '-pix_fmt', 'yuv420p',
+                '-c:a', 'aac', '-shortest',
+                '-y', output_path
+            ],
+            capture_output=True,
+            text=True
+        )
+        if result.returncode != 0:
+            print(f"[桩服务] 生成模板视频失败，输出不是有效视频: {result.stderr[-500:]}", file=sys.stderr)
+            return b""
+        with open(output_path, 'rb') as f:
+            return f.read()
+
+def pad_mp4(clip: bytes, size: int) -> bytes:
+    """在MP4末尾追加free box把文件补到指定大小，播放器和ffmpeg会忽略它"""
+    padding = size - len(clip)
+    if padding < 8:
+        return clip
+    return clip + struct.pack(">I", padding) + b"free" + b"\0" * (padding - 8)
+
+class StubBackends:
+    def __init__(self, latency: Distribution, output_size: Distribution, char_latency: float = 0.0):
+        self.latency = latency
+        self.output_size = output_size
+        # TTS每个字符额外的耗时，模拟推理时间随文本长度增长
+        self.char_latency = char_latency
+        self.base_clip = b""
+        self.avatars = set()
+        self.stats = {"requests": 0, "bytes_in": 0, "bytes_out": 0}
+
+    async def _delay(self):
+        await asyncio.sleep(self.latency.sample())
+
+    def _clip(self) -> bytes:
+        return pad_mp4(self.base_clip, int(self.output_size.sample()))
+
+    async def _read_form(self, request: web.Request):
+        self.stats["requests"] += 1
+        self.stats["bytes_in"] += request.content_length or 0
+        return await request.post()
+
+    async def tts(self, request: web.Request):
+        self.stats["requests"] += 1
+        data = await request.json()
+        await asyncio.sleep(self.latency.sample() + len(data.get("text", "")) * self.char_latency)
+        body = make_wav(int(self.output_size.sample()))
+        self.stats["bytes_out"] += len(body)
+        return web.Response(body=body, content_type="audio/wav")
+
+    def _register_avatar(self, video) -> str:
+        avatar_id = hashlib.sha256(video.file.read()).hexdigest() + "_0"
+        self.avatars.add(avatar_id)
+        return avatar_id
+
+    async def prewarm(self, request: web.Request):
+        data = await self._read_form(request)
+        return web.json_response({"avatar_id": self._register_avatar(data["video"])})
+
+    def _check_avatar(self, data):
+        """与MuseTalk一致：上传的参考视频会被缓存，引用未缓存的avatar_id返回404"""
+        if "video" in data:
+            self._register_avatar(data["video"])
+        elif data.get("avatar_id") not in self.avatars:
+            raise web.HTTPNotFound()
+
+    async def inference(self, request: web.Request):
+        data = await self._read_form(request)
+        self._check_avatar(data)
+        await self._delay()
+        body = self._clip()
+        self.stats["bytes_out"] += len(body)
+        return web.Response(body=body, content_type="video/mp4")
+
+    async def inference_batch(self, request: web.Request):
+        data = await self._read_form(request)
+        self._check_avatar(data)
+        count = len(data.getall("audios"))
+        # 批量推理按段数累加耗时
+        await asyncio.sleep(sum(self.latency.sample() for _ in range(count)))
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+            for i in range(count):
+                archive.writestr(f"segment_{i}.mp4", self._clip())
+        self.stats["bytes_out"] += buffer.tell()
+        return web.Response(body=buffer.getvalue(), content_type="application/zip")
+
+    async def health(self, request: web.Request):
+        return web.json_response({"status": "healthy"})
+
+    async def get_stats(self, request: web.Request):
+        return web.json_response(self.stats)
+
+    def create_app(self, kind: str) -> web.Application:
+        app = web.Application(client_max_size=4 * 1024 ** 3)
+        app.router.add_get("/health", self.health)
+        app.router.add_get("/stats", self.get_stats)
+        if kind == "gpt_sovits":
+            app.router.add_post("/tts", self.tts)
+        else:
+            self.base_clip = make_base_clip()
+            app.router.add_post("/inference", self.inference)
+            app.router.add_post("/inference/batch", self.inference_batch)
+            app.router.add_post("/avatars/prewarm", self.prewarm)
+        return app
+
+def main():
+    parser = argparse.ArgumentParser(description="压测用后端桩服务")
+    parser.add_argument("kind", choices=["gpt_sovits", "musetalk"])
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--latency", type=float, default=0.5, help="推理耗时中位数（秒）")
+    parser.add_argument("--latency-sigma", type=float, default=0.0, help="推理耗时的对数标准差")
+    parser.add_argument("--size", type=int, default=200 * 1024, help="输出大小中位数（字节）")
+    parser.add_argument("--size-sigma", type=float, default=0.0, help="输出大小的对数标准差")
+    parser.add_argument("--char-latency", type=float, default=0.0, help="TTS每个字符额外的耗时（秒）")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    backends = StubBackends(
+        Distribution(args.latency, args.latency_sigma),
+        Distribution(args.size, args.size_sigma, minimum=1024),
+        args.char_latency
+    )
+    web.run_app(backends.create_app(args.kind), host="127.0.0.1", port=args.port, print=None)
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,10 @@ from PyQt5.QtGui import *
 import requests
 from datetime import datetime
 import tempfile
+import tarfile
 import shutil
+import hashlib
+import time
 
 # 获取资源路径（支持打包后的exe）
 def resource_path(relative_path):
@@ -18,6 +21,16 @@ def resource_path(relative_path):
         base_path = os.path.abspath(".")
     return os.path.join(base_path, relative_path)
 
+# 超过该大小的参考视频使用分块上传，支持断点续传
+RESUMABLE_UPLOAD_THRESHOLD = 32 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_MAX_RETRIES = 5
+# 服务端任务队列已满(429)时按Retry-After等待后重新提交的次数
+SUBMIT_MAX_RETRIES = 10
+
+# (服务器, 文件路径, 大小, 修改时间) -> upload_id，上传中断后再次提交时继续上传
+_pending_uploads = {}
+
 class WorkerThread(QThread):
     progress_update = pyqtSignal(str)
     task_complete = pyqtSignal(dict)
@@ -34,13 +47,10 @@ class WorkerThread(QThread):
         self.task_id = None
         
     def run(self):
+        files = {}
         try:
             self.progress_update.emit("正在上传文件...")
             
-            files = {'video': open(self.video_path, 'rb')}
-            if self.ref_audio_path:
-                files['ref_audio'] = open(self.ref_audio_path, 'rb')
-            
             data = {
                 'texts': '\n'.join(self.texts),
                 'language': self.language
@@ -48,35 +58,32 @@ class WorkerThread(QThread):
             if self.ref_text:
                 data['ref_text'] = self.ref_text
             
-            response = requests.post(
-                f"{self.server_url}/synthesize",
-                files=files,
-                data=data
-            )
+            video_asset_id = None
+            if os.path.getsize(self.video_path) > RESUMABLE_UPLOAD_THRESHOLD:
+                video_asset_id = self.upload_resumable(self.video_path, 'video')
+            if video_asset_id:
+                data['video_asset_id'] = video_asset_id
+            else:
+                files['video'] = open(self.video_path, 'rb')
+            if self.ref_audio_path:
+                files['ref_audio'] = open(self.ref_audio_path, 'rb')
+            
+            response = self.submit(files, data)
             
             if response.status_code == 200:
                 self.task_id = response.json()['task_id']
                 self.progress_update.emit(f"任务已创建: {self.task_id}")
                 
-                while True:
-                    status_response = requests.get(
-                        f"{self.server_url}/task/{self.task_id}"
-                    )
-                    
-                    if status_response.status_code == 200:
-                        status = status_response.json()
-                        self.progress_update.emit(
-                            f"状态: {status['status']} - {status['message']} ({status['progress']}%)"
-                        )
-                        
-                        if status['status'] == 'completed':
-                            self.task_complete.emit(status)
-                            break
-                        elif status['status'] == 'failed':
-                            self.error_occurred.emit(status['message'])
-                            break
-                    
-                    self.msleep(2000)
+                # 优先通过服务端推送获取进度，连接失败或服务端不支持时回退为轮询
+                try:
+                    finished = self.watch_events()
+                except requests.RequestException as e:
+                    self.progress_update.emit(f"进度推送中断，改为轮询: {e}")
+                    finished = False
+                if not finished:
+                    self.poll_status()
+            elif response.status_code == 429:
+                self.error_occurred.emit("服务器繁忙，任务队列已满，请稍后再试")
             else:
                 self.error_occurred.emit(f"上传失败: {response.status_code}")
                 
@@ -86,6 +93,160 @@ class WorkerThread(QThread):
             for file in files.values():
                 file.close()
 
+    def submit(self, files, data):
+        """提交合成任务，队列已满时按服务端给出的Retry-After等待后重试"""
+        for attempt in range(SUBMIT_MAX_RETRIES + 1):
+            for file in files.values():
+                file.seek(0)
+            response = requests.post(
+                f"{self.server_url}/synthesize",
+                files=files,
+                data=data
+            )
+            if response.status_code != 429 or attempt == SUBMIT_MAX_RETRIES:
+                return response
+            retry_after = int(response.headers.get('Retry-After', '5'))
+            self.progress_update.emit(f"服务器繁忙，{retry_after} 秒后重新提交...")
+            time.sleep(retry_after)
+        return response
+
+    def upload_resumable(self, path, kind):
+        """
+        分块上传文件，失败时查询服务端偏移后从断点继续，返回asset_id；服务端不支持时返回None
+        """
+        stat = os.stat(path)
+        key = (self.server_url, os.path.abspath(path), stat.st_size, stat.st_mtime)
+        session = requests.Session()
+        
+        upload_id = _pending_uploads.get(key)
+        offset = None
+        if upload_id:
+            response = session.get(f"{self.server_url}/uploads/{upload_id}")
+            if response.status_code == 200:
+                offset = response.json()['offset']
+                self.progress_update.emit(f"继续上传: 已完成 {offset * 100 // stat.st_size}%")
+        if offset is None:
+            response = session.post(
+                f"{self.server_url}/uploads",
+                data={'size': stat.st_size, 'kind': kind, 'filename': os.path.basename(path)}
+            )
+            if response.status_code == 404:
+                return None
+            response.raise_for_status()
+            upload_id, offset = response.json()['upload_id'], 0
+            _pending_uploads[key] = upload_id
+        
+        self.progress_update.emit("正在计算文件校验值...")
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        
+        retries = 0
+        with open(path, 'rb') as f:
+            while offset < stat.st_size:
+                f.seek(offset)
+                chunk = f.read(UPLOAD_CHUNK_SIZE)
+                try:
+                    response = session.put(
+                        f"{self.server_url}/uploads/{upload_id}",
+                        params={'offset': offset},
+                        data=chunk,
+                        timeout=(10, 300)
+                    )
+                    if response.status_code == 200:
+                        offset = response.json()['offset']
+                        retries = 0
+                        self.progress_update.emit(f"上传进度: {offset * 100 // stat.st_size}%")
+                        continue
+                    if response.status_code != 409:
+                        response.raise_for_status()
+                    # 偏移不一致（上次分块只写入了一部分），以服务端实际收到的字节数为准
+                    response = session.get(f"{self.server_url}/uploads/{upload_id}")
+                    response.raise_for_status()
+                    offset = response.json()['offset']
+                    error = "偏移不一致"
+                except requests.RequestException as e:
+                    error = e
+                
+                retries += 1
+                if retries > UPLOAD_MAX_RETRIES:
+                    raise Exception(f"上传失败，可重新提交以继续上传: {error}")
+                self.progress_update.emit(f"上传中断，{retries}秒后重试: {error}")
+                time.sleep(retries)
+        
+        response = session.post(
+            f"{self.server_url}/uploads/{upload_id}/finalize",
+            data={'sha256': digest.hexdigest()}
+        )
+        _pending_uploads.pop(key, None)
+        response.raise_for_status()
+        return response.json()['asset_id']
+    
+    def handle_status(self, status):
+        """处理一次状态更新，任务结束时返回True"""
+        if status.get('queue_position'):
+            self.progress_update.emit(f"排队中，前面还有 {status['queue_position'] - 1} 个任务")
+        else:
+            self.progress_update.emit(
+                f"状态: {status['status']} - {status.get('message', '')} ({status.get('progress', '-')}%)"
+            )
+        if status['status'] == 'completed':
+            self.task_complete.emit(status)
+            return True
+        if status['status'] == 'failed':
+            self.error_occurred.emit(status.get('message', '处理失败'))
+            return True
+        return False
+    
+    def watch_events(self):
+        """
+        订阅任务的Server-Sent Events，收到结束状态时返回True，服务端不支持时返回False
+        """
+        response = requests.get(
+            f"{self.server_url}/task/{self.task_id}/events",
+            stream=True,
+            timeout=(10, 60)
+        )
+        if response.status_code != 200:
+            return False
+        
+        with response:
+            event, data = None, []
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    data.append(line[5:].strip())
+                elif not line and data:
+                    payload = json.loads("\n".join(data))
+                    event, data = event or "message", []
+                    if event == "segment":
+                        stage = "语音" if payload['stage'] == "audio" else "视频"
+                        self.progress_update.emit(f"第 {payload['index'] + 1} 段{stage}已完成")
+                    elif event == "merged":
+                        self.progress_update.emit("视频合并完成")
+                    elif event == "status":
+                        if payload['status'] == 'completed' and 'result_urls' not in payload:
+                            return False
+                        if self.handle_status(payload):
+                            return True
+                    event = None
+        return False
+    
+    def poll_status(self):
+        """轮询任务状态直到结束"""
+        while True:
+            status_response = requests.get(
+                f"{self.server_url}/task/{self.task_id}"
+            )
+            
+            if status_response.status_code == 200:
+                if self.handle_status(status_response.json()):
+                    break
+            
+            self.msleep(2000)
+
 class VideoSynthesisClient(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -200,6 +361,7 @@ class VideoSynthesisClient(QMainWindow):
         self.video_path = None
         self.audio_path = None
         self.result_urls = None
+        self.task_id = None
         
     def select_video(self):
         file_path, _ = QFileDialog.getOpenFileName(
@@ -255,6 +417,7 @@ class VideoSynthesisClient(QMainWindow):
     
     def on_task_complete(self, result):
         self.result_urls = result['result_urls']
+        self.task_id = result['task_id']
         self.download_btn.setEnabled(True)
         self.process_btn.setEnabled(True)
         self.update_progress("合成完成！可以下载结果了。")
@@ -275,22 +438,43 @@ class VideoSynthesisClient(QMainWindow):
         
         self.update_progress("开始下载文件...")
         
-        for url in self.result_urls:
-            filename = os.path.basename(url)
-            response = requests.get(f"{self.server_url}{url}", stream=True)
-            
-            if response.status_code == 200:
-                save_path = os.path.join(save_dir, filename)
-                with open(save_path, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        f.write(chunk)
-                self.update_progress(f"已下载: {filename}")
-            else:
-                self.update_progress(f"下载失败: {filename}")
+        with requests.Session() as session:
+            # 优先一次请求下载全部结果，旧版服务端不支持时逐个下载
+            if not self.download_bundle(session, save_dir):
+                for url in self.result_urls:
+                    filename = os.path.basename(url)
+                    response = session.get(f"{self.server_url}{url}", stream=True)
+                    
+                    if response.status_code == 200:
+                        save_path = os.path.join(save_dir, filename)
+                        with open(save_path, 'wb') as f:
+                            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                                f.write(chunk)
+                        self.update_progress(f"已下载: {filename}")
+                    else:
+                        self.update_progress(f"下载失败: {filename}")
         
         self.update_progress("所有文件下载完成！")
         QMessageBox.information(self, "完成", f"文件已保存到: {save_dir}")
 
+    def download_bundle(self, session, save_dir):
+        """
+        下载任务结果打包（tar），边下载边解包，不支持时返回False
+        """
+        response = session.get(f"{self.server_url}/task/{self.task_id}/bundle", stream=True)
+        if response.status_code != 200:
+            return False
+        
+        with tarfile.open(fileobj=response.raw, mode='r|') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                filename = os.path.basename(member.name)
+                with open(os.path.join(save_dir, filename), 'wb') as f:
+                    shutil.copyfileobj(tar.extractfile(member), f, 1024 * 1024)
+                self.update_progress(f"已下载: {filename}")
+        return True
+
 def main():
     app = QApplication(sys.argv)
     app.setApplicationName("视频合成客户端")
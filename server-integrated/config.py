@@ -17,11 +17,16 @@ SERVER_HOST = "0.0.0.0"
 SERVER_PORT = 8000
 
 # 内部服务配置
+# instances 可为同一服务配置多个实例（如每块GPU一个），每项可覆盖host/port并用gpu指定显卡，
+# 例如 [{"port": 9881, "gpu": "0"}, {"port": 9891, "gpu": "1"}]；未配置时只有host/port一个实例
+# 实例监听的端口通过 port_env 指定的环境变量传给启动脚本
 SERVICES = {
     "gpt_sovits": {
         "name": "GPT-SoVITS",
         "host": "127.0.0.1",
         "port": 9880,
+        "port_env": "GPT_SOVITS_PORT",
+        "instances": [],
         "health_endpoint": "/health",
         "start_script": str(PROJECT_ROOT / "services" / "gpt-sovits" / "start_service.sh"),
         "enabled": True
@@ -30,29 +35,56 @@ SERVICES = {
         "name": "MuseTalk",
         "host": "127.0.0.1", 
         "port": 9881,
+        "port_env": "MUSETALK_PORT",
+        "instances": [],
         "health_endpoint": "/health",
         "start_script": str(PROJECT_ROOT / "services" / "musetalk" / "start_service.sh"),
         "enabled": True
     }
 }
 
+def get_service_instances(service_name: str) -> list:
+    """
+    获取服务的所有实例配置，每项包含id、host、port和可选的gpu
+    只有一个实例时id与服务名相同
+    """
+    service = SERVICES.get(service_name)
+    if not service:
+        return []
+    instances = service.get("instances") or [{}]
+    result = []
+    for i, instance in enumerate(instances):
+        merged = {"host": service["host"], "port": service["port"], **instance}
+        merged["id"] = service_name if len(instances) == 1 else f"{service_name}-{i}"
+        result.append(merged)
+    return result
+
 # 获取内部服务URL
+def get_service_urls(service_name: str) -> list:
+    """获取内部服务所有实例的完整URL"""
+    return [f"http://{i['host']}:{i['port']}" for i in get_service_instances(service_name)]
+
 def get_service_url(service_name: str) -> str:
-    """获取内部服务的完整URL"""
-    service = SERVICES.get(service_name)
-    if service:
-        return f"http://{service['host']}:{service['port']}"
-    return None
+    """获取内部服务第一个实例的完整URL"""
+    urls = get_service_urls(service_name)
+    return urls[0] if urls else None
 
 GPT_SOVITS_URL = get_service_url("gpt_sovits")
 MUSETALK_URL = get_service_url("musetalk")
+# 逗号分隔的全部实例地址，可直接作为主服务的 GPT_SOVITS_API_URL / MUSETALK_API_URL
+GPT_SOVITS_URLS = ",".join(get_service_urls("gpt_sovits"))
+MUSETALK_URLS = ",".join(get_service_urls("musetalk"))
 
 # 超时配置
 REQUEST_TIMEOUT = 300  # 5分钟
 HEALTH_CHECK_INTERVAL = 30  # 30秒
 SERVICE_START_TIMEOUT = 60  # 1分钟
 
+# 服务管理器暴露Prometheus指标（实例可用性、健康检查耗时、重启次数）的端口，默认0为不暴露
+SERVICE_METRICS_PORT = int(os.getenv("SERVICE_METRICS_PORT", "0"))
+
 # 任务配置
 MAX_CONCURRENT_TASKS = 5
-TASK_CLEANUP_INTERVAL = 3600  # 1小时清理一次过期任务
-TASK_EXPIRE_TIME = 86400  # 任务结果保留24小时
\ No newline at end of file
+# 与主服务的同名环境变量一致，由主服务的磁盘清理执行
+TASK_CLEANUP_INTERVAL = int(os.getenv("TASK_CLEANUP_INTERVAL", "3600"))  # 1小时清理一次过期任务
+TASK_EXPIRE_TIME = int(os.getenv("TASK_EXPIRE_TIME", "86400"))  # 任务结果保留24小时
\ No newline at end of file
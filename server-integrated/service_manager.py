@@ -3,25 +3,58 @@ import sys
 import subprocess
 import asyncio
 import aiohttp
+import time
 import psutil
-from typing import Dict, Optional
+from typing import Dict
 from datetime import datetime
 from pathlib import Path
-from config import SERVICES, LOGS_DIR, HEALTH_CHECK_INTERVAL, SERVICE_START_TIMEOUT
+from prometheus_client import REGISTRY, Counter, Histogram, start_http_server
+from prometheus_client.core import GaugeMetricFamily
+from config import (
+    SERVICES,
+    LOGS_DIR,
+    HEALTH_CHECK_INTERVAL,
+    SERVICE_START_TIMEOUT,
+    SERVICE_METRICS_PORT,
+    get_service_instances
+)
+
+HEALTH_CHECK_LATENCY = Histogram(
+    "backend_health_check_seconds", "内部服务健康检查耗时", ["service", "instance", "result"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5)
+)
+SERVICE_RESTARTS = Counter(
+    "backend_restarts_total", "内部服务被自动重启的次数", ["service", "instance"]
+)
 
 class ServiceManager:
-    """管理内部服务的启动、停止和健康检查"""
+    """管理内部服务的启动、停止和健康检查，状态和进程按实例记录"""
     
     def __init__(self):
+        # 实例id -> 状态 / 进程
         self.services_status = {}
         self.processes = {}
         self.health_check_task = None
+        self.metrics_server_started = False
+        
+    def start_metrics_server(self):
+        """在SERVICE_METRICS_PORT上暴露 /metrics，只启动一次"""
+        if SERVICE_METRICS_PORT and not self.metrics_server_started:
+            try:
+                start_http_server(SERVICE_METRICS_PORT)
+            except OSError as e:
+                # 指标只是辅助功能，端口被占用时不影响服务启动
+                print(f"服务指标端口 {SERVICE_METRICS_PORT} 启动失败: {e}")
+                return
+            self.metrics_server_started = True
+            print(f"服务指标: http://0.0.0.0:{SERVICE_METRICS_PORT}/metrics")
         
     async def start_all_services(self):
         """启动所有配置的服务"""
         print("=" * 60)
         print("启动内部服务...")
         print("=" * 60)
+        self.start_metrics_server()
         
         for service_id, service_config in SERVICES.items():
             if service_config['enabled']:
@@ -34,25 +67,41 @@ class ServiceManager:
         self.health_check_task = asyncio.create_task(self.health_check_loop())
         
     async def start_service(self, service_id: str) -> bool:
-        """启动单个服务"""
+        """启动服务的所有实例"""
         service = SERVICES.get(service_id)
         if not service:
             print(f"[错误] 未知服务: {service_id}")
             return False
         
-        print(f"[{service['name']}] 正在启动...")
+        results = [await self.start_instance(service_id, instance) for instance in get_service_instances(service_id)]
+        return all(results)
+    
+    async def start_instance(self, service_id: str, instance: dict) -> bool:
+        """启动单个实例"""
+        service = SERVICES[service_id]
+        instance_id = instance['id']
+        label = f"{service['name']}:{instance['port']}"
+        
+        print(f"[{label}] 正在启动...")
         
         # 检查端口是否被占用
-        if self.is_port_in_use(service['port']):
-            print(f"[{service['name']}] 端口 {service['port']} 已被占用，尝试连接现有服务...")
-            if await self.check_service_health(service_id):
-                print(f"[{service['name']}] 现有服务运行正常")
-                self.services_status[service_id] = "running"
+        if self.is_port_in_use(instance['port']):
+            print(f"[{label}] 端口 {instance['port']} 已被占用，尝试连接现有服务...")
+            if await self.check_instance_health(service_id, instance):
+                print(f"[{label}] 现有服务运行正常")
+                self.services_status[instance_id] = "running"
                 return True
             else:
-                print(f"[{service['name']}] 端口被占用但服务无响应")
+                print(f"[{label}] 端口被占用但服务无响应")
                 return False
         
+        # 实例的端口和显卡通过环境变量传给启动脚本
+        env = dict(os.environ)
+        if service.get('port_env'):
+            env[service['port_env']] = str(instance['port'])
+        if instance.get('gpu') is not None:
+            env['CUDA_VISIBLE_DEVICES'] = str(instance['gpu'])
+        
         # 启动服务进程
         try:
             # Windows系统
@@ -66,39 +115,41 @@ class ServiceManager:
                     if python_script.exists():
                         cmd = [sys.executable, str(python_script)]
                     else:
-                        print(f"[{service['name']}] 找不到启动脚本")
+                        print(f"[{label}] 找不到启动脚本")
                         return False
                 else:
                     cmd = [script_path]
                 
                 # 创建日志文件
-                log_file = LOGS_DIR / f"{service_id}.log"
+                log_file = LOGS_DIR / f"{instance_id}.log"
                 with open(log_file, 'w') as f:
                     process = subprocess.Popen(
                         cmd,
                         stdout=f,
                         stderr=subprocess.STDOUT,
-                        cwd=Path(script_path).parent if 'script_path' in locals() else None
+                        cwd=Path(script_path).parent if 'script_path' in locals() else None,
+                        env=env
                     )
             else:
                 # Linux/Mac系统
-                log_file = LOGS_DIR / f"{service_id}.log"
+                log_file = LOGS_DIR / f"{instance_id}.log"
                 with open(log_file, 'w') as f:
                     process = subprocess.Popen(
                         ['bash', service['start_script']],
                         stdout=f,
-                        stderr=subprocess.STDOUT
+                        stderr=subprocess.STDOUT,
+                        env=env
                     )
             
-            self.processes[service_id] = process
-            self.services_status[service_id] = "starting"
+            self.processes[instance_id] = process
+            self.services_status[instance_id] = "starting"
             
-            print(f"[{service['name']}] 进程已启动 (PID: {process.pid})")
+            print(f"[{label}] 进程已启动 (PID: {process.pid})")
             return True
             
         except Exception as e:
-            print(f"[{service['name']}] 启动失败: {e}")
-            self.services_status[service_id] = "failed"
+            print(f"[{label}] 启动失败: {e}")
+            self.services_status[instance_id] = "failed"
             return False
     
     async def stop_all_services(self):
@@ -110,37 +161,54 @@ class ServiceManager:
             self.health_check_task.cancel()
         
         # 停止所有进程
-        for service_id, process in self.processes.items():
-            service_name = SERVICES[service_id]['name']
+        for instance_id, process in self.processes.items():
             try:
                 if process.poll() is None:  # 进程还在运行
-                    print(f"[{service_name}] 正在停止...")
+                    print(f"[{instance_id}] 正在停止...")
                     process.terminate()
                     try:
                         process.wait(timeout=5)
                     except subprocess.TimeoutExpired:
                         process.kill()
-                    print(f"[{service_name}] 已停止")
+                    print(f"[{instance_id}] 已停止")
             except Exception as e:
-                print(f"[{service_name}] 停止失败: {e}")
+                print(f"[{instance_id}] 停止失败: {e}")
         
         self.processes.clear()
         self.services_status.clear()
     
     async def check_service_health(self, service_id: str) -> bool:
-        """检查服务健康状态"""
+        """检查服务健康状态，任一实例可用即视为可用"""
+        results = await asyncio.gather(
+            *(self.check_instance_health(service_id, i) for i in get_service_instances(service_id))
+        )
+        return any(results)
+    
+    async def check_instance_health(self, service_id: str, instance: dict) -> bool:
+        """检查单个实例的健康状态"""
         service = SERVICES.get(service_id)
         if not service:
             return False
         
-        url = f"http://{service['host']}:{service['port']}{service['health_endpoint']}"
+        url = f"http://{instance['host']}:{instance['port']}{service['health_endpoint']}"
         
+        start_time, healthy = time.perf_counter(), False
         try:
             async with aiohttp.ClientSession() as session:
                 async with session.get(url, timeout=aiohttp.ClientTimeout(total=5)) as resp:
-                    return resp.status == 200
+                    healthy = resp.status == 200
         except:
-            return False
+            pass
+        HEALTH_CHECK_LATENCY.labels(service_id, instance['id'], "healthy" if healthy else "unhealthy").observe(
+            time.perf_counter() - start_time
+        )
+        return healthy
+    
+    def _enabled_instances(self):
+        for service_id, service in SERVICES.items():
+            if service['enabled']:
+                for instance in get_service_instances(service_id):
+                    yield service_id, service, instance
     
     async def wait_all_services_ready(self):
         """等待所有服务就绪"""
@@ -150,14 +218,11 @@ class ServiceManager:
         while (datetime.now() - start_time).seconds < SERVICE_START_TIMEOUT:
             all_ready = True
             
-            for service_id, service in SERVICES.items():
-                if not service['enabled']:
-                    continue
-                
-                if await self.check_service_health(service_id):
-                    if self.services_status.get(service_id) != "running":
-                        print(f"[{service['name']}] ✓ 服务就绪")
-                        self.services_status[service_id] = "running"
+            for service_id, service, instance in self._enabled_instances():
+                if await self.check_instance_health(service_id, instance):
+                    if self.services_status.get(instance['id']) != "running":
+                        print(f"[{service['name']}:{instance['port']}] ✓ 服务就绪")
+                        self.services_status[instance['id']] = "running"
                 else:
                     all_ready = False
             
@@ -171,28 +236,26 @@ class ServiceManager:
         return False
     
     async def health_check_loop(self):
-        """定期健康检查"""
+        """定期健康检查，异常的实例单独重启，不影响同一服务的其他实例"""
         while True:
             try:
                 await asyncio.sleep(HEALTH_CHECK_INTERVAL)
                 
-                for service_id, service in SERVICES.items():
-                    if not service['enabled']:
-                        continue
-                    
-                    is_healthy = await self.check_service_health(service_id)
-                    current_status = self.services_status.get(service_id)
+                for service_id, service, instance in self._enabled_instances():
+                    label = f"{service['name']}:{instance['port']}"
+                    is_healthy = await self.check_instance_health(service_id, instance)
+                    current_status = self.services_status.get(instance['id'])
                     
                     if is_healthy and current_status != "running":
-                        print(f"[{service['name']}] 服务恢复正常")
-                        self.services_status[service_id] = "running"
+                        print(f"[{label}] 服务恢复正常")
+                        self.services_status[instance['id']] = "running"
                     elif not is_healthy and current_status == "running":
-                        print(f"[{service['name']}] 服务异常")
-                        self.services_status[service_id] = "unhealthy"
+                        print(f"[{label}] 服务异常")
+                        self.services_status[instance['id']] = "unhealthy"
                         
                         # 尝试重启服务
-                        print(f"[{service['name']}] 尝试重启...")
-                        await self.restart_service(service_id)
+                        print(f"[{label}] 尝试重启...")
+                        await self.restart_instance(service_id, instance)
                         
             except asyncio.CancelledError:
                 break
@@ -200,10 +263,16 @@ class ServiceManager:
                 print(f"[健康检查] 错误: {e}")
     
     async def restart_service(self, service_id: str):
-        """重启服务"""
+        """重启服务的所有实例"""
+        for instance in get_service_instances(service_id):
+            await self.restart_instance(service_id, instance)
+    
+    async def restart_instance(self, service_id: str, instance: dict):
+        """重启单个实例"""
+        SERVICE_RESTARTS.labels(service_id, instance['id']).inc()
         # 先停止
-        if service_id in self.processes:
-            process = self.processes[service_id]
+        if instance['id'] in self.processes:
+            process = self.processes[instance['id']]
             if process.poll() is None:
                 process.terminate()
                 try:
@@ -212,7 +281,7 @@ class ServiceManager:
                     process.kill()
         
         # 再启动
-        await self.start_service(service_id)
+        await self.start_instance(service_id, instance)
     
     def is_port_in_use(self, port: int) -> bool:
         """检查端口是否被占用"""
@@ -222,16 +291,37 @@ class ServiceManager:
         return False
     
     def get_services_status(self) -> Dict[str, dict]:
-        """获取所有服务状态"""
+        """获取所有服务状态，任一实例运行中即视为服务运行中"""
         status = {}
         for service_id, service in SERVICES.items():
+            instances = [
+                {
+                    "id": instance['id'],
+                    "port": instance['port'],
+                    "status": self.services_status.get(instance['id'], "unknown")
+                }
+                for instance in get_service_instances(service_id)
+            ]
+            running = any(i['status'] == "running" for i in instances)
             status[service_id] = {
                 "name": service['name'],
                 "port": service['port'],
-                "status": self.services_status.get(service_id, "unknown"),
-                "enabled": service['enabled']
+                "status": "running" if running else instances[0]['status'],
+                "enabled": service['enabled'],
+                "instances": instances
             }
         return status
 
+    def collect(self):
+        """Prometheus采集接口：各实例当前是否可用"""
+        up = GaugeMetricFamily("backend_up", "内部服务实例是否处于运行状态", labels=["service", "instance"])
+        for service_id, service, instance in self._enabled_instances():
+            up.add_metric(
+                [service_id, instance['id']],
+                1 if self.services_status.get(instance['id']) == "running" else 0
+            )
+        yield up
+
 # 全局服务管理器实例
-service_manager = ServiceManager()
\ No newline at end of file
+service_manager = ServiceManager()
+REGISTRY.register(service_manager)
\ No newline at end of file
@@ -0,0 +1,301 @@
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import asyncio
+import aiofiles
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional
+from fastapi import UploadFile
+from config import ASSETS_DIR, ASSET_EXPIRE_TIME, UPLOAD_EXPIRE_TIME
+
+ASSET_KINDS = ("video", "audio")
+# 各类素材允许保存的扩展名，第一个为默认值；其余扩展名（包括与元数据同名的.json）一律改用默认值
+ASSET_SUFFIXES = {
+    "video": (".mp4", ".mov", ".webm", ".mkv", ".avi"),
+    "audio": (".wav", ".mp3", ".flac", ".ogg", ".m4a")
+}
+ASSET_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+class UploadError(Exception):
+    """分块上传请求不合法，status_code为对应的HTTP状态码"""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+def asset_suffix(kind: str, filename: Optional[str]) -> str:
+    """取上传文件名的扩展名，不在白名单内时使用该类素材的默认扩展名"""
+    suffix = Path(filename or "").suffix.lower()
+    return suffix if suffix in ASSET_SUFFIXES[kind] else ASSET_SUFFIXES[kind][0]
+
+def file_sha256(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class AssetStore:
+    """按内容哈希存储参考视频和音频，相同文件只保存一份"""
+
+    def __init__(
+        self,
+        assets_dir: Path = ASSETS_DIR,
+        expire_time: int = ASSET_EXPIRE_TIME,
+        upload_expire_time: int = UPLOAD_EXPIRE_TIME
+    ):
+        self.assets_dir = Path(assets_dir)
+        self.uploads_dir = self.assets_dir / ".uploads"
+        self.expire_time = expire_time
+        self.upload_expire_time = upload_expire_time
+        self.chunk_size = 1024 * 1024
+        self._upload_locks: Dict[str, asyncio.Lock] = {}
+        self.uploads_dir.mkdir(parents=True, exist_ok=True)
+
+    def _meta_path(self, asset_id: str) -> Path:
+        return self.assets_dir / f"{asset_id}.json"
+
+    def _data_path(self, asset_id: str, suffix: str) -> Path:
+        return self.assets_dir / f"{asset_id}{suffix}"
+
+    def _read_meta(self, asset_id: str) -> Optional[dict]:
+        if not ASSET_ID_PATTERN.match(asset_id):
+            return None
+        meta_path = self._meta_path(asset_id)
+        if not meta_path.exists():
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_meta(self, asset_id: str, meta: dict):
+        tmp_path = self.assets_dir / f".{asset_id}.{uuid.uuid4().hex}.json.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, self._meta_path(asset_id))
+
+    async def save_upload(self, upload: UploadFile, kind: str) -> dict:
+        """
+        流式保存上传文件并计算哈希，已存在相同内容时直接复用
+        """
+        if kind not in ASSET_KINDS:
+            raise ValueError(f"不支持的素材类型: {kind}")
+
+        suffix = asset_suffix(kind, upload.filename)
+        tmp_path = self.assets_dir / f".upload_{uuid.uuid4().hex}.tmp"
+        digest = hashlib.sha256()
+        size = 0
+
+        try:
+            async with aiofiles.open(tmp_path, 'wb') as f:
+                while True:
+                    chunk = await upload.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    size += len(chunk)
+                    await f.write(chunk)
+
+            return self._commit(tmp_path, digest.hexdigest(), kind, upload.filename, suffix, size)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def _commit(
+        self,
+        tmp_path: Path,
+        asset_id: str,
+        kind: str,
+        filename: Optional[str],
+        suffix: str,
+        size: int
+    ) -> dict:
+        """将已写完并算好哈希的临时文件登记为素材，已存在相同内容时丢弃临时文件"""
+        meta = self._read_meta(asset_id)
+        now = time.time()
+
+        if meta and self._data_path(asset_id, meta["suffix"]).exists():
+            tmp_path.unlink()
+            meta["last_used_at"] = now
+            self._write_meta(asset_id, meta)
+            return {**meta, "deduplicated": True}
+
+        os.replace(tmp_path, self._data_path(asset_id, suffix))
+        meta = {
+            "asset_id": asset_id,
+            "kind": kind,
+            "filename": filename,
+            "suffix": suffix,
+            "size": size,
+            "created_at": now,
+            "last_used_at": now
+        }
+        self._write_meta(asset_id, meta)
+        return {**meta, "deduplicated": False}
+
+    def _upload_paths(self, upload_id: str):
+        return self.uploads_dir / f"{upload_id}.part", self.uploads_dir / f"{upload_id}.json"
+
+    def create_upload(self, kind: str, filename: Optional[str], size: int) -> dict:
+        """
+        创建一个可断点续传的分块上传会话
+        """
+        if kind not in ASSET_KINDS:
+            raise UploadError(400, f"不支持的素材类型: {kind}")
+        if size <= 0:
+            raise UploadError(400, "文件大小必须大于0")
+
+        upload_id = uuid.uuid4().hex
+        part_path, meta_path = self._upload_paths(upload_id)
+        part_path.touch()
+        meta = {
+            "upload_id": upload_id,
+            "kind": kind,
+            "filename": filename,
+            "size": size,
+            "created_at": time.time()
+        }
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        return {**meta, "offset": 0}
+
+    def get_upload(self, upload_id: str) -> Optional[dict]:
+        """获取上传会话，offset为服务端已收到的字节数"""
+        if not UPLOAD_ID_PATTERN.match(upload_id):
+            return None
+        part_path, meta_path = self._upload_paths(upload_id)
+        if not meta_path.exists() or not part_path.exists():
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return {**meta, "offset": part_path.stat().st_size}
+
+    async def write_chunk(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> int:
+        """
+        从offset处追加一个分块，返回写入后的偏移
+        offset必须等于已收到的字节数；连接中断时已写入的部分保留，客户端查询偏移后续传
+        """
+        lock = self._upload_locks.setdefault(upload_id, asyncio.Lock())
+        if lock.locked():
+            raise UploadError(409, "该上传正在写入其他分块")
+
+        async with lock:
+            upload = self.get_upload(upload_id)
+            if upload is None:
+                raise UploadError(404, "上传不存在或已过期")
+            if offset != upload["offset"]:
+                raise UploadError(409, f"偏移不匹配，服务端已收到 {upload['offset']} 字节")
+
+            part_path, _ = self._upload_paths(upload_id)
+            written = offset
+            async with aiofiles.open(part_path, 'ab') as f:
+                async for chunk in chunks:
+                    if written + len(chunk) > upload["size"]:
+                        raise UploadError(413, "写入数据超过声明的文件大小")
+                    await f.write(chunk)
+                    written += len(chunk)
+            return written
+
+    async def finalize_upload(self, upload_id: str, sha256: str) -> dict:
+        """
+        校验完整性并将上传转为素材
+        """
+        lock = self._upload_locks.setdefault(upload_id, asyncio.Lock())
+        async with lock:
+            upload = self.get_upload(upload_id)
+            if upload is None:
+                raise UploadError(404, "上传不存在或已过期")
+            if upload["offset"] != upload["size"]:
+                raise UploadError(409, f"上传未完成: {upload['offset']}/{upload['size']}")
+
+            part_path, meta_path = self._upload_paths(upload_id)
+            asset_id = await asyncio.to_thread(file_sha256, part_path)
+            if asset_id != sha256.lower():
+                # 数据已损坏，无法续传，只能重新上传
+                self.abort_upload(upload_id)
+                raise UploadError(422, "文件哈希校验失败，请重新上传")
+
+            suffix = asset_suffix(upload["kind"], upload["filename"])
+            meta = self._commit(part_path, asset_id, upload["kind"], upload["filename"], suffix, upload["size"])
+            meta_path.unlink(missing_ok=True)
+        self._upload_locks.pop(upload_id, None)
+        return meta
+
+    def abort_upload(self, upload_id: str) -> bool:
+        """放弃上传并删除已收到的数据"""
+        if not UPLOAD_ID_PATTERN.match(upload_id):
+            return False
+        part_path, meta_path = self._upload_paths(upload_id)
+        existed = meta_path.exists()
+        part_path.unlink(missing_ok=True)
+        meta_path.unlink(missing_ok=True)
+        self._upload_locks.pop(upload_id, None)
+        return existed
+
+    def get(self, asset_id: str) -> Optional[dict]:
+        """获取素材元数据"""
+        return self._read_meta(asset_id)
+
+    def resolve(self, asset_id: str, kind: str) -> Optional[Path]:
+        """
+        获取素材文件路径并刷新最近使用时间，不存在或类型不符时返回None
+        """
+        meta = self._read_meta(asset_id)
+        if not meta or meta["kind"] != kind:
+            return None
+        data_path = self._data_path(asset_id, meta["suffix"])
+        if not data_path.exists():
+            return None
+        meta["last_used_at"] = time.time()
+        self._write_meta(asset_id, meta)
+        return data_path
+
+    def delete(self, asset_id: str) -> bool:
+        """删除素材"""
+        meta = self._read_meta(asset_id)
+        if not meta:
+            return False
+        self._data_path(asset_id, meta["suffix"]).unlink(missing_ok=True)
+        self._meta_path(asset_id).unlink(missing_ok=True)
+        return True
+
+    def cleanup_expired(self) -> int:
+        """
+        删除超过保留时间未被使用的素材，返回释放的字节数
+        """
+        reclaimed = 0
+        deadline = time.time() - self.expire_time
+        for meta_path in self.assets_dir.glob("*.json"):
+            asset_id = meta_path.stem
+            meta = self._read_meta(asset_id)
+            if meta and meta["last_used_at"] < deadline:
+                reclaimed += meta["size"]
+                self.delete(asset_id)
+
+        # 长时间没有新数据的分块上传视为已放弃
+        upload_deadline = time.time() - self.upload_expire_time
+        for part_path in self.uploads_dir.glob("*.part"):
+            if part_path.stat().st_mtime < upload_deadline:
+                reclaimed += part_path.stat().st_size
+                self.abort_upload(part_path.stem)
+        return reclaimed
+
+    async def cleanup_loop(self, interval: int):
+        """定期清理过期素材"""
+        while True:
+            try:
+                await asyncio.sleep(interval)
+                reclaimed = await asyncio.to_thread(self.cleanup_expired)
+                if reclaimed:
+                    print(f"[素材清理] 释放 {reclaimed} 字节")
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"[素材清理] 错误: {e}")
+
+# 全局素材存储实例
+asset_store = AssetStore()
@@ -0,0 +1,74 @@
+import os
+import wave
+import struct
+import numpy as np
+from typing import List
+
+# 每个样本字节数 -> numpy类型，WAV为小端序，8位为无符号数，其余为有符号数
+SAMPLE_DTYPES = {1: np.dtype("u1"), 2: np.dtype("<i2"), 4: np.dtype("<i4")}
+
+def fix_wav_sizes(path: str):
+    """
+    流式接收的WAV头中RIFF和data块长度是占位值（通常为0xFFFFFFFF），
+    接收完成后按实际文件大小改写，使wave等按长度读取的工具能正确解析
+    """
+    file_size = os.path.getsize(path)
+    with open(path, 'r+b') as f:
+        riff, _, wave_id = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave_id != b"WAVE":
+            raise Exception(f"不是有效的WAV文件: {path}")
+        offset = 12
+        while offset + 8 <= file_size:
+            f.seek(offset)
+            chunk_id, chunk_size = struct.unpack("<4sI", f.read(8))
+            if chunk_id == b"data":
+                # data块之后不应再有其他块，其长度即为剩余的全部字节（按样本帧对齐由读取方处理）
+                data_size = file_size - offset - 8
+                if chunk_size != data_size:
+                    f.seek(offset + 4)
+                    f.write(struct.pack("<I", data_size))
+                    f.seek(4)
+                    f.write(struct.pack("<I", file_size - 8))
+                return
+            # 块长度为奇数时有一个填充字节
+            offset += 8 + chunk_size + (chunk_size & 1)
+        raise Exception(f"WAV文件缺少data块: {path}")
+
+def read_wav(path: str):
+    """读取WAV文件，返回(参数, 样本数组)"""
+    with wave.open(path, 'rb') as f:
+        params = f.getparams()
+        frames = f.readframes(params.nframes)
+    dtype = SAMPLE_DTYPES.get(params.sampwidth)
+    if dtype is None:
+        raise Exception(f"不支持的WAV样本宽度: {params.sampwidth * 8}位 ({path})")
+    return params, np.frombuffer(frames, dtype=dtype)
+
+def concat_wavs(paths: List[str], output_path: str, silence: float = 0.0):
+    """
+    按顺序拼接多个WAV文件，相邻两段之间插入silence秒静音
+    各文件的采样率、声道数和样本宽度必须一致
+    """
+    params, first = read_wav(paths[0])
+    parts = [first]
+    for path in paths[1:]:
+        other, samples = read_wav(path)
+        if (other.framerate, other.nchannels, other.sampwidth) != (params.framerate, params.nchannels, params.sampwidth):
+            raise Exception(
+                f"WAV格式不一致，无法拼接: {params.framerate}Hz/{params.nchannels}声道 与 "
+                f"{other.framerate}Hz/{other.nchannels}声道 ({path})"
+            )
+        parts.append(samples)
+
+    if silence > 0 and len(parts) > 1:
+        dtype = parts[0].dtype
+        # 8位样本的静音值是中点128
+        zero = 128 if dtype == SAMPLE_DTYPES[1] else 0
+        gap = np.full(int(round(silence * params.framerate)) * params.nchannels, zero, dtype=dtype)
+        parts = [piece for part in parts for piece in (part, gap)][:-1]
+
+    with wave.open(output_path, 'wb') as f:
+        f.setnchannels(params.nchannels)
+        f.setsampwidth(params.sampwidth)
+        f.setframerate(params.framerate)
+        f.writeframes(np.concatenate(parts).tobytes())
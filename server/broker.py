@@ -0,0 +1,236 @@
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+from config import JOB_BROKER_DEFAULT_PATH
+
+class Lease:
+    """工作进程领取到的任务，租约到期前需要续期"""
+
+    def __init__(self, job_id: str, payload: dict, priority: int, attempts: int, enqueued_at: float, worker_id: str):
+        self.job_id = job_id
+        self.payload = payload
+        self.priority = priority
+        self.attempts = attempts
+        self.enqueued_at = enqueued_at
+        self.worker_id = worker_id
+
+class Broker:
+    """
+    任务代理接口：API进程入队，工作进程以租约方式领取
+    工作进程需在租约到期前续期，失联（租约过期）的任务会重新投递给其他工作进程
+    其他实现（如基于Redis）实现以下方法并注册到BROKERS即可通过JOB_BROKER_URL选用
+    """
+
+    def enqueue(self, job_id: str, payload: dict, priority: int):
+        """加入队列，priority越小越先被领取"""
+        raise NotImplementedError
+
+    def claim(self, worker_id: str, lease_time: float) -> Optional[Lease]:
+        """领取一个待执行或租约已过期的任务，没有时返回None"""
+        raise NotImplementedError
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_time: float) -> bool:
+        """续期租约，任务已被取消或已被其他工作进程领取时返回False"""
+        raise NotImplementedError
+
+    def ack(self, job_id: str, worker_id: str):
+        """任务执行结束（无论成功失败），从队列中删除"""
+        raise NotImplementedError
+
+    def release(self, job_id: str, worker_id: str):
+        """放弃租约，任务立即回到队列等待重新领取"""
+        raise NotImplementedError
+
+    def cancel(self, job_id: str) -> bool:
+        """删除任务，返回任务是否尚未开始执行；执行中的任务由工作进程在续期失败时停止"""
+        raise NotImplementedError
+
+    def position(self, job_id: str) -> Optional[int]:
+        """排队位置（从1开始），执行中或不存在时返回None"""
+        raise NotImplementedError
+
+    def depth_by_priority(self) -> Dict[int, int]:
+        """各优先级排队中的任务数"""
+        raise NotImplementedError
+
+    def running(self) -> int:
+        """持有有效租约的任务数"""
+        raise NotImplementedError
+
+    def avg_duration(self) -> Optional[float]:
+        """近期任务执行耗时的移动平均，用于估算Retry-After"""
+        raise NotImplementedError
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    enqueued_at REAL NOT NULL,
+    worker_id TEXT,
+    lease_until REAL,
+    claimed_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_order ON jobs (priority, seq);
+CREATE TABLE IF NOT EXISTS broker_stats (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+# 未被领取或租约已过期的任务都视为排队中
+QUEUED = "(worker_id IS NULL OR lease_until < ?)"
+
+class SQLiteBroker(Broker):
+    """
+    基于SQLite（WAL模式）的任务代理，适用于API和工作进程在同一台机器或共享本地磁盘的部署
+    SQLite不适合放在网络文件系统上，跨机器部署时应实现基于网络服务的代理
+    """
+
+    def __init__(self, db_path: Path = JOB_BROKER_DEFAULT_PATH):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(self.db_path),
+            timeout=30,
+            check_same_thread=False,
+            isolation_level=None
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=30000")
+        self._conn.executescript(SCHEMA)
+
+    def enqueue(self, job_id: str, payload: dict, priority: int):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, payload, priority, enqueued_at) VALUES (?, ?, ?, ?)",
+                (job_id, json.dumps(payload, ensure_ascii=False), priority, time.time())
+            )
+
+    def claim(self, worker_id: str, lease_time: float) -> Optional[Lease]:
+        now = time.time()
+        with self._lock:
+            # 立即获取写锁，多个工作进程不会领取到同一个任务
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    f"SELECT * FROM jobs WHERE {QUEUED} ORDER BY priority, seq LIMIT 1", (now,)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET worker_id = ?, lease_until = ?, claimed_at = ?, attempts = attempts + 1 "
+                        "WHERE seq = ?",
+                        (worker_id, now + lease_time, now, row["seq"])
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return Lease(
+            row["job_id"],
+            json.loads(row["payload"]),
+            row["priority"],
+            row["attempts"] + 1,
+            row["enqueued_at"],
+            worker_id
+        )
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_time: float) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE job_id = ? AND worker_id = ?",
+                (time.time() + lease_time, job_id, worker_id)
+            )
+        return cursor.rowcount > 0
+
+    def ack(self, job_id: str, worker_id: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT claimed_at FROM jobs WHERE job_id = ? AND worker_id = ?", (job_id, worker_id)
+            ).fetchone()
+            if row is None:
+                return
+            self._conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+            duration = time.time() - row["claimed_at"]
+            self._conn.execute(
+                "INSERT INTO broker_stats (name, value) VALUES ('avg_duration', ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = 0.8 * value + 0.2 * excluded.value",
+                (duration,)
+            )
+
+    def release(self, job_id: str, worker_id: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET worker_id = NULL, lease_until = NULL WHERE job_id = ? AND worker_id = ?",
+                (job_id, worker_id)
+            )
+
+    def cancel(self, job_id: str) -> bool:
+        now = time.time()
+        with self._lock:
+            queued = self._conn.execute(
+                f"SELECT 1 FROM jobs WHERE job_id = ? AND {QUEUED}", (job_id, now)
+            ).fetchone() is not None
+            self._conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        return queued
+
+    def position(self, job_id: str) -> Optional[int]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT priority, seq FROM jobs WHERE job_id = ? AND {QUEUED}", (job_id, now)
+            ).fetchone()
+            if row is None:
+                return None
+            ahead = self._conn.execute(
+                f"SELECT COUNT(*) FROM jobs WHERE {QUEUED} AND (priority < ? OR (priority = ? AND seq < ?))",
+                (now, row["priority"], row["priority"], row["seq"])
+            ).fetchone()[0]
+        return ahead + 1
+
+    def depth_by_priority(self) -> Dict[int, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT priority, COUNT(*) FROM jobs WHERE {QUEUED} GROUP BY priority", (time.time(),)
+            ).fetchall()
+        return {priority: count for priority, count in rows}
+
+    def running(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE worker_id IS NOT NULL AND lease_until >= ?", (time.time(),)
+            ).fetchone()[0]
+
+    def avg_duration(self) -> Optional[float]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM broker_stats WHERE name = 'avg_duration'"
+            ).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# URL协议 -> 代理实现
+BROKERS = {"sqlite": SQLiteBroker}
+
+def create_broker(url: str) -> Broker:
+    """
+    按URL创建任务代理: sqlite 使用默认路径，sqlite://<路径> 使用指定路径（sqlite:///data/jobs.db 为绝对路径）
+    """
+    scheme, _, location = url.partition("://")
+    broker_class = BROKERS.get(scheme)
+    if broker_class is None:
+        raise Exception(f"不支持的任务代理: {url}，可选: {', '.join(BROKERS)}")
+    return broker_class(location) if location else broker_class()
@@ -2,14 +2,103 @@ import os
 from pathlib import Path
 
 BASE_DIR = Path(__file__).parent
-TEMP_DIR = BASE_DIR.parent / "temp"
-OUTPUT_DIR = BASE_DIR.parent / "output"
+# 任务临时目录应与输出目录位于同一文件系统，成品可直接改名发布而无需复制
+TEMP_DIR = Path(os.getenv("TEMP_DIR", str(BASE_DIR.parent / "temp")))
+OUTPUT_DIR = Path(os.getenv("OUTPUT_DIR", str(BASE_DIR.parent / "output")))
 
-TEMP_DIR.mkdir(exist_ok=True)
-OUTPUT_DIR.mkdir(exist_ok=True)
+TEMP_DIR.mkdir(parents=True, exist_ok=True)
+OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-GPT_SOVITS_API_URL = os.getenv("GPT_SOVITS_API_URL", "http://localhost:9880")
-MUSETALK_API_URL = os.getenv("MUSETALK_API_URL", "http://localhost:9881")
+def _split_urls(value: str) -> list:
+    return [url.strip().rstrip("/") for url in value.split(",") if url.strip()]
+
+# 后端地址，多个副本用逗号分隔，每个请求发往在途请求最少的健康副本
+GPT_SOVITS_API_URLS = _split_urls(os.getenv("GPT_SOVITS_API_URL", "http://localhost:9880"))
+MUSETALK_API_URLS = _split_urls(os.getenv("MUSETALK_API_URL", "http://localhost:9881"))
+
+# 副本健康探测：连续失败次数达到阈值时剔除，剔除后连续成功次数达到阈值时恢复
+BACKEND_HEALTH_INTERVAL = float(os.getenv("BACKEND_HEALTH_INTERVAL", "5"))
+BACKEND_HEALTH_TIMEOUT = float(os.getenv("BACKEND_HEALTH_TIMEOUT", "3"))
+BACKEND_EJECT_FAILURES = int(os.getenv("BACKEND_EJECT_FAILURES", "2"))
+BACKEND_REINSTATE_SUCCESSES = int(os.getenv("BACKEND_REINSTATE_SUCCESSES", "2"))
+# 各后端的健康检查路径；后端没有该路径（返回404）时只要能响应即视为存活
+GPT_SOVITS_HEALTH_PATH = os.getenv("GPT_SOVITS_HEALTH_PATH", "/health")
+MUSETALK_HEALTH_PATH = os.getenv("MUSETALK_HEALTH_PATH", "/health")
 
 SERVER_HOST = "0.0.0.0"
-SERVER_PORT = 6006
\ No newline at end of file
+SERVER_PORT = 6006
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "1"))
+
+# 后端HTTP连接池配置（连接数和并发数均为每个副本的值）
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "60"))
+
+GPT_SOVITS_MAX_CONNECTIONS = int(os.getenv("GPT_SOVITS_MAX_CONNECTIONS", "8"))
+GPT_SOVITS_TIMEOUT = float(os.getenv("GPT_SOVITS_TIMEOUT", "60"))
+# 请求GPT-SoVITS流式返回音频，边生成边写入文件，不必等整段合成完才开始传输
+GPT_SOVITS_STREAMING = os.getenv("GPT_SOVITS_STREAMING", "true").lower() == "true"
+
+MUSETALK_MAX_CONNECTIONS = int(os.getenv("MUSETALK_MAX_CONNECTIONS", "4"))
+MUSETALK_TIMEOUT = float(os.getenv("MUSETALK_TIMEOUT", "300"))
+
+# 后端并发调度配置（所有任务共享）
+GPT_SOVITS_CONCURRENCY = int(os.getenv("GPT_SOVITS_CONCURRENCY", "4"))
+MUSETALK_CONCURRENCY = int(os.getenv("MUSETALK_CONCURRENCY", "2"))
+
+# 任务队列：同时处理的任务数和排队任务数上限，队列满时返回429
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_MAX_LENGTH = int(os.getenv("JOB_QUEUE_MAX_LENGTH", "100"))
+
+# 任务代理：为空时任务在API进程内执行；设置后API只负责入队，由独立的工作进程（worker.py）领取执行
+# 如 sqlite（默认路径data/jobs.db）或 sqlite:///绝对路径
+JOB_BROKER_URL = os.getenv("JOB_BROKER_URL", "")
+JOB_BROKER_DEFAULT_PATH = BASE_DIR.parent / "data" / "jobs.db"
+# 工作进程领取任务的租约时长，租约每1/3时长续期一次，工作进程失联超过租约时长后任务重新投递
+JOB_LEASE_TIME = float(os.getenv("JOB_LEASE_TIME", "60"))
+# 同一任务最多被领取的次数，超过后标记为失败，避免反复导致工作进程崩溃的任务无限重试
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# 工作进程在没有任务时查询代理的间隔秒数
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+# 工作进程单独暴露Prometheus指标的端口，0为不暴露
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "0"))
+
+# 流水线配置：已生成但尚未送入视频生成的音频段上限
+PIPELINE_BUFFER_SIZE = int(os.getenv("PIPELINE_BUFFER_SIZE", "4"))
+
+# 长文本切分：超过TTS_SPLIT_MIN_CHARS字的行在句子边界切分为不超过TTS_SPLIT_MAX_CHARS字的子句，
+# 并行合成后以TTS_SPLIT_SILENCE秒静音拼接为一段音频；切分会改变合成结果和TTS缓存键，默认关闭
+TTS_SPLIT_ENABLED = os.getenv("TTS_SPLIT_ENABLED", "false").lower() == "true"
+TTS_SPLIT_MIN_CHARS = int(os.getenv("TTS_SPLIT_MIN_CHARS", "80"))
+TTS_SPLIT_MAX_CHARS = int(os.getenv("TTS_SPLIT_MAX_CHARS", "50"))
+TTS_SPLIT_SILENCE = float(os.getenv("TTS_SPLIT_SILENCE", "0.2"))
+
+# TTS音频缓存配置
+TTS_CACHE_ENABLED = os.getenv("TTS_CACHE_ENABLED", "true").lower() == "true"
+TTS_CACHE_DIR = Path(os.getenv("TTS_CACHE_DIR", str(BASE_DIR.parent / "cache" / "tts")))
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+# 参考素材存储配置
+ASSETS_DIR = Path(os.getenv("ASSETS_DIR", str(BASE_DIR.parent / "assets")))
+ASSET_EXPIRE_TIME = int(os.getenv("ASSET_EXPIRE_TIME", str(30 * 86400)))  # 30天未使用的素材被清理
+ASSET_CLEANUP_INTERVAL = int(os.getenv("ASSET_CLEANUP_INTERVAL", "3600"))
+UPLOAD_EXPIRE_TIME = int(os.getenv("UPLOAD_EXPIRE_TIME", "86400"))  # 分块上传超过1天无新数据视为放弃
+
+# 任务状态数据库（SQLite，多个服务进程共享）
+TASK_DB_PATH = Path(os.getenv("TASK_DB_PATH", str(BASE_DIR.parent / "data" / "tasks.db")))
+
+# 渐进式HLS输出配置
+HLS_ENABLED = os.getenv("HLS_ENABLED", "true").lower() == "true"
+HLS_DIR = OUTPUT_DIR / "hls"
+
+# 任务进度推送（SSE）心跳间隔秒数，心跳时同时从任务库同步其他进程写入的状态
+TASK_EVENT_HEARTBEAT = float(os.getenv("TASK_EVENT_HEARTBEAT", "15"))
+# 使用任务代理或多个uvicorn工作进程时任务可能在其他进程中执行，收不到进程内事件，按此间隔从任务库同步状态
+TASK_EVENT_POLL_INTERVAL = float(os.getenv("TASK_EVENT_POLL_INTERVAL", "1"))
+
+# 磁盘清理：任务结束后保留结果的秒数、清理间隔、无主临时目录的保留秒数
+TASK_EXPIRE_TIME = int(os.getenv("TASK_EXPIRE_TIME", "86400"))
+TASK_CLEANUP_INTERVAL = int(os.getenv("TASK_CLEANUP_INTERVAL", "600"))
+TEMP_EXPIRE_TIME = int(os.getenv("TEMP_EXPIRE_TIME", "3600"))
+# 输出目录所在磁盘使用率超过高水位时，从最早结束的任务开始淘汰结果，直到降到低水位
+DISK_HIGH_WATERMARK = float(os.getenv("DISK_HIGH_WATERMARK", "0.9"))
+DISK_LOW_WATERMARK = float(os.getenv("DISK_LOW_WATERMARK", "0.8"))
@@ -0,0 +1,201 @@
+import os
+import re
+import tarfile
+import aiofiles
+from email.utils import formatdate
+from pathlib import Path
+from typing import AsyncIterator, List, Optional, Tuple
+from urllib.parse import quote
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+CHUNK_SIZE = 1024 * 1024
+
+def make_etag(stat: os.stat_result) -> str:
+    """由修改时间和大小生成强ETag，文件被替换后自动失效"""
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """判断If-None-Match是否命中（弱比较）"""
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in candidates or f"W/{etag}" in candidates
+
+def parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单个字节范围，返回闭区间(start, end)
+    格式不支持（如多段范围）时返回None表示忽略Range；范围无法满足时抛出ValueError
+    """
+    match = RANGE_PATTERN.match(range_header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # bytes=-N 表示最后N个字节
+        length = int(end)
+        if length == 0:
+            raise ValueError("无法满足的范围")
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError("无法满足的范围")
+    return start, end
+
+def content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted == filename:
+        return f'attachment; filename="{filename}"'
+    return f"attachment; filename*=utf-8''{quoted}"
+
+class RangeFileResponse(Response):
+    """
+    支持Range、ETag/If-None-Match和If-Range的文件响应
+    ASGI服务器支持zerocopysend扩展时通过sendfile发送，否则按大块读取
+    """
+
+    def __init__(self, path: Path, media_type: str, filename: Optional[str] = None):
+        self.path = Path(path)
+        self.media_type = media_type
+        self.filename = filename
+        self.status_code = 200
+        self.background = None
+        self.raw_headers = []
+        # 实际发送的正文字节数
+        self.sent_bytes = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await self._respond(scope, send)
+        if self.background is not None:
+            await self.background()
+
+    async def _respond(self, scope: Scope, send: Send):
+        request_headers = {
+            key.decode("latin-1").lower(): value.decode("latin-1")
+            for key, value in scope.get("headers", [])
+        }
+        stat = os.stat(self.path)
+        size = stat.st_size
+        etag = make_etag(stat)
+
+        headers = [
+            ("accept-ranges", "bytes"),
+            ("etag", etag),
+            ("last-modified", formatdate(stat.st_mtime, usegmt=True))
+        ]
+        if self.filename:
+            headers.append(("content-disposition", content_disposition(self.filename)))
+
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, etag):
+            await self._send_head(send, 304, headers)
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        status, start, end = 200, 0, size - 1
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        # If-Range不匹配说明客户端手里的是旧文件，返回完整内容
+        if range_header and (not if_range or if_range.strip() == etag):
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                await self._send_head(send, 416, headers + [
+                    ("content-range", f"bytes */{size}"),
+                    ("content-length", "0")
+                ])
+                await send({"type": "http.response.body", "body": b""})
+                return
+            if byte_range:
+                status, (start, end) = 206, byte_range
+                headers.append(("content-range", f"bytes {start}-{end}/{size}"))
+
+        length = end - start + 1 if size else 0
+        headers += [("content-type", self.media_type), ("content-length", str(length))]
+        await self._send_head(send, status, headers)
+
+        if scope.get("method") == "HEAD" or length == 0:
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f.fileno(),
+                    "offset": start,
+                    "count": length
+                })
+            self.sent_bytes = length
+            return
+
+        async with aiofiles.open(self.path, "rb") as f:
+            await f.seek(start)
+            remaining = length
+            while remaining > 0:
+                chunk = await f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+                self.sent_bytes += len(chunk)
+        if remaining > 0:
+            # 文件在发送过程中被截断
+            await send({"type": "http.response.body", "body": b""})
+
+    async def _send_head(self, send: Send, status: int, headers: List[Tuple[str, str]]):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers] + self.raw_headers
+        })
+
+class TarBundle:
+    """
+    将多个文件即时打包为不压缩的tar流，不生成临时文件，总长度可预先算出
+    """
+
+    def __init__(self, paths: List[Path]):
+        self.sent_bytes = 0
+        self.entries = []
+        for path in paths:
+            stat = os.stat(path)
+            info = tarfile.TarInfo(name=path.name)
+            info.size = stat.st_size
+            info.mtime = int(stat.st_mtime)
+            info.mode = 0o644
+            self.entries.append((path, info.tobuf(format=tarfile.GNU_FORMAT), stat.st_size))
+
+    @property
+    def content_length(self) -> int:
+        total = sum(len(header) + size + self._padding(size) for _, header, size in self.entries)
+        # 结尾为两个全零块
+        return total + 2 * tarfile.BLOCKSIZE
+
+    @staticmethod
+    def _padding(size: int) -> int:
+        return -size % tarfile.BLOCKSIZE
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        for path, header, size in self.entries:
+            yield header
+            self.sent_bytes += len(header)
+            remaining = size
+            async with aiofiles.open(path, "rb") as f:
+                while remaining > 0:
+                    chunk = await f.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        raise Exception(f"文件在打包过程中被修改: {path.name}")
+                    remaining -= len(chunk)
+                    yield chunk
+                    self.sent_bytes += len(chunk)
+            padding = self._padding(size)
+            if padding:
+                yield b"\0" * padding
+                self.sent_bytes += padding
+        yield b"\0" * (2 * tarfile.BLOCKSIZE)
+        self.sent_bytes += 2 * tarfile.BLOCKSIZE
@@ -0,0 +1,51 @@
+import json
+import asyncio
+from collections import defaultdict
+from typing import Dict, Optional, Set
+
+# 任务进入这些状态后不会再有新事件
+TERMINAL_STATUSES = ("completed", "failed")
+
+class TaskEventBus:
+    """
+    进程内的任务事件发布/订阅，每个订阅者一个有界队列
+    订阅者消费过慢时丢弃最旧的事件，不会阻塞任务处理
+    """
+
+    def __init__(self, queue_size: int = 256):
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+
+    def subscribe(self, task_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[task_id].add(queue)
+        return queue
+
+    def unsubscribe(self, task_id: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(task_id)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[task_id]
+
+    def publish(self, task_id: str, event: str, data: dict):
+        """
+        向任务的所有订阅者广播事件，必须在事件循环线程中调用
+        """
+        for queue in self._subscribers.get(task_id, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait((event, data))
+
+    def subscriber_count(self, task_id: Optional[str] = None) -> int:
+        if task_id is not None:
+            return len(self._subscribers.get(task_id, ()))
+        return sum(len(s) for s in self._subscribers.values())
+
+def format_sse(event: str, data: dict) -> str:
+    """编码为一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# 全局任务事件总线实例
+task_events = TaskEventBus()
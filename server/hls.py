@@ -0,0 +1,133 @@
+import os
+import re
+import math
+import shutil
+import asyncio
+from pathlib import Path
+from typing import Dict, List, Optional
+from config import HLS_DIR
+
+PLAYLIST_NAME = "index.m3u8"
+HLS_FILE_PATTERN = re.compile(r"^(index\.m3u8|seg_\d{5}\.ts)$")
+TASK_ID_PATTERN = re.compile(r"^[0-9a-f-]{36}$")
+
+async def probe_duration(video_path: str) -> float:
+    """使用ffprobe获取视频时长（秒）"""
+    process = await asyncio.create_subprocess_exec(
+        'ffprobe', '-v', 'error',
+        '-show_entries', 'format=duration',
+        '-of', 'default=noprint_wrappers=1:nokey=1',
+        video_path,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise Exception(f"FFprobe error: {stderr.decode()}")
+    return float(stdout.decode().strip())
+
+class HLSPublisher:
+    """为单个任务维护一个随视频段完成而增长的HLS播放列表"""
+
+    def __init__(self, task_id: str, root: Path = HLS_DIR):
+        self.task_id = task_id
+        self.task_dir = Path(root) / task_id
+        self.task_dir.mkdir(parents=True, exist_ok=True)
+        # 已转封装但尚未发布的段（前面的段还没完成），时长为None表示该段发布失败、在播放列表中跳过
+        self._ready: Dict[int, Optional[float]] = {}
+        self._published: List[Optional[float]] = []
+        self._pending: List[asyncio.Task] = []
+        self._finished = False
+        self._write_playlist()
+
+    @property
+    def playlist_path(self) -> Path:
+        return self.task_dir / PLAYLIST_NAME
+
+    def submit(self, index: int, video_path: str):
+        """
+        提交一个已生成的视频段，转封装在后台进行，不阻塞流水线
+        """
+        self._pending.append(asyncio.create_task(self._add_segment(index, video_path)))
+
+    async def _add_segment(self, index: int, video_path: str):
+        segment_path = self.task_dir / f"seg_{index:05d}.ts"
+        try:
+            # 只转封装不重新编码，耗时很短
+            process = await asyncio.create_subprocess_exec(
+                'ffmpeg', '-v', 'error',
+                '-i', video_path,
+                '-c', 'copy',
+                '-bsf:v', 'h264_mp4toannexb',
+                '-f', 'mpegts',
+                '-y',
+                str(segment_path),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            _, stderr = await process.communicate()
+            if process.returncode != 0:
+                raise Exception(f"FFmpeg error: {stderr.decode()}")
+            duration = await probe_duration(str(segment_path))
+        except Exception as e:
+            # 预览流失败不影响任务本身，记为跳过，后面的段照常发布
+            print(f"[HLS] 任务 {self.task_id} 第 {index} 段发布失败: {e}")
+            segment_path.unlink(missing_ok=True)
+            duration = None
+
+        self._ready[index] = duration
+        # 播放列表只能按顺序追加，等前面的段就绪后一并发布
+        while len(self._published) in self._ready:
+            self._published.append(self._ready.pop(len(self._published)))
+        self._write_playlist()
+
+    def _write_playlist(self):
+        target_duration = max([math.ceil(d) for d in self._published if d is not None], default=1)
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{target_duration}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+            "#EXT-X-PLAYLIST-TYPE:EVENT"
+        ]
+        first = True
+        for index, duration in enumerate(self._published):
+            if duration is None:
+                continue
+            if not first:
+                # 每段独立编码，时间戳从零开始；跳过的段前后同样不连续
+                lines.append("#EXT-X-DISCONTINUITY")
+            first = False
+            lines.append(f"#EXTINF:{duration:.3f},")
+            lines.append(f"seg_{index:05d}.ts")
+        if self._finished:
+            lines.append("#EXT-X-ENDLIST")
+
+        tmp_path = self.task_dir / f"{PLAYLIST_NAME}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.playlist_path)
+
+    async def finish(self):
+        """等待所有段发布完成并结束播放列表"""
+        await asyncio.gather(*self._pending, return_exceptions=True)
+        self._finished = True
+        self._write_playlist()
+
+    async def abort(self):
+        """任务失败时取消未完成的转封装并结束播放列表"""
+        for task in self._pending:
+            task.cancel()
+        await self.finish()
+
+def playlist_url(task_id: str) -> Optional[str]:
+    """任务存在HLS播放列表时返回其URL"""
+    if (HLS_DIR / task_id / PLAYLIST_NAME).exists():
+        return f"/hls/{task_id}/{PLAYLIST_NAME}"
+    return None
+
+def remove_task_hls(task_id: str):
+    """删除任务的HLS文件"""
+    if not TASK_ID_PATTERN.match(task_id):
+        return
+    shutil.rmtree(HLS_DIR / task_id, ignore_errors=True)
@@ -0,0 +1,72 @@
+import aiohttp
+from typing import Dict, Optional
+from config import (
+    GPT_SOVITS_API_URLS,
+    MUSETALK_API_URLS,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_KEEPALIVE_TIMEOUT,
+    GPT_SOVITS_MAX_CONNECTIONS,
+    GPT_SOVITS_TIMEOUT,
+    MUSETALK_MAX_CONNECTIONS,
+    MUSETALK_TIMEOUT
+)
+
+# 各后端的连接池配置
+BACKENDS = {
+    "gpt_sovits": {
+        "max_connections": GPT_SOVITS_MAX_CONNECTIONS,
+        "replicas": len(GPT_SOVITS_API_URLS),
+        "timeout": GPT_SOVITS_TIMEOUT
+    },
+    "musetalk": {
+        "max_connections": MUSETALK_MAX_CONNECTIONS,
+        "replicas": len(MUSETALK_API_URLS),
+        "timeout": MUSETALK_TIMEOUT
+    }
+}
+
+class BackendClients:
+    """管理各后端服务共享的长连接HTTP会话"""
+
+    def __init__(self):
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+
+    def _create_session(self, backend: str) -> aiohttp.ClientSession:
+        """为单个后端创建带连接池的会话"""
+        backend_config = BACKENDS[backend]
+        # 每个副本各自的连接上限，总上限随副本数增加
+        connector = aiohttp.TCPConnector(
+            limit=backend_config["max_connections"] * backend_config["replicas"],
+            limit_per_host=backend_config["max_connections"],
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=backend_config["timeout"],
+            connect=HTTP_CONNECT_TIMEOUT
+        )
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def start(self):
+        """应用启动时创建所有后端会话"""
+        for backend in BACKENDS:
+            self.get(backend)
+
+    def get(self, backend: str) -> aiohttp.ClientSession:
+        """
+        获取后端会话，未创建或已关闭时自动创建
+        """
+        session: Optional[aiohttp.ClientSession] = self._sessions.get(backend)
+        if session is None or session.closed:
+            session = self._create_session(backend)
+            self._sessions[backend] = session
+        return session
+
+    async def close(self):
+        """应用关闭时释放所有连接"""
+        for session in self._sessions.values():
+            if not session.closed:
+                await session.close()
+        self._sessions.clear()
+
+# 全局后端HTTP客户端实例
+http_clients = BackendClients()
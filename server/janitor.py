@@ -0,0 +1,189 @@
+import time
+import shutil
+import asyncio
+from pathlib import Path
+from typing import Dict
+from config import (
+    TEMP_DIR,
+    OUTPUT_DIR,
+    HLS_DIR,
+    TASK_EXPIRE_TIME,
+    TEMP_EXPIRE_TIME,
+    DISK_HIGH_WATERMARK,
+    DISK_LOW_WATERMARK
+)
+from task_store import task_store
+from events import TERMINAL_STATUSES
+from hls import TASK_ID_PATTERN, remove_task_hls
+from metrics import RECLAIMED_BYTES
+
+def path_size(path: Path) -> int:
+    """文件或目录占用的字节数，不存在时为0"""
+    try:
+        if path.is_dir():
+            return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+def remove_path(path: Path) -> int:
+    """删除文件或目录并返回释放的字节数"""
+    size = path_size(path)
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+    return size
+
+def disk_usage_ratio(path: Path) -> float:
+    """path所在磁盘的使用率（按可用空间计算，包含保留块）"""
+    usage = shutil.disk_usage(path)
+    return 1 - usage.free / usage.total
+
+class Janitor:
+    """
+    服务端磁盘清理：删除过期任务的结果、无主的临时目录和残留的临时文件，
+    磁盘使用率超过高水位时从最早结束的任务开始淘汰结果，直到降到低水位
+    """
+
+    def __init__(
+        self,
+        expire_time: int = TASK_EXPIRE_TIME,
+        temp_expire_time: int = TEMP_EXPIRE_TIME,
+        high_watermark: float = DISK_HIGH_WATERMARK,
+        low_watermark: float = DISK_LOW_WATERMARK
+    ):
+        self.expire_time = expire_time
+        self.temp_expire_time = temp_expire_time
+        self.high_watermark = high_watermark
+        self.low_watermark = min(low_watermark, high_watermark)
+
+    def remove_task(self, task_id: str) -> int:
+        """
+        删除任务的结果文件、HLS文件和任务记录，返回释放的字节数
+        临时目录可能仍被处理中的任务使用，留给无主临时目录清理
+        """
+        reclaimed = 0
+        for file in OUTPUT_DIR.glob(f"{task_id}_*"):
+            reclaimed += remove_path(file)
+        reclaimed += path_size(HLS_DIR / task_id)
+        remove_task_hls(task_id)
+        task_store.delete(task_id)
+        return reclaimed
+
+    def _expire_tasks(self, report: dict):
+        # 排队或执行中的任务可能仍在运行，只清理已结束的，避免任务记录删除后继续发布无主文件
+        for task_id in task_store.expired_ids(time.time() - self.expire_time, TERMINAL_STATUSES):
+            report["expired_tasks"] += 1
+            self._count(report, "expired", self.remove_task(task_id))
+
+    def _sweep_orphans(self, report: dict):
+        """
+        清理没有任务记录的结果文件和HLS目录（如任务库丢失），
+        以及不属于进行中任务的临时目录和写了一半的临时文件
+        """
+        now = time.time()
+        states: Dict[str, str] = {}
+
+        def task_state(task_id: str) -> str:
+            if task_id not in states:
+                task = task_store.get(task_id)
+                if task is None:
+                    states[task_id] = "missing"
+                elif task["status"] in TERMINAL_STATUSES:
+                    states[task_id] = "finished"
+                else:
+                    states[task_id] = "active"
+            return states[task_id]
+
+        def age(path: Path) -> float:
+            try:
+                return now - path.stat().st_mtime
+            except FileNotFoundError:
+                return 0
+
+        for path in OUTPUT_DIR.iterdir():
+            if not path.is_file():
+                continue
+            if path.name.startswith(".") and path.name.endswith(".tmp"):
+                # 发布或合并中途退出留下的临时文件
+                if age(path) > self.temp_expire_time:
+                    report["stale_files"] += 1
+                    self._count(report, "stale_file", remove_path(path))
+                continue
+            task_id = path.name[:36]
+            if TASK_ID_PATTERN.match(task_id) and age(path) > self.expire_time and task_state(task_id) == "missing":
+                report["stale_files"] += 1
+                self._count(report, "expired", remove_path(path))
+
+        if HLS_DIR.exists():
+            for path in HLS_DIR.iterdir():
+                if TASK_ID_PATTERN.match(path.name) and age(path) > self.expire_time and task_state(path.name) == "missing":
+                    self._count(report, "expired", remove_path(path))
+
+        for path in TEMP_DIR.iterdir():
+            if not TASK_ID_PATTERN.match(path.name) or age(path) <= self.temp_expire_time:
+                continue
+            # 进行中的任务可能长时间不修改目录本身，只清理已结束或没有记录的
+            if task_state(path.name) != "active":
+                report["temp_dirs"] += 1
+                self._count(report, "orphan_temp", remove_path(path))
+
+    def _enforce_watermark(self, report: dict):
+        usage = disk_usage_ratio(OUTPUT_DIR)
+        if usage < self.high_watermark:
+            return
+        print(f"[磁盘清理] 磁盘使用率 {usage:.1%} 超过高水位 {self.high_watermark:.0%}，开始淘汰最早的任务结果")
+        while usage > self.low_watermark:
+            task_ids = task_store.finished_ids(TERMINAL_STATUSES, limit=50)
+            if not task_ids:
+                print(f"[磁盘清理] 已无可淘汰的任务结果，磁盘使用率仍为 {usage:.1%}")
+                break
+            for task_id in task_ids:
+                report["evicted_tasks"] += 1
+                self._count(report, "evicted", self.remove_task(task_id))
+                usage = disk_usage_ratio(OUTPUT_DIR)
+                if usage <= self.low_watermark:
+                    break
+
+    def _count(self, report: dict, reason: str, reclaimed: int):
+        report["reclaimed_bytes"] += reclaimed
+        RECLAIMED_BYTES.labels(reason).inc(reclaimed)
+
+    def run_once(self) -> dict:
+        """
+        执行一轮清理，返回清理报告
+        """
+        report = {
+            "expired_tasks": 0,
+            "evicted_tasks": 0,
+            "temp_dirs": 0,
+            "stale_files": 0,
+            "reclaimed_bytes": 0
+        }
+        self._expire_tasks(report)
+        self._sweep_orphans(report)
+        self._enforce_watermark(report)
+        report["disk_usage"] = round(disk_usage_ratio(OUTPUT_DIR), 4)
+        return report
+
+    async def cleanup_loop(self, interval: int):
+        """启动时立即清理一次，之后定期清理"""
+        while True:
+            try:
+                report = await asyncio.to_thread(self.run_once)
+                if report["reclaimed_bytes"]:
+                    print(
+                        f"[磁盘清理] 释放 {report['reclaimed_bytes']} 字节: 过期任务 {report['expired_tasks']} 个, "
+                        f"淘汰任务 {report['evicted_tasks']} 个, 临时目录 {report['temp_dirs']} 个, "
+                        f"残留文件 {report['stale_files']} 个; 磁盘使用率 {report['disk_usage']:.1%}"
+                    )
+                await asyncio.sleep(interval)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"[磁盘清理] 错误: {e}")
+                await asyncio.sleep(interval)
+
+# 全局磁盘清理实例
+janitor = Janitor()
@@ -0,0 +1,252 @@
+import math
+import time
+import heapq
+import asyncio
+import itertools
+from typing import Awaitable, Callable, Dict, List, Optional
+from config import JOB_WORKERS, JOB_QUEUE_MAX_LENGTH, JOB_BROKER_URL
+from broker import Broker, create_broker
+from metrics import QUEUE_WAIT
+
+# 优先级名称 -> 数值，越小越先执行
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+DEFAULT_PRIORITY = "normal"
+
+class QueueFull(Exception):
+    """队列已满，retry_after为建议的重试等待秒数"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"任务队列已满，请 {retry_after} 秒后重试")
+        self.retry_after = retry_after
+
+# 任务执行函数，参数为提交时的payload
+Handler = Callable[[dict], Awaitable]
+
+def priority_name(value: int) -> str:
+    return next((name for name, v in PRIORITIES.items() if v == value), DEFAULT_PRIORITY)
+
+def estimate_retry_after(avg_duration: Optional[float], excess: int, workers: int) -> int:
+    """按平均耗时估算队列腾出excess个位置所需的秒数"""
+    avg = avg_duration if avg_duration is not None else 30.0
+    return max(1, math.ceil(avg * excess / max(1, workers)))
+
+class Job:
+    def __init__(self, task_id: str, priority: str, payload: dict):
+        self.task_id = task_id
+        self.priority = priority
+        self.payload = payload
+        self.submitted_at = time.time()
+        # 开始执行后为执行该任务的asyncio任务，删除任务时用于取消
+        self.task: Optional[asyncio.Task] = None
+        self.cancelled = False
+
+class JobQueue:
+    """
+    进程内的有界优先级任务队列，固定数量的工作协程按优先级、同优先级按提交顺序执行任务
+    队列满时拒绝新任务，过载时同时执行的任务数保持不变，不会因全部同时启动而一起超时
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, max_length: int = JOB_QUEUE_MAX_LENGTH):
+        self.workers = max(1, workers)
+        self.max_length = max_length
+        self.running: Dict[str, Job] = {}
+        self._heap: List[tuple] = []
+        self._pending: Dict[str, Job] = {}
+        self._counter = itertools.count()
+        # 在start()中创建，确保绑定到服务运行的事件循环
+        self._available: Optional[asyncio.Condition] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._handler: Optional[Handler] = None
+        # 任务执行耗时的指数移动平均，用于估算Retry-After
+        self._avg_duration: Optional[float] = None
+
+    @property
+    def length(self) -> int:
+        """排队中（尚未开始）的任务数"""
+        return len(self._pending)
+
+    def retry_after(self) -> int:
+        return estimate_retry_after(self._avg_duration, self.length - self.max_length + 1, self.workers)
+
+    async def ensure_capacity(self):
+        """队列已满时抛出QueueFull"""
+        if self.length >= self.max_length:
+            raise QueueFull(self.retry_after())
+
+    async def submit(self, task_id: str, payload: dict, priority: str = DEFAULT_PRIORITY) -> int:
+        """
+        提交任务并返回排队位置（从1开始），队列已满时抛出QueueFull
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"未知的优先级: {priority}")
+        await self.ensure_capacity()
+
+        job = Job(task_id, priority, payload)
+        self._pending[task_id] = job
+        heapq.heappush(self._heap, (PRIORITIES[priority], next(self._counter), job))
+        async with self._available:
+            self._available.notify()
+        return self._position(task_id)
+
+    async def position(self, task_id: str) -> Optional[int]:
+        """
+        任务在队列中的位置（从1开始），已开始执行或不在本进程队列中时返回None
+        """
+        return self._position(task_id)
+
+    def _position(self, task_id: str) -> Optional[int]:
+        job = self._pending.get(task_id)
+        if job is None:
+            return None
+        key = next(entry[:2] for entry in self._heap if entry[2] is job)
+        return 1 + sum(1 for entry in self._heap if entry[:2] < key)
+
+    async def cancel(self, task_id: str) -> bool:
+        """
+        从队列中移除尚未开始的任务，或取消执行中的任务并等待其退出
+        返回True表示任务之后不会再使用其临时目录
+        """
+        job = self._pending.pop(task_id, None)
+        if job is not None:
+            # 从堆中一并移除，避免反复提交又删除的任务在堆中堆积
+            self._heap = [entry for entry in self._heap if entry[2] is not job]
+            heapq.heapify(self._heap)
+            return True
+        job = self.running.get(task_id)
+        if job is None or job.task is None:
+            return False
+        job.cancelled = True
+        job.task.cancel()
+        await asyncio.wait({job.task})
+        return True
+
+    async def _next_job(self) -> Job:
+        async with self._available:
+            while True:
+                if self._heap:
+                    _, _, job = heapq.heappop(self._heap)
+                    del self._pending[job.task_id]
+                    return job
+                await self._available.wait()
+
+    async def _worker(self):
+        while True:
+            job = await self._next_job()
+            QUEUE_WAIT.labels(job.priority).observe(time.time() - job.submitted_at)
+            self.running[job.task_id] = job
+            start_time = time.perf_counter()
+            # 任务在独立的asyncio任务中执行，删除任务时只取消该任务，工作协程继续领取下一个
+            job.task = asyncio.create_task(self._handler(job.payload))
+            try:
+                await job.task
+            except asyncio.CancelledError:
+                if not job.cancelled:
+                    raise
+                print(f"[任务队列] 任务 {job.task_id} 已删除，停止执行")
+            except Exception as e:
+                print(f"[任务队列] 任务 {job.task_id} 异常: {e}")
+            finally:
+                del self.running[job.task_id]
+                duration = time.perf_counter() - start_time
+                self._avg_duration = duration if self._avg_duration is None else 0.8 * self._avg_duration + 0.2 * duration
+
+    def start(self, handler: Handler):
+        """启动工作协程，handler(payload)执行单个任务"""
+        if not self._worker_tasks:
+            self._handler = handler
+            self._available = asyncio.Condition()
+            self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> List[str]:
+        """
+        停止工作协程，返回尚未开始和执行被中断的任务，由调用方标记状态
+        """
+        abandoned = list(self._pending) + list(self.running)
+        for worker in self._worker_tasks:
+            worker.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._pending.clear()
+        self._heap.clear()
+        self.running.clear()
+        return abandoned
+
+    def depth_by_priority(self) -> Dict[str, int]:
+        """各优先级排队中的任务数"""
+        depth = {name: 0 for name in PRIORITIES}
+        for job in self._pending.values():
+            depth[job.priority] += 1
+        return depth
+
+    def get_status(self) -> dict:
+        return {
+            "mode": "local",
+            "workers": self.workers,
+            "running": len(self.running),
+            "queued": self.length,
+            "max_length": self.max_length,
+            "avg_duration": self._avg_duration
+        }
+
+class BrokerJobQueue:
+    """
+    API进程一侧的任务队列：只负责入队和查询，任务由独立的工作进程（worker.py）从代理领取执行
+    队列保存在代理中，API进程重启不影响排队和执行中的任务
+    """
+
+    def __init__(self, broker: Broker, max_length: int = JOB_QUEUE_MAX_LENGTH):
+        self.broker = broker
+        self.max_length = max_length
+
+    @property
+    def length(self) -> int:
+        return sum(self.broker.depth_by_priority().values())
+
+    def retry_after(self) -> int:
+        # 无法得知工作进程总数，以当前执行中的任务数近似处理能力
+        return estimate_retry_after(
+            self.broker.avg_duration(), self.length - self.max_length + 1, self.broker.running()
+        )
+
+    async def submit(self, task_id: str, payload: dict, priority: str = DEFAULT_PRIORITY) -> int:
+        if priority not in PRIORITIES:
+            raise ValueError(f"未知的优先级: {priority}")
+        await self.ensure_capacity()
+        await asyncio.to_thread(self.broker.enqueue, task_id, payload, PRIORITIES[priority])
+        return await asyncio.to_thread(self.broker.position, task_id)
+
+    async def ensure_capacity(self):
+        # 查询代理会访问数据库，放到线程中执行，不阻塞事件循环
+        if await asyncio.to_thread(lambda: self.length) >= self.max_length:
+            raise QueueFull(await asyncio.to_thread(self.retry_after))
+
+    async def position(self, task_id: str) -> Optional[int]:
+        return await asyncio.to_thread(self.broker.position, task_id)
+
+    async def cancel(self, task_id: str) -> bool:
+        """执行中的任务由工作进程在下次续租失败时自行取消"""
+        return await asyncio.to_thread(self.broker.cancel, task_id)
+
+    def start(self, handler: Handler):
+        """任务由工作进程执行，API进程内不启动工作协程"""
+
+    async def stop(self) -> List[str]:
+        return []
+
+    def depth_by_priority(self) -> Dict[str, int]:
+        depth = {name: 0 for name in PRIORITIES}
+        for value, count in self.broker.depth_by_priority().items():
+            depth[priority_name(value)] += count
+        return depth
+
+    def get_status(self) -> dict:
+        return {
+            "mode": "broker",
+            "running": self.broker.running(),
+            "queued": self.length,
+            "max_length": self.max_length,
+            "avg_duration": self.broker.avg_duration()
+        }
+
+# 全局任务队列实例：配置了任务代理时由独立的工作进程执行任务
+job_queue = BrokerJobQueue(create_broker(JOB_BROKER_URL)) if JOB_BROKER_URL else JobQueue()
@@ -1,18 +1,38 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Request
+from fastapi.responses import FileResponse, StreamingResponse, Response
+from starlette.background import BackgroundTask
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
 import os
 import uuid
 from pathlib import Path
+import time
 import shutil
 import asyncio
+import aiofiles
 from datetime import datetime
 
-from config import SERVER_HOST, SERVER_PORT, TEMP_DIR, OUTPUT_DIR
-from tts_service import TTSService
-from video_service import VideoService
+from config import (
+    SERVER_HOST, SERVER_PORT, SERVER_WORKERS, TEMP_DIR, OUTPUT_DIR,
+    ASSET_CLEANUP_INTERVAL, HLS_DIR, TASK_EVENT_HEARTBEAT,
+    TASK_EVENT_POLL_INTERVAL, TASK_CLEANUP_INTERVAL, JOB_BROKER_URL
+)
+from http_client import http_clients
+from asset_store import asset_store, UploadError
+from task_store import task_store
+from events import task_events, format_sse, TERMINAL_STATUSES
+from downloads import RangeFileResponse, TarBundle
+from scheduler import tts_scheduler, video_scheduler
+from router import backend_routers
+from job_queue import job_queue, QueueFull, PRIORITIES, DEFAULT_PRIORITY
+from metrics import (
+    UPLOAD_BYTES, DOWNLOAD_BYTES,
+    METRICS_CONTENT_TYPE, render_metrics, state_collector
+)
+from hls import HLS_FILE_PATTERN, playlist_url
+from janitor import janitor, disk_usage_ratio
+from synthesis import tts_service, process_synthesis, update_task
 
 app = FastAPI(title="Video Synthesis API")
 
@@ -24,8 +44,63 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-tts_service = TTSService()
-video_service = VideoService()
+background_loops = []
+
+# 以下状态在抓取指标时才读取
+state_collector.add_gauge(
+    "backend_inflight_requests", "正在执行的后端请求数", "backend",
+    lambda: {"gpt_sovits": tts_scheduler.active, "musetalk": video_scheduler.active}
+)
+state_collector.add_gauge(
+    "backend_queue_depth", "等待后端并发名额的请求数", "backend",
+    lambda: {"gpt_sovits": tts_scheduler.waiting, "musetalk": video_scheduler.waiting}
+)
+state_collector.add_gauge(
+    "backend_replica_up", "后端副本是否可用（未被健康检查剔除）", "replica",
+    lambda: {r.url: int(r.healthy) for router in backend_routers for r in router.replicas}
+)
+state_collector.add_gauge(
+    "backend_replica_inflight", "各后端副本正在执行的请求数", "replica",
+    lambda: {r.url: r.inflight for router in backend_routers for r in router.replicas}
+)
+state_collector.add_gauge(
+    "job_queue_depth", "任务队列中各优先级排队的任务数", "priority",
+    job_queue.depth_by_priority
+)
+state_collector.add_gauge(
+    "job_queue_running", "任务队列中正在执行的任务数", "queue",
+    lambda: {"synthesis": job_queue.get_status()["running"]}
+)
+state_collector.add_gauge(
+    "disk_usage_ratio", "输出目录和临时目录所在磁盘的使用率", "path",
+    lambda: {"output": disk_usage_ratio(OUTPUT_DIR), "temp": disk_usage_ratio(TEMP_DIR)}
+)
+state_collector.add_gauge(
+    "tasks_by_status", "各状态的任务数（来自任务库，多进程共享）", "status",
+    task_store.count_by_status
+)
+
+@app.on_event("startup")
+async def startup_event():
+    """启动时创建后端连接池、副本健康探测、任务队列和后台清理任务"""
+    await http_clients.start()
+    for router in backend_routers:
+        router.start()
+    job_queue.start(lambda payload: process_synthesis(**payload))
+    background_loops.append(asyncio.create_task(asset_store.cleanup_loop(ASSET_CLEANUP_INTERVAL)))
+    background_loops.append(asyncio.create_task(janitor.cleanup_loop(TASK_CLEANUP_INTERVAL)))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """关闭时停止后台任务并释放后端连接"""
+    for loop_task in background_loops:
+        loop_task.cancel()
+    # 进程内队列只在内存中，未完成的任务无法在重启后继续；使用任务代理时不受影响
+    for task_id in await job_queue.stop():
+        update_task(task_id, status="failed", message="服务重启，任务已取消")
+    for router in backend_routers:
+        await router.stop()
+    await http_clients.close()
 
 class TextItem(BaseModel):
     text: str
@@ -42,169 +117,423 @@ class TaskStatus(BaseModel):
     progress: int
     message: str
     result_urls: Optional[List[str]] = None
+    total_segments: Optional[int] = None
+    completed_segments: Optional[int] = None
+    created_at: Optional[float] = None
+    updated_at: Optional[float] = None
+    playlist_url: Optional[str] = None
+    queue_position: Optional[int] = None
 
-tasks = {}
+class TaskList(BaseModel):
+    total: int
+    limit: int
+    offset: int
+    items: List[TaskStatus]
+
+@app.post("/assets")
+async def upload_asset(
+    file: UploadFile = File(...),
+    kind: str = Form("video")
+):
+    """
+    上传参考视频或音频素材，相同内容只保存一次
+    """
+    try:
+        meta = await asset_store.save_upload(file, kind)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    UPLOAD_BYTES.labels("assets").observe(meta["size"])
+    return meta
+
+@app.get("/assets/{asset_id}")
+async def get_asset(asset_id: str):
+    """
+    获取素材信息
+    """
+    meta = asset_store.get(asset_id)
+    if not meta:
+        raise HTTPException(status_code=404, detail="素材不存在")
+    return meta
+
+@app.delete("/assets/{asset_id}")
+async def delete_asset(asset_id: str):
+    """
+    删除素材
+    """
+    if not asset_store.delete(asset_id):
+        raise HTTPException(status_code=404, detail="素材不存在")
+    return {"message": "素材已删除"}
+
+@app.post("/uploads")
+async def create_upload(
+    size: int = Form(...),
+    kind: str = Form("video"),
+    filename: Optional[str] = Form(None)
+):
+    """
+    创建分块上传会话，之后用 PUT /uploads/{upload_id}?offset=N 依次上传分块，
+    中断后通过 GET /uploads/{upload_id} 查询已收到的偏移继续上传
+    """
+    try:
+        return asset_store.create_upload(kind, filename, size)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+@app.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str):
+    """
+    查询上传进度
+    """
+    upload = asset_store.get_upload(upload_id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail="上传不存在或已过期")
+    return upload
+
+@app.put("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request, offset: int = Query(..., ge=0)):
+    """
+    上传一个分块，请求体为原始字节，边接收边写盘
+    """
+    try:
+        new_offset = await asset_store.write_chunk(upload_id, offset, request.stream())
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    UPLOAD_BYTES.labels("uploads").observe(new_offset - offset)
+    return {"upload_id": upload_id, "offset": new_offset}
+
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str, sha256: str = Form(...)):
+    """
+    校验文件哈希并完成上传，返回的asset_id可用于 /synthesize 的 video_asset_id / ref_audio_asset_id
+    """
+    try:
+        return await asset_store.finalize_upload(upload_id, sha256)
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+@app.delete("/uploads/{upload_id}")
+async def abort_upload(upload_id: str):
+    """
+    放弃上传
+    """
+    if not asset_store.abort_upload(upload_id):
+        raise HTTPException(status_code=404, detail="上传不存在或已过期")
+    return {"message": "上传已取消"}
+
+async def save_upload_file(upload: UploadFile, path: Path, chunk_size: int = 1024 * 1024) -> int:
+    """分块将上传文件写入磁盘，内存占用与文件大小无关，返回写入的字节数"""
+    size = 0
+    async with aiofiles.open(path, "wb") as f:
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+            await f.write(chunk)
+            size += len(chunk)
+    UPLOAD_BYTES.labels("synthesize").observe(size)
+    return size
 
 @app.post("/synthesize")
 async def synthesize_videos(
-    background_tasks: BackgroundTasks,
     texts: str = Form(...),
-    video: UploadFile = File(...),
+    video: Optional[UploadFile] = File(None),
     ref_audio: Optional[UploadFile] = File(None),
     ref_text: Optional[str] = Form(None),
-    language: str = Form("zh")
+    language: str = Form("zh"),
+    video_asset_id: Optional[str] = Form(None),
+    ref_audio_asset_id: Optional[str] = Form(None),
+    priority: str = Form(DEFAULT_PRIORITY)
 ):
     """
-    合成视频的主接口
+    合成视频的主接口，参考视频和音频可直接上传，也可引用已上传的素材
+    任务进入有界优先级队列，队列已满时返回429和Retry-After
     """
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"priority必须是 {', '.join(PRIORITIES)} 之一")
+    # 在接收上传之前拒绝，避免过载时白白写入大文件
+    try:
+        await job_queue.ensure_capacity()
+    except QueueFull as e:
+        raise queue_full_error(e.retry_after)
+    
+    if video is None and not video_asset_id:
+        raise HTTPException(status_code=400, detail="需要上传参考视频或指定video_asset_id")
+    
+    if video_asset_id:
+        video_path = asset_store.resolve(video_asset_id, "video")
+        if video_path is None:
+            raise HTTPException(status_code=404, detail="参考视频素材不存在")
+    
+    ref_audio_path = None
+    if ref_audio_asset_id:
+        ref_audio_path = asset_store.resolve(ref_audio_asset_id, "audio")
+        if ref_audio_path is None:
+            raise HTTPException(status_code=404, detail="参考音频素材不存在")
+    
     task_id = str(uuid.uuid4())
     
     task_dir = TEMP_DIR / task_id
     task_dir.mkdir(exist_ok=True)
     
-    video_path = task_dir / f"input_{video.filename}"
-    with open(video_path, "wb") as f:
-        f.write(await video.read())
+    if not video_asset_id:
+        video_path = task_dir / f"input_{Path(video.filename or 'video.mp4').name}"
+        await save_upload_file(video, video_path)
     
-    ref_audio_path = None
-    if ref_audio:
-        ref_audio_path = task_dir / f"ref_{ref_audio.filename}"
-        with open(ref_audio_path, "wb") as f:
-            f.write(await ref_audio.read())
+    if ref_audio and not ref_audio_path:
+        ref_audio_path = task_dir / f"ref_{Path(ref_audio.filename or 'audio.wav').name}"
+        await save_upload_file(ref_audio, ref_audio_path)
     
     text_list = [t.strip() for t in texts.split('\n') if t.strip()]
     
-    tasks[task_id] = {
-        "status": "processing",
-        "progress": 0,
-        "message": "任务已创建",
-        "result_urls": None
-    }
-    
-    background_tasks.add_task(
-        process_synthesis,
+    task_store.create(
         task_id,
-        text_list,
-        str(video_path),
-        str(ref_audio_path) if ref_audio_path else None,
-        ref_text,
-        language
+        status="queued",
+        progress=0,
+        message="排队中",
+        total_segments=len(text_list),
+        completed_segments=0
     )
     
-    return {"task_id": task_id}
-
-async def process_synthesis(
-    task_id: str,
-    texts: List[str],
-    video_path: str,
-    ref_audio_path: Optional[str],
-    ref_text: Optional[str],
-    language: str
-):
-    """
-    后台处理合成任务
-    """
     try:
-        task_dir = TEMP_DIR / task_id
-        audio_dir = task_dir / "audios"
-        video_dir = task_dir / "videos"
-        audio_dir.mkdir(exist_ok=True)
-        video_dir.mkdir(exist_ok=True)
-        
-        tasks[task_id]["status"] = "converting_audio"
-        tasks[task_id]["message"] = "正在转换文本为语音..."
-        
-        audio_paths = await tts_service.batch_text_to_speech(
-            texts,
-            str(audio_dir),
-            ref_audio_path,
-            ref_text,
-            language
+        # 路径需对执行任务的工作进程可见（共享存储且挂载路径相同）
+        position = await job_queue.submit(
+            task_id,
+            {
+                "task_id": task_id,
+                "texts": text_list,
+                "video_path": str(video_path),
+                "ref_audio_path": str(ref_audio_path) if ref_audio_path else None,
+                "ref_text": ref_text,
+                "language": language
+            },
+            priority
         )
-        
-        tasks[task_id]["progress"] = 40
-        tasks[task_id]["status"] = "generating_videos"
-        tasks[task_id]["message"] = "正在生成说话视频..."
-        
-        video_paths = await video_service.batch_generate_videos(
-            audio_paths,
-            video_path,
-            str(video_dir)
-        )
-        
-        tasks[task_id]["progress"] = 80
-        tasks[task_id]["status"] = "merging"
-        tasks[task_id]["message"] = "正在合并视频..."
-        
-        final_output_path = OUTPUT_DIR / f"{task_id}_final.mp4"
-        await video_service.merge_videos(video_paths, str(final_output_path))
-        
-        output_paths = []
-        for i, video_path in enumerate(video_paths):
-            individual_output = OUTPUT_DIR / f"{task_id}_segment_{i}.mp4"
-            shutil.copy(video_path, individual_output)
-            output_paths.append(f"/download/{task_id}_segment_{i}.mp4")
-        
-        output_paths.append(f"/download/{task_id}_final.mp4")
-        
-        tasks[task_id]["status"] = "completed"
-        tasks[task_id]["progress"] = 100
-        tasks[task_id]["message"] = "处理完成"
-        tasks[task_id]["result_urls"] = output_paths
-        
-    except Exception as e:
-        tasks[task_id]["status"] = "failed"
-        tasks[task_id]["message"] = f"处理失败: {str(e)}"
-    
-    finally:
-        if (TEMP_DIR / task_id).exists():
-            shutil.rmtree(TEMP_DIR / task_id)
+    except QueueFull as e:
+        # 上传期间队列被其他请求占满
+        task_store.delete(task_id)
+        shutil.rmtree(task_dir, ignore_errors=True)
+        raise queue_full_error(e.retry_after)
+    
+    return {"task_id": task_id, "queue_position": position}
+
+def queue_full_error(retry_after: int) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail=f"任务队列已满，请 {retry_after} 秒后重试",
+        headers={"Retry-After": str(retry_after)}
+    )
 
 @app.get("/task/{task_id}")
 async def get_task_status(task_id: str):
     """
     获取任务状态
     """
-    if task_id not in tasks:
+    task = task_store.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    
+    return TaskStatus(**task, playlist_url=playlist_url(task_id), queue_position=await job_queue.position(task_id))
+
+@app.get("/task/{task_id}/events")
+async def task_events_stream(task_id: str):
+    """
+    以Server-Sent Events推送任务状态变化和每段完成事件，任务结束后关闭连接
+    事件类型: status（状态变化）、segment（某段语音/视频完成）、merged（合并完成）
+    """
+    task = task_store.get(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="任务不存在")
     
-    return TaskStatus(**tasks[task_id])
+    async def event_stream():
+        queue = task_events.subscribe(task_id)
+        try:
+            # 先订阅再读取快照，两者之间的更新不会丢失
+            snapshot = task_store.get(task_id)
+            if snapshot is None:
+                return
+            last_updated = snapshot["updated_at"]
+            snapshot = TaskStatus(
+                **snapshot, playlist_url=playlist_url(task_id), queue_position=await job_queue.position(task_id)
+            ).model_dump()
+            yield format_sse("status", snapshot)
+            status = snapshot["status"]
+            # 任务由独立工作进程或其他uvicorn工作进程执行时只能从任务库同步，缩短同步间隔
+            sync_interval = TASK_EVENT_POLL_INTERVAL if JOB_BROKER_URL or SERVER_WORKERS > 1 else TASK_EVENT_HEARTBEAT
+            last_sent = time.monotonic()
+            
+            while status not in TERMINAL_STATUSES:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), sync_interval)
+                except asyncio.TimeoutError:
+                    # 任务可能在其他工作进程中执行，从任务库同步状态
+                    current = task_store.get(task_id)
+                    if current is None:
+                        return
+                    if current["updated_at"] == last_updated:
+                        if time.monotonic() - last_sent >= TASK_EVENT_HEARTBEAT:
+                            last_sent = time.monotonic()
+                            yield ": keepalive\n\n"
+                        continue
+                    last_updated = current["updated_at"]
+                    event, data = "status", TaskStatus(
+                        **current, playlist_url=playlist_url(task_id), queue_position=await job_queue.position(task_id)
+                    ).model_dump()
+                
+                last_sent = time.monotonic()
+                yield format_sse(event, data)
+                if event == "status":
+                    status = data.get("status", status)
+        finally:
+            task_events.unsubscribe(task_id, queue)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/tasks")
+async def list_tasks(
+    status: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=200),
+    offset: int = Query(0, ge=0)
+):
+    """
+    按创建时间倒序分页列出任务，可按状态过滤
+    """
+    items, total = task_store.list(status, limit, offset)
+    return TaskList(
+        total=total,
+        limit=limit,
+        offset=offset,
+        items=[TaskStatus(**task) for task in items]
+    )
 
-@app.get("/download/{filename}")
+@app.api_route("/download/{filename}", methods=["GET", "HEAD"])
 async def download_file(filename: str):
     """
-    下载生成的视频文件
+    下载生成的视频文件，支持断点续传和拖动播放（Range）以及条件请求（ETag）
     """
     file_path = OUTPUT_DIR / filename
-    if not file_path.exists():
+    # 以点开头的是临时目录和未发布完成的文件
+    if filename.startswith(".") or not file_path.is_file():
         raise HTTPException(status_code=404, detail="文件不存在")
     
-    return FileResponse(
+    response = RangeFileResponse(
         file_path,
         media_type="video/mp4",
         filename=filename
     )
+    response.background = BackgroundTask(lambda: DOWNLOAD_BYTES.labels("download").observe(response.sent_bytes))
+    return response
 
-@app.delete("/task/{task_id}")
-async def delete_task(task_id: str):
+@app.get("/task/{task_id}/bundle")
+async def download_bundle(task_id: str):
+    """
+    将任务的全部结果打包为一个不压缩的tar流下载，边读边发，不生成临时文件
+    """
+    task = task_store.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    if task["status"] != "completed" or not task["result_urls"]:
+        raise HTTPException(status_code=409, detail="任务尚未完成")
+    
+    paths = [OUTPUT_DIR / os.path.basename(url) for url in task["result_urls"]]
+    missing = [path.name for path in paths if not path.is_file()]
+    if missing:
+        raise HTTPException(status_code=410, detail=f"结果文件已被清理: {', '.join(missing)}")
+    
+    bundle = TarBundle(paths)
+    return StreamingResponse(
+        bundle.stream(),
+        media_type="application/x-tar",
+        headers={
+            "Content-Length": str(bundle.content_length),
+            "Content-Disposition": f'attachment; filename="{task_id}.tar"'
+        },
+        background=BackgroundTask(lambda: DOWNLOAD_BYTES.labels("bundle").observe(bundle.sent_bytes))
+    )
+
+@app.get("/hls/{task_id}/{filename}")
+async def get_hls_file(task_id: str, filename: str):
     """
-    删除任务及其相关文件
+    获取任务的HLS播放列表或分段，视频段生成后即可开始播放
     """
-    if task_id in tasks:
-        del tasks[task_id]
+    if not HLS_FILE_PATTERN.match(filename):
+        raise HTTPException(status_code=404, detail="文件不存在")
     
-    for file in OUTPUT_DIR.glob(f"{task_id}_*"):
-        file.unlink()
+    file_path = HLS_DIR / task_id / filename
+    if not file_path.exists():
+        raise HTTPException(status_code=404, detail="文件不存在")
     
-    return {"message": "任务已删除"}
+    if filename.endswith(".m3u8"):
+        # 播放列表会持续增长，不能被缓存
+        return FileResponse(
+            file_path,
+            media_type="application/vnd.apple.mpegurl",
+            headers={"Cache-Control": "no-cache"}
+        )
+    return FileResponse(file_path, media_type="video/mp2t")
+
+@app.delete("/task/{task_id}")
+async def delete_task(task_id: str):
+    """
+    删除任务及其相关文件，尚未开始的任务移出队列，执行中的任务同时停止
+    """
+    if await job_queue.cancel(task_id):
+        shutil.rmtree(TEMP_DIR / task_id, ignore_errors=True)
+    reclaimed = await asyncio.to_thread(janitor.remove_task, task_id)
+    return {"message": "任务已删除", "reclaimed_bytes": reclaimed}
+
+@app.post("/cleanup")
+async def run_cleanup():
+    """
+    立即执行一轮磁盘清理并返回清理报告
+    """
+    return await asyncio.to_thread(janitor.run_once)
+
+@app.get("/cache/tts")
+async def get_tts_cache_stats():
+    """
+    获取TTS缓存统计
+    """
+    if not tts_service.cache:
+        return {"enabled": False}
+    return {"enabled": True, **tts_service.cache.get_stats()}
+
+@app.delete("/cache/tts")
+async def clear_tts_cache():
+    """
+    清空TTS缓存
+    """
+    if tts_service.cache:
+        await asyncio.to_thread(tts_service.cache.clear)
+    return {"message": "缓存已清空"}
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus文本格式的运行指标
+    """
+    # 采集时会查询任务库和任务代理，放到线程中执行，不阻塞事件循环
+    return Response(content=await asyncio.to_thread(render_metrics), media_type=METRICS_CONTENT_TYPE)
 
 @app.get("/health")
 async def health_check():
     """
     健康检查
     """
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    return {
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "backends": {router.name: router.get_status() for router in backend_routers},
+        "queue": await asyncio.to_thread(job_queue.get_status)
+    }
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host=SERVER_HOST, port=SERVER_PORT)
\ No newline at end of file
+    if SERVER_WORKERS > 1:
+        # 任务状态保存在SQLite中，多个工作进程可以共享
+        uvicorn.run("main:app", host=SERVER_HOST, port=SERVER_PORT, workers=SERVER_WORKERS)
+    else:
+        uvicorn.run(app, host=SERVER_HOST, port=SERVER_PORT)
\ No newline at end of file
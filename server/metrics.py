@@ -0,0 +1,99 @@
+import os
+from typing import Callable, Dict, List
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest
+)
+from prometheus_client.core import GaugeMetricFamily
+
+# 后端调用耗时分布（秒）
+TTS_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60)
+VIDEO_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+MERGE_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120)
+TASK_BUCKETS = (5, 10, 30, 60, 120, 300, 600, 1200, 3600)
+# 传输字节数分布：1KB到4GB，每档×4
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(12))
+
+TTS_LATENCY = Histogram(
+    "tts_request_seconds", "GPT-SoVITS请求耗时", ["result"], buckets=TTS_BUCKETS
+)
+TTS_FIRST_BYTE = Histogram(
+    "tts_first_byte_seconds", "GPT-SoVITS请求到收到第一块音频的耗时", buckets=TTS_BUCKETS
+)
+MUSETALK_LATENCY = Histogram(
+    "musetalk_request_seconds", "MuseTalk请求耗时", ["endpoint", "result"], buckets=VIDEO_BUCKETS
+)
+MERGE_LATENCY = Histogram(
+    "merge_seconds", "视频合并耗时", ["mode"], buckets=MERGE_BUCKETS
+)
+QUEUE_WAIT = Histogram(
+    "job_queue_wait_seconds", "任务在队列中等待的时间", ["priority"], buckets=TASK_BUCKETS
+)
+TASK_DURATION = Histogram(
+    "task_duration_seconds", "任务从开始处理到结束的耗时", ["outcome"], buckets=TASK_BUCKETS
+)
+UPLOAD_BYTES = Histogram(
+    "upload_bytes", "每次上传的字节数", ["route"], buckets=BYTES_BUCKETS
+)
+DOWNLOAD_BYTES = Histogram(
+    "download_bytes", "每次下载实际发送的字节数", ["route"], buckets=BYTES_BUCKETS
+)
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total", "缓存查询次数", ["cache", "result"]
+)
+SEGMENTS = Counter(
+    "segments_total", "完成的段数", ["stage"]
+)
+TASKS = Counter(
+    "tasks_total", "结束的任务数", ["outcome"]
+)
+RECLAIMED_BYTES = Counter(
+    "janitor_reclaimed_bytes_total", "磁盘清理释放的字节数", ["reason"]
+)
+
+class StateCollector:
+    """
+    抓取时才读取调度器、任务库等的当前状态，平时没有任何开销
+    每个来源是返回 {标签值: 数值} 的函数
+    """
+
+    def __init__(self):
+        self._gauges: List[tuple] = []
+
+    def add_gauge(self, name: str, documentation: str, label: str, source: Callable[[], Dict[str, float]]):
+        self._gauges.append((name, documentation, label, source))
+
+    def collect(self):
+        for name, documentation, label, source in self._gauges:
+            family = GaugeMetricFamily(name, documentation, labels=[label])
+            try:
+                values = source()
+            except Exception as e:
+                print(f"[指标] 读取 {name} 失败: {e}")
+                continue
+            for label_value, value in values.items():
+                family.add_metric([label_value], value)
+            yield family
+
+state_collector = StateCollector()
+REGISTRY.register(state_collector)
+
+def render_metrics() -> bytes:
+    """
+    生成Prometheus文本格式的指标
+    多进程部署时设置PROMETHEUS_MULTIPROC_DIR，汇总所有工作进程的计数器和直方图
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(state_collector)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
@@ -0,0 +1,117 @@
+import asyncio
+from pathlib import Path
+from typing import Callable, List, Optional
+from config import GPT_SOVITS_CONCURRENCY, MUSETALK_CONCURRENCY, PIPELINE_BUFFER_SIZE
+
+# 段事件回调: (阶段, 段序号, 产物路径)，阶段为 "audio" 或 "video"
+SegmentCallback = Callable[[str, int, str], None]
+
+class SegmentPipeline:
+    """逐段流水执行TTS与视频生成，音频就绪的段立即进入视频生成阶段"""
+
+    def __init__(
+        self,
+        tts_service,
+        video_service,
+        tts_workers: int = GPT_SOVITS_CONCURRENCY,
+        video_workers: int = MUSETALK_CONCURRENCY,
+        buffer_size: int = PIPELINE_BUFFER_SIZE
+    ):
+        self.tts_service = tts_service
+        self.video_service = video_service
+        self.tts_workers = max(1, tts_workers)
+        self.video_workers = max(1, video_workers)
+        self.buffer_size = max(1, buffer_size)
+
+    async def run(
+        self,
+        task_id: str,
+        texts: List[str],
+        video_path: str,
+        audio_dir: str,
+        video_dir: str,
+        ref_audio_path: Optional[str] = None,
+        ref_text: Optional[str] = None,
+        language: str = "zh",
+        on_segment: Optional[SegmentCallback] = None
+    ) -> List[str]:
+        """
+        运行流水线，返回按文本顺序排列的视频段路径
+        """
+        audio_dir = Path(audio_dir)
+        video_dir = Path(video_dir)
+        audio_dir.mkdir(exist_ok=True)
+        video_dir.mkdir(exist_ok=True)
+        
+        text_queue: asyncio.Queue = asyncio.Queue()
+        for i, text in enumerate(texts):
+            text_queue.put_nowait((i, text))
+        # 有界缓冲：视频阶段跟不上时TTS阶段自动暂停
+        audio_queue: asyncio.Queue = asyncio.Queue(maxsize=self.buffer_size)
+        video_paths: List[Optional[str]] = [None] * len(texts)
+        
+        def notify(stage: str, index: int, path: str):
+            if on_segment:
+                on_segment(stage, index, path)
+        
+        async def tts_worker():
+            while True:
+                try:
+                    i, text = text_queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                audio_path = await self.tts_service.text_to_speech(
+                    text,
+                    str(audio_dir / f"audio_{i}.wav"),
+                    ref_audio_path,
+                    ref_text,
+                    language,
+                    task_id
+                )
+                notify("audio", i, audio_path)
+                await audio_queue.put((i, audio_path))
+        
+        async def video_worker():
+            avatar_id = await avatar_task
+            while True:
+                item = await audio_queue.get()
+                if item is None:
+                    return
+                i, audio_path = item
+                video_paths[i] = await self.video_service.generate_talking_video(
+                    audio_path,
+                    video_path,
+                    str(video_dir / f"video_{i}.mp4"),
+                    task_id,
+                    avatar_id
+                )
+                notify("video", i, video_paths[i])
+        
+        async def produce():
+            await asyncio.gather(*tts_tasks)
+            for _ in video_tasks:
+                await audio_queue.put(None)
+        
+        # 参考视频与TTS并行上传到MuseTalk预处理，之后每段只传音频
+        avatar_task = asyncio.create_task(self.video_service.prepare_avatar(video_path, task_id))
+        tts_tasks = [
+            asyncio.create_task(tts_worker())
+            for _ in range(min(self.tts_workers, len(texts)))
+        ]
+        video_tasks = [
+            asyncio.create_task(video_worker())
+            for _ in range(min(self.video_workers, len(texts)))
+        ]
+        producer = asyncio.create_task(produce())
+        all_tasks = [producer, avatar_task, *tts_tasks, *video_tasks]
+        
+        try:
+            await asyncio.gather(producer, avatar_task, *video_tasks)
+        except BaseException:
+            # 任一段失败时取消其余段，避免继续占用后端
+            for task in all_tasks:
+                task.cancel()
+            await asyncio.gather(*all_tasks, return_exceptions=True)
+            raise
+        
+        return video_paths
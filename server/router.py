@@ -0,0 +1,160 @@
+import time
+import asyncio
+import aiohttp
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+from config import (
+    GPT_SOVITS_API_URLS,
+    MUSETALK_API_URLS,
+    GPT_SOVITS_HEALTH_PATH,
+    MUSETALK_HEALTH_PATH,
+    BACKEND_HEALTH_INTERVAL,
+    BACKEND_HEALTH_TIMEOUT,
+    BACKEND_EJECT_FAILURES,
+    BACKEND_REINSTATE_SUCCESSES
+)
+
+class Replica:
+    """后端的一个副本实例"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.inflight = 0
+        self.requests = 0
+        self.healthy = True
+        # 连续探测失败/成功次数，用于剔除和恢复
+        self.failures = 0
+        self.successes = 0
+        self.last_error: Optional[str] = None
+        self.last_probe: Optional[float] = None
+
+class ReplicaRouter:
+    """
+    将同一后端的请求分发到多个副本，选择健康副本中在途请求最少的一个
+    后台定期探测各副本的健康接口，连续失败达到阈值时剔除，连续成功达到阈值后恢复
+    后端没有健康接口（如GPT-SoVITS官方api.py）时返回404，此时只按能否连接和响应判断
+    """
+
+    def __init__(self, name: str, urls: List[str], health_path: str = "/health"):
+        self.name = name
+        self.replicas = [Replica(url) for url in urls]
+        self.health_path = health_path
+        # 在途数相同时从不同位置开始比较，避免总落到第一个副本
+        self._cursor = 0
+        self._probe_task: Optional[asyncio.Task] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def pick(self, preferred: Iterable[str] = ()) -> Replica:
+        """
+        选择在途请求最少的健康副本，在途数相同时优先preferred中的副本
+        所有副本都被剔除时仍在全部副本中选择，探测结果可能滞后于实际恢复
+        """
+        preferred = set(preferred)
+        candidates = [r for r in self.replicas if r.healthy] or self.replicas
+        start = self._cursor % len(candidates)
+        self._cursor += 1
+        ordered = candidates[start:] + candidates[:start]
+        return min(ordered, key=lambda r: (r.inflight, r.url not in preferred))
+
+    @asynccontextmanager
+    async def replica(self, preferred: Iterable[str] = ()):
+        """
+        占用一个副本发送请求，连接失败时立即剔除该副本，等待探测恢复
+        """
+        replica = self.pick(preferred)
+        replica.inflight += 1
+        replica.requests += 1
+        try:
+            yield replica.url
+        except aiohttp.ClientConnectorError as e:
+            self._mark_failed(replica, str(e), eject=True)
+            raise
+        finally:
+            replica.inflight -= 1
+
+    async def request(self, send: Callable[[str], Awaitable], preferred: Iterable[str] = ()):
+        """
+        在选中的副本上执行send(url)并返回其结果
+        连接失败说明请求没有送达，剔除该副本后换一个健康副本重试
+        """
+        while True:
+            try:
+                async with self.replica(preferred) as url:
+                    return await send(url)
+            except aiohttp.ClientConnectorError:
+                if not any(r.healthy for r in self.replicas):
+                    raise
+
+    def _mark_failed(self, replica: Replica, error: str, eject: bool = False):
+        replica.failures += 1
+        replica.successes = 0
+        replica.last_error = error
+        if replica.healthy and (eject or replica.failures >= BACKEND_EJECT_FAILURES):
+            replica.healthy = False
+            print(f"[路由] {self.name} 副本 {replica.url} 已剔除: {error}")
+
+    def _mark_ok(self, replica: Replica):
+        replica.failures = 0
+        replica.successes += 1
+        replica.last_error = None
+        if not replica.healthy and replica.successes >= BACKEND_REINSTATE_SUCCESSES:
+            replica.healthy = True
+            print(f"[路由] {self.name} 副本 {replica.url} 已恢复")
+
+    async def probe(self, replica: Replica):
+        """探测单个副本的健康接口"""
+        replica.last_probe = time.time()
+        try:
+            async with self._session.get(f"{replica.url}{self.health_path}") as response:
+                if response.status in (200, 404):
+                    self._mark_ok(replica)
+                else:
+                    self._mark_failed(replica, f"健康检查返回 {response.status}")
+        except Exception as e:
+            self._mark_failed(replica, str(e) or type(e).__name__)
+
+    async def _probe_loop(self, interval: float):
+        while True:
+            await asyncio.gather(*(self.probe(r) for r in self.replicas))
+            await asyncio.sleep(interval)
+
+    def start(self, interval: float = BACKEND_HEALTH_INTERVAL):
+        """
+        启动后台探测，探测使用独立的短超时会话，不占用推理请求的连接池
+        """
+        if self._probe_task is not None:
+            return
+        self._session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=BACKEND_HEALTH_TIMEOUT)
+        )
+        self._probe_task = asyncio.create_task(self._probe_loop(interval))
+
+    async def stop(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def get_status(self) -> List[Dict]:
+        """获取各副本当前状态"""
+        return [
+            {
+                "url": r.url,
+                "healthy": r.healthy,
+                "inflight": r.inflight,
+                "requests": r.requests,
+                "last_error": r.last_error
+            }
+            for r in self.replicas
+        ]
+
+# 全局后端路由实例
+tts_router = ReplicaRouter("gpt_sovits", GPT_SOVITS_API_URLS, GPT_SOVITS_HEALTH_PATH)
+video_router = ReplicaRouter("musetalk", MUSETALK_API_URLS, MUSETALK_HEALTH_PATH)
+backend_routers = (tts_router, video_router)
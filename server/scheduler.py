@@ -0,0 +1,98 @@
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+from config import GPT_SOVITS_CONCURRENCY, MUSETALK_CONCURRENCY, GPT_SOVITS_API_URLS, MUSETALK_API_URLS
+
+DEFAULT_TASK = "default"
+
+class BackendScheduler:
+    """限制单个后端的并发请求数，并在任务之间轮转分配空闲槽位"""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.active = 0
+        # task_id -> 等待中的请求，同一任务内先进先出，任务之间轮转
+        self._queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+
+    @property
+    def waiting(self) -> int:
+        """排队等待槽位的请求数"""
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def acquire(self, task_id: Optional[str] = None):
+        """
+        获取一个并发槽位，槽位已满时按任务排队等待
+        """
+        if self.active < self.limit and not self._queues:
+            self.active += 1
+            return
+        
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(task_id or DEFAULT_TASK, deque()).append(future)
+        
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 槽位已分配但调用方被取消，归还槽位
+                self.release()
+            else:
+                self._discard(task_id or DEFAULT_TASK, future)
+            raise
+
+    def release(self):
+        """归还槽位并唤醒下一个等待者"""
+        self.active -= 1
+        self._wake()
+
+    def _discard(self, task_id: str, future: asyncio.Future):
+        queue = self._queues.get(task_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(future)
+        except ValueError:
+            pass
+        if not queue:
+            del self._queues[task_id]
+
+    def _wake(self):
+        while self.active < self.limit and self._queues:
+            task_id, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            if queue:
+                # 该任务还有请求在等，排到队尾让其他任务先执行
+                self._queues.move_to_end(task_id)
+            else:
+                del self._queues[task_id]
+            
+            if future.done():
+                continue
+            self.active += 1
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, task_id: Optional[str] = None):
+        """
+        以上下文管理器形式占用一个槽位
+        """
+        await self.acquire(task_id)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def get_status(self) -> Dict[str, int]:
+        """获取调度器当前状态"""
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "tasks_waiting": len(self._queues)
+        }
+
+# 全局后端调度器实例，并发上限按副本数放大
+tts_scheduler = BackendScheduler("gpt_sovits", GPT_SOVITS_CONCURRENCY * len(GPT_SOVITS_API_URLS))
+video_scheduler = BackendScheduler("musetalk", MUSETALK_CONCURRENCY * len(MUSETALK_API_URLS))
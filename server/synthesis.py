@@ -0,0 +1,172 @@
+"""
+合成任务的执行：逐段生成语音和视频、合并并发布结果
+API进程（本地任务队列）和独立的工作进程（worker.py）共用
+"""
+
+import os
+import time
+import errno
+import shutil
+import asyncio
+import contextlib
+from pathlib import Path
+from typing import List, Optional
+from config import TEMP_DIR, OUTPUT_DIR, HLS_ENABLED
+from tts_service import TTSService
+from video_service import VideoService
+from pipeline import SegmentPipeline
+from task_store import task_store
+from events import task_events
+from hls import HLSPublisher, remove_task_hls
+from metrics import SEGMENTS, TASKS, TASK_DURATION
+
+def publish_file(src: Path, dst: Path) -> bool:
+    """
+    将任务产物发布到输出目录：同一文件系统时直接改名，跨文件系统时才复制
+    返回是否发生了复制
+    """
+    try:
+        os.replace(src, dst)
+        return False
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    # 先复制到目标目录下的临时文件再改名，下载方不会读到写了一半的文件
+    tmp_path = dst.parent / f".{dst.name}.tmp"
+    try:
+        shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return True
+
+class TaskDeleted(Exception):
+    """任务在执行过程中被删除"""
+
+def ensure_not_deleted(task_id: str):
+    """
+    任务记录已被删除时抛出TaskDeleted
+    使用任务代理时删除请求在API进程中处理，工作进程要到下次续租才会发现，发布结果前先检查一次
+    """
+    if task_store.get(task_id) is None:
+        raise TaskDeleted(f"任务 {task_id} 已删除")
+
+def update_task(task_id: str, **fields):
+    """更新任务状态并推送给订阅者"""
+    task_store.update(task_id, **fields)
+    task_events.publish(task_id, "status", {"task_id": task_id, **fields})
+
+async def process_synthesis(
+    task_id: str,
+    texts: List[str],
+    video_path: str,
+    ref_audio_path: Optional[str],
+    ref_text: Optional[str],
+    language: str
+):
+    """
+    后台处理合成任务
+    """
+    hls_publisher = HLSPublisher(task_id) if HLS_ENABLED else None
+    start_time, outcome = time.perf_counter(), "failed"
+    try:
+        task_dir = TEMP_DIR / task_id
+        audio_dir = task_dir / "audios"
+        video_dir = task_dir / "videos"
+        audio_dir.mkdir(exist_ok=True)
+        video_dir.mkdir(exist_ok=True)
+        
+        update_task(task_id, status="converting_audio", message="正在转换文本为语音...")
+        
+        total = len(texts)
+        done = {"audio": 0, "video": 0}
+        
+        def on_segment(stage: str, index: int, path: str):
+            # 语音和视频各占40%进度，按实际完成的段数推进
+            done[stage] += 1
+            SEGMENTS.labels(stage).inc()
+            if stage == "video" and hls_publisher:
+                hls_publisher.submit(index, path)
+            task_events.publish(task_id, "segment", {"task_id": task_id, "stage": stage, "index": index})
+            update_task(
+                task_id,
+                status="generating_videos" if done["audio"] == total else "converting_audio",
+                progress=(done["audio"] + done["video"]) * 40 // total,
+                completed_segments=done["video"],
+                message=f"正在合成: 语音 {done['audio']}/{total}，视频 {done['video']}/{total}"
+            )
+        
+        video_paths = await pipeline.run(
+            task_id,
+            texts,
+            video_path,
+            str(audio_dir),
+            str(video_dir),
+            ref_audio_path,
+            ref_text,
+            language,
+            on_segment
+        )
+        
+        ensure_not_deleted(task_id)
+        update_task(task_id, status="merging", progress=80, message="正在合并视频...")
+        
+        if hls_publisher:
+            await hls_publisher.finish()
+        
+        final_output_path = OUTPUT_DIR / f"{task_id}_final.mp4"
+        await video_service.merge_videos(video_paths, str(final_output_path), str(task_dir))
+        task_events.publish(task_id, "merged", {"task_id": task_id})
+        
+        output_paths = []
+        for i, video_path in enumerate(video_paths):
+            individual_output = OUTPUT_DIR / f"{task_id}_segment_{i}.mp4"
+            await asyncio.to_thread(publish_file, Path(video_path), individual_output)
+            output_paths.append(f"/download/{task_id}_segment_{i}.mp4")
+        
+        output_paths.append(f"/download/{task_id}_final.mp4")
+        
+        ensure_not_deleted(task_id)
+        update_task(
+            task_id,
+            status="completed",
+            progress=100,
+            message="处理完成",
+            result_urls=output_paths
+        )
+        outcome = "completed"
+        
+    except asyncio.CancelledError:
+        # 任务被删除，或租约丢失后已重新投递给其他工作进程
+        outcome = "cancelled"
+        if hls_publisher:
+            await hls_publisher.abort()
+        raise
+    
+    except TaskDeleted as e:
+        # 删除时已清理的结果文件和HLS文件可能又被写入，一并删除
+        outcome = "deleted"
+        print(f"[合成] {e}，停止发布结果")
+        if hls_publisher:
+            with contextlib.suppress(OSError):
+                await hls_publisher.abort()
+        remove_task_hls(task_id)
+        for file in OUTPUT_DIR.glob(f"{task_id}_*"):
+            file.unlink(missing_ok=True)
+    
+    except Exception as e:
+        if hls_publisher:
+            await hls_publisher.abort()
+        update_task(task_id, status="failed", message=f"处理失败: {str(e)}")
+    
+    finally:
+        TASKS.labels(outcome).inc()
+        TASK_DURATION.labels(outcome).observe(time.perf_counter() - start_time)
+        # 取消时临时目录可能正被重新投递的执行使用，留给无主临时目录清理
+        if outcome != "cancelled" and (TEMP_DIR / task_id).exists():
+            shutil.rmtree(TEMP_DIR / task_id)
+
+# 全局合成服务实例
+tts_service = TTSService()
+video_service = VideoService()
+pipeline = SegmentPipeline(tts_service, video_service)
@@ -0,0 +1,167 @@
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Optional, Tuple
+from config import TASK_DB_PATH
+
+# 任务表中除task_id和时间戳之外的字段
+TASK_FIELDS = (
+    "status",
+    "progress",
+    "message",
+    "result_urls",
+    "total_segments",
+    "completed_segments"
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    progress INTEGER NOT NULL DEFAULT 0,
+    message TEXT NOT NULL DEFAULT '',
+    result_urls TEXT,
+    total_segments INTEGER,
+    completed_segments INTEGER,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status);
+CREATE INDEX IF NOT EXISTS idx_tasks_created_at ON tasks (created_at);
+"""
+
+class TaskStore:
+    """基于SQLite（WAL模式）的持久化任务状态存储，可被多个服务进程共享"""
+
+    def __init__(self, db_path: Path = TASK_DB_PATH):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(self.db_path),
+            timeout=30,
+            check_same_thread=False,
+            isolation_level=None
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=30000")
+        self._conn.executescript(SCHEMA)
+
+    def _to_dict(self, row: sqlite3.Row) -> dict:
+        task = dict(row)
+        if task["result_urls"] is not None:
+            task["result_urls"] = json.loads(task["result_urls"])
+        return task
+
+    def _encode(self, fields: dict) -> dict:
+        unknown = set(fields) - set(TASK_FIELDS)
+        if unknown:
+            raise ValueError(f"未知的任务字段: {', '.join(sorted(unknown))}")
+        encoded = dict(fields)
+        if encoded.get("result_urls") is not None:
+            encoded["result_urls"] = json.dumps(encoded["result_urls"], ensure_ascii=False)
+        return encoded
+
+    def create(self, task_id: str, **fields):
+        """
+        创建任务记录
+        """
+        encoded = self._encode(fields)
+        now = time.time()
+        columns = ["task_id", *encoded, "created_at", "updated_at"]
+        values = [task_id, *encoded.values(), now, now]
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO tasks ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                values
+            )
+
+    def update(self, task_id: str, **fields) -> bool:
+        """
+        更新任务字段，任务不存在时返回False
+        """
+        encoded = self._encode(fields)
+        if not encoded:
+            return self.get(task_id) is not None
+        assignments = ", ".join(f"{column} = ?" for column in encoded)
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE tasks SET {assignments}, updated_at = ? WHERE task_id = ?",
+                [*encoded.values(), time.time(), task_id]
+            )
+        return cursor.rowcount > 0
+
+    def get(self, task_id: str) -> Optional[dict]:
+        """获取单个任务"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM tasks WHERE task_id = ?", (task_id,)
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def delete(self, task_id: str) -> bool:
+        """删除任务记录"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+        return cursor.rowcount > 0
+
+    def list(
+        self,
+        status: Optional[str] = None,
+        limit: int = 20,
+        offset: int = 0
+    ) -> Tuple[List[dict], int]:
+        """
+        按创建时间倒序分页列出任务，返回(当前页, 总数)
+        """
+        where, params = "", []
+        if status:
+            where, params = "WHERE status = ?", [status]
+        with self._lock:
+            total = self._conn.execute(
+                f"SELECT COUNT(*) FROM tasks {where}", params
+            ).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT * FROM tasks {where} ORDER BY created_at DESC LIMIT ? OFFSET ?",
+                [*params, limit, offset]
+            ).fetchall()
+        return [self._to_dict(row) for row in rows], total
+
+    def expired_ids(self, updated_before: float, statuses: Tuple[str, ...]) -> List[str]:
+        """列出处于statuses状态、最后更新时间早于updated_before的任务"""
+        placeholders = ", ".join("?" * len(statuses))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT task_id FROM tasks WHERE status IN ({placeholders}) AND updated_at < ?",
+                [*statuses, updated_before]
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def finished_ids(self, statuses: Tuple[str, ...], limit: int = 100) -> List[str]:
+        """按结束时间从旧到新列出处于statuses状态的任务"""
+        placeholders = ", ".join("?" * len(statuses))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT task_id FROM tasks WHERE status IN ({placeholders}) ORDER BY updated_at LIMIT ?",
+                [*statuses, limit]
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def count_by_status(self) -> dict:
+        """按状态统计任务数"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM tasks GROUP BY status"
+            ).fetchall()
+        return {status: count for status, count in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# 全局任务存储实例
+task_store = TaskStore()
@@ -0,0 +1,50 @@
+import re
+from typing import List
+
+# 句末标点（可带后引号、右括号），英文句点需后跟空白或位于末尾，避免切开小数和缩写
+SENTENCE_END = re.compile(r'(?:[。！？；!?;…]+|\.(?=\s|$))[”’"」』）)]*')
+# 句中停顿，句子过长时在这些位置继续切分
+CLAUSE_END = re.compile(r'[，,、：:]')
+
+def _cut(text: str, pattern: re.Pattern) -> List[str]:
+    """在每个匹配的末尾切开，保留标点和空白，拼接后与原文相同"""
+    pieces, start = [], 0
+    for match in pattern.finditer(text):
+        pieces.append(text[start:match.end()])
+        start = match.end()
+    if start < len(text):
+        pieces.append(text[start:])
+    return pieces
+
+def _hard_cut(text: str, max_chars: int) -> List[str]:
+    """没有标点可用时按长度切分，英文尽量在空白处切开"""
+    pieces = []
+    while len(text) > max_chars:
+        index = text.rfind(" ", 0, max_chars)
+        if index <= 0:
+            index = max_chars
+        pieces.append(text[:index])
+        text = text[index:]
+    pieces.append(text)
+    return pieces
+
+def split_sentences(text: str, max_chars: int) -> List[str]:
+    """
+    将一行文本在中英文句子边界切分，过长的句子再按逗号等停顿切分，
+    相邻的短句合并到不超过max_chars，避免切得过碎影响语气
+    """
+    pieces = []
+    for sentence in _cut(text, SENTENCE_END):
+        if len(sentence.strip()) <= max_chars:
+            pieces.append(sentence)
+            continue
+        for clause in _cut(sentence, CLAUSE_END):
+            pieces.extend(_hard_cut(clause, max_chars))
+
+    merged: List[str] = []
+    for piece in pieces:
+        if merged and len((merged[-1] + piece).strip()) <= max_chars:
+            merged[-1] += piece
+        else:
+            merged.append(piece)
+    return [piece.strip() for piece in merged if piece.strip()]
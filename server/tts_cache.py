@@ -0,0 +1,176 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Tuple
+from config import TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class TTSCache:
+    """以请求内容哈希为键、按总字节数做LRU淘汰的磁盘音频缓存"""
+
+    def __init__(self, cache_dir: Path = TTS_CACHE_DIR, max_bytes: int = TTS_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # key -> 文件大小，顺序即最近使用顺序（末尾最新）
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        # (路径, 大小, 修改时间) -> 内容哈希，避免重复计算参考音频哈希；
+        # 每个任务的临时路径都不同，按最近使用保留有限条目
+        self._ref_hashes: "OrderedDict[Tuple[str, int, float], str]" = OrderedDict()
+        self._ref_memo_size = 256
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        """按文件修改时间重建LRU索引"""
+        entries = []
+        for path in self.cache_dir.glob("*.wav"):
+            stat = path.stat()
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._total_bytes += size
+        # 清理上次异常退出遗留的临时文件
+        for path in self.cache_dir.glob("*.tmp"):
+            path.unlink(missing_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.wav"
+
+    def ref_audio_hash(self, ref_audio_path: str) -> str:
+        """
+        获取参考音频的内容哈希，文件未变化时复用上次结果
+        """
+        stat = os.stat(ref_audio_path)
+        memo_key = (os.path.abspath(ref_audio_path), stat.st_size, stat.st_mtime)
+        with self._lock:
+            digest = self._ref_hashes.get(memo_key)
+            if digest is not None:
+                self._ref_hashes.move_to_end(memo_key)
+                return digest
+
+        digest = file_sha256(ref_audio_path)
+        with self._lock:
+            self._ref_hashes[memo_key] = digest
+            while len(self._ref_hashes) > self._ref_memo_size:
+                self._ref_hashes.popitem(last=False)
+        return digest
+
+    def make_key(self, params: dict) -> str:
+        """
+        由合成参数生成缓存键，参数中的参考音频需已替换为内容哈希
+        """
+        payload = json.dumps(params, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str, output_path: str) -> bool:
+        """
+        命中时将缓存音频放到output_path并返回True
+        """
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                return False
+            self._index.move_to_end(key)
+            self.hits += 1
+
+        cached_path = self._path(key)
+        try:
+            _link_or_copy(cached_path, output_path)
+            os.utime(cached_path)
+            return True
+        except FileNotFoundError:
+            # 文件被外部删除，修正索引后按未命中处理
+            with self._lock:
+                size = self._index.pop(key, None)
+                if size is not None:
+                    self._total_bytes -= size
+                self.hits -= 1
+                self.misses += 1
+            return False
+
+    def put(self, key: str, source_path: str):
+        """
+        将生成的音频原子地写入缓存，并按容量上限淘汰最久未用的条目
+        """
+        size = os.path.getsize(source_path)
+        if size > self.max_bytes:
+            return
+
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+        os.close(fd)
+        try:
+            shutil.copyfile(source_path, tmp_path)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+        with self._lock:
+            old_size = self._index.pop(key, None)
+            if old_size is not None:
+                self._total_bytes -= old_size
+            self._index[key] = size
+            self._total_bytes += size
+            evicted = self._evict_locked()
+
+        for path in evicted:
+            path.unlink(missing_ok=True)
+
+    def _evict_locked(self) -> list:
+        evicted = []
+        while self._total_bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            evicted.append(self._path(key))
+        return evicted
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            keys = list(self._index)
+            self._index.clear()
+            self._total_bytes = 0
+        for key in keys:
+            self._path(key).unlink(missing_ok=True)
+
+    def get_stats(self) -> dict:
+        """获取缓存统计信息"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._index),
+                "total_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions
+            }
+
+def _link_or_copy(source: Path, target: str):
+    """优先硬链接，跨文件系统时复制"""
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
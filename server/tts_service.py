@@ -1,15 +1,43 @@
 import os
-import requests
 import json
+import time
 from pathlib import Path
 from typing import Optional
 import aiofiles
 import asyncio
-from config import GPT_SOVITS_API_URL, TEMP_DIR
+from config import (
+    TEMP_DIR,
+    GPT_SOVITS_STREAMING,
+    TTS_CACHE_ENABLED,
+    TTS_SPLIT_ENABLED,
+    TTS_SPLIT_MIN_CHARS,
+    TTS_SPLIT_MAX_CHARS,
+    TTS_SPLIT_SILENCE
+)
+from http_client import http_clients
+from scheduler import tts_scheduler
+from router import tts_router
+from tts_cache import TTSCache
+from text_split import split_sentences
+from audio import concat_wavs, fix_wav_sizes
+from metrics import TTS_LATENCY, TTS_FIRST_BYTE, CACHE_LOOKUPS
+
+# 只影响传输方式、不影响音频内容的参数，不参与缓存键
+TRANSPORT_PARAMS = ("streaming_mode", "media_type")
 
 class TTSService:
-    def __init__(self):
-        self.api_url = GPT_SOVITS_API_URL
+    def __init__(
+        self,
+        cache: Optional[TTSCache] = None,
+        split_enabled: bool = TTS_SPLIT_ENABLED,
+        streaming: bool = GPT_SOVITS_STREAMING
+    ):
+        self.chunk_size = 64 * 1024
+        self.streaming = streaming
+        if cache is None and TTS_CACHE_ENABLED:
+            cache = TTSCache()
+        self.cache = cache
+        self.split_enabled = split_enabled
         
     async def text_to_speech(
         self, 
@@ -17,71 +45,127 @@ class TTSService:
         output_path: str,
         ref_audio_path: Optional[str] = None,
         ref_text: Optional[str] = None,
-        language: str = "zh"
+        language: str = "zh",
+        task_id: Optional[str] = None
     ) -> str:
         """
         调用GPT-SoVITS API将文本转换为语音
+        较长的文本按句切分后并行合成，再拼接为一个音频文件写入output_path
         """
         try:
-            data = {
-                "text": text,
-                "text_language": language,
-                "top_k": 5,
-                "top_p": 1,
-                "temperature": 1
-            }
-            
-            if ref_audio_path and ref_text:
-                data.update({
-                    "ref_audio_path": ref_audio_path,
-                    "prompt_text": ref_text,
-                    "prompt_language": language
-                })
-            
-            response = requests.post(
-                f"{self.api_url}/tts",
-                json=data,
-                stream=True,
-                timeout=60
-            )
-            
-            if response.status_code == 200:
-                async with aiofiles.open(output_path, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=1024):
-                        if chunk:
-                            await f.write(chunk)
-                return output_path
+            pieces = [text]
+            if self.split_enabled and len(text) > TTS_SPLIT_MIN_CHARS:
+                pieces = split_sentences(text, TTS_SPLIT_MAX_CHARS)
+            if len(pieces) > 1:
+                await self._synthesize_pieces(pieces, output_path, ref_audio_path, ref_text, language, task_id)
             else:
-                raise Exception(f"TTS API error: {response.status_code}")
+                await self._synthesize(text, output_path, ref_audio_path, ref_text, language, task_id)
+            return output_path
                 
         except Exception as e:
             raise Exception(f"TTS conversion failed: {str(e)}")
     
-    async def batch_text_to_speech(
+    async def _synthesize_pieces(
         self,
-        texts: list[str],
-        output_dir: str,
-        ref_audio_path: Optional[str] = None,
-        ref_text: Optional[str] = None,
-        language: str = "zh"
-    ) -> list[str]:
+        pieces: list[str],
+        output_path: str,
+        ref_audio_path: Optional[str],
+        ref_text: Optional[str],
+        language: str,
+        task_id: Optional[str]
+    ):
         """
-        批量转换文本为语音
+        各子句并行合成（各自经过缓存和调度器），按顺序拼接，子句之间插入静音
         """
-        output_dir = Path(output_dir)
-        output_dir.mkdir(exist_ok=True)
+        part_paths = [f"{output_path}.part{i}.wav" for i in range(len(pieces))]
+        jobs = [
+            asyncio.ensure_future(self._synthesize(piece, path, ref_audio_path, ref_text, language, task_id))
+            for piece, path in zip(pieces, part_paths)
+        ]
+        try:
+            await asyncio.gather(*jobs)
+            await asyncio.to_thread(concat_wavs, part_paths, output_path, TTS_SPLIT_SILENCE)
+        except BaseException:
+            # 一个子句失败时取消其余子句，不再占用后端
+            for job in jobs:
+                job.cancel()
+            await asyncio.gather(*jobs, return_exceptions=True)
+            raise
+        finally:
+            for path in part_paths:
+                Path(path).unlink(missing_ok=True)
+    
+    async def _synthesize(
+        self,
+        text: str,
+        output_path: str,
+        ref_audio_path: Optional[str],
+        ref_text: Optional[str],
+        language: str,
+        task_id: Optional[str]
+    ):
+        """合成单段文本，优先使用缓存"""
+        data = {
+            "text": text,
+            "text_language": language,
+            "top_k": 5,
+            "top_p": 1,
+            "temperature": 1,
+            "streaming_mode": self.streaming,
+            "media_type": "wav"
+        }
         
-        tasks = []
-        for i, text in enumerate(texts):
-            output_path = str(output_dir / f"audio_{i}.wav")
-            task = self.text_to_speech(
-                text, 
-                output_path,
-                ref_audio_path,
-                ref_text,
-                language
-            )
-            tasks.append(task)
+        if ref_audio_path and ref_text:
+            data.update({
+                "ref_audio_path": ref_audio_path,
+                "prompt_text": ref_text,
+                "prompt_language": language
+            })
         
-        results = await asyncio.gather(*tasks)
-        return results
\ No newline at end of file
+        cache_key = None
+        if self.cache:
+            cache_key = await asyncio.to_thread(self._cache_key, data)
+            if await asyncio.to_thread(self.cache.get, cache_key, output_path):
+                CACHE_LOOKUPS.labels("tts", "hit").inc()
+                return
+            CACHE_LOOKUPS.labels("tts", "miss").inc()
+        
+        async with tts_scheduler.slot(task_id):
+            await tts_router.request(lambda api_url: self._request(api_url, data, output_path))
+        
+        if cache_key:
+            await asyncio.to_thread(self.cache.put, cache_key, output_path)
+    
+    async def _request(self, api_url: str, data: dict, output_path: str):
+        """
+        向一个副本发送合成请求，只统计请求本身的耗时，不含排队
+        流式响应边收边写，收完后按实际长度改写WAV头
+        """
+        session = http_clients.get("gpt_sovits")
+        start_time, result = time.perf_counter(), "error"
+        try:
+            async with session.post(f"{api_url}/tts", json=data) as response:
+                if response.status != 200:
+                    raise Exception(f"TTS API error: {response.status}")
+                first_chunk = True
+                async with aiofiles.open(output_path, 'wb') as f:
+                    async for chunk in response.content.iter_chunked(self.chunk_size):
+                        if first_chunk:
+                            TTS_FIRST_BYTE.observe(time.perf_counter() - start_time)
+                            first_chunk = False
+                        await f.write(chunk)
+                if data.get("streaming_mode"):
+                    await asyncio.to_thread(fix_wav_sizes, output_path)
+                result = "success"
+        finally:
+            TTS_LATENCY.labels(result).observe(time.perf_counter() - start_time)
+    
+    def _cache_key(self, data: dict) -> str:
+        """
+        参考音频按内容而非路径参与缓存键，每个任务的临时路径不同也能命中
+        """
+        params = {key: value for key, value in data.items() if key not in TRANSPORT_PARAMS}
+        ref_audio_path = params.pop("ref_audio_path", None)
+        if ref_audio_path:
+            params["ref_audio_sha256"] = self.cache.ref_audio_hash(ref_audio_path)
+        return self.cache.make_key(params)
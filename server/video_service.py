@@ -1,114 +1,302 @@
 import os
-import requests
 import json
-import shutil
-import subprocess
+import time
+import uuid
+import contextlib
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Optional, Set
 import aiofiles
+import aiohttp
 import asyncio
-from config import MUSETALK_API_URL, TEMP_DIR, OUTPUT_DIR
+from http_client import http_clients
+from scheduler import video_scheduler
+from router import video_router
+from metrics import MUSETALK_LATENCY, MERGE_LATENCY, CACHE_LOOKUPS
 
 class VideoService:
     def __init__(self):
-        self.api_url = MUSETALK_API_URL
+        self.chunk_size = 256 * 1024
+        # 后端是否支持数字人缓存，首次遇到404时关闭
+        self.avatar_supported = True
+        # (视频路径, 大小, 修改时间) -> avatar_id
+        self._avatar_ids: "OrderedDict[tuple, str]" = OrderedDict()
+        self._avatar_memo_size = 256
+        # avatar_id -> 已缓存该数字人的副本地址，各副本的数字人缓存相互独立
+        self._avatar_replicas: Dict[str, Set[str]] = {}
         
+    async def prepare_avatar(
+        self,
+        video_path: str,
+        task_id: Optional[str] = None
+    ) -> Optional[str]:
+        """
+        将参考视频上传到一个MuseTalk副本预处理并返回avatar_id，
+        后端不支持或预处理失败时返回None，调用方回退为每段上传视频
+        avatar_id由视频内容决定，其他副本在首次收到该视频时各自缓存
+        """
+        if not self.avatar_supported:
+            return None
+        
+        stat = os.stat(video_path)
+        memo_key = (os.path.abspath(video_path), stat.st_size, stat.st_mtime)
+        if memo_key in self._avatar_ids:
+            self._avatar_ids.move_to_end(memo_key)
+            CACHE_LOOKUPS.labels("avatar", "hit").inc()
+            return self._avatar_ids[memo_key]
+        CACHE_LOOKUPS.labels("avatar", "miss").inc()
+        
+        try:
+            async with video_scheduler.slot(task_id):
+                avatar_id = await video_router.request(lambda api_url: self._prewarm(api_url, video_path))
+        except Exception as e:
+            # 预处理只是优化，超时或副本出错时不影响任务，各段改为上传参考视频
+            print(f"[数字人缓存] 预处理失败，改为每段上传参考视频: {e}")
+            return None
+        if avatar_id is None:
+            return None
+        
+        self._avatar_ids[memo_key] = avatar_id
+        while len(self._avatar_ids) > self._avatar_memo_size:
+            _, evicted = self._avatar_ids.popitem(last=False)
+            if evicted not in self._avatar_ids.values():
+                self._avatar_replicas.pop(evicted, None)
+        return avatar_id
+    
+    async def _prewarm(self, api_url: str, video_path: str) -> Optional[str]:
+        """在一个副本上预处理参考视频，接口不存在时关闭数字人缓存并返回None"""
+        session = http_clients.get("musetalk")
+        with open(video_path, 'rb') as video_file:
+            form = aiohttp.FormData()
+            form.add_field('video', video_file, filename='video.mp4', content_type='video/mp4')
+            
+            async with session.post(f"{api_url}/avatars/prewarm", data=form) as response:
+                if response.status == 404:
+                    self.avatar_supported = False
+                    return None
+                if response.status != 200:
+                    raise Exception(f"MuseTalk API error: {response.status}")
+                avatar_id = (await response.json())["avatar_id"]
+        self._avatar_replicas.setdefault(avatar_id, set()).add(api_url)
+        return avatar_id
+    
+    async def _post_inference(
+        self,
+        endpoint: str,
+        fields: list,
+        video_path: str,
+        avatar_id: Optional[str],
+        output_path: str,
+        task_id: Optional[str]
+    ) -> bool:
+        """
+        发送推理请求并将结果流式写入output_path，接口不存在（404）时返回False
+        优先发往已缓存该数字人的副本；选中的副本没有缓存或已淘汰时改为上传参考视频，
+        副本会顺带缓存该数字人
+        """
+        holders = self._avatar_replicas.get(avatar_id, set()) if avatar_id else set()
+        async with video_scheduler.slot(task_id):
+            return await video_router.request(
+                lambda api_url: self._send_inference(api_url, endpoint, fields, video_path, avatar_id, output_path),
+                preferred=holders
+            )
+    
+    async def _send_inference(
+        self,
+        api_url: str,
+        endpoint: str,
+        fields: list,
+        video_path: str,
+        avatar_id: Optional[str],
+        output_path: str
+    ) -> bool:
+        session = http_clients.get("musetalk")
+        use_avatar = avatar_id is not None and api_url in self._avatar_replicas.get(avatar_id, ())
+        while True:
+            with contextlib.ExitStack() as stack:
+                # 文件对象作为表单字段时aiohttp按块从磁盘读取，不会整体载入内存
+                form = aiohttp.FormData()
+                for name, path, filename, content_type in fields:
+                    form.add_field(name, stack.enter_context(open(path, 'rb')), filename=filename, content_type=content_type)
+                if use_avatar:
+                    form.add_field('avatar_id', avatar_id)
+                else:
+                    video_file = stack.enter_context(open(video_path, 'rb'))
+                    form.add_field('video', video_file, filename='video.mp4', content_type='video/mp4')
+                
+                start_time, result = time.perf_counter(), "error"
+                try:
+                    async with session.post(f"{api_url}{endpoint}", data=form) as response:
+                        if response.status == 404:
+                            result = "not_found"
+                        elif response.status != 200:
+                            raise Exception(f"MuseTalk API error: {response.status}")
+                        else:
+                            async with aiofiles.open(output_path, 'wb') as f:
+                                async for chunk in response.content.iter_chunked(self.chunk_size):
+                                    await f.write(chunk)
+                            result = "success"
+                finally:
+                    MUSETALK_LATENCY.labels(endpoint, result).observe(time.perf_counter() - start_time)
+            
+            if result == "success":
+                if avatar_id:
+                    self._avatar_replicas.setdefault(avatar_id, set()).add(api_url)
+                return True
+            if not use_avatar:
+                return False
+            # 该副本已淘汰这个数字人，在同一副本上改为上传参考视频重试
+            self._avatar_replicas.get(avatar_id, set()).discard(api_url)
+            use_avatar = False
+    
     async def generate_talking_video(
         self,
         audio_path: str,
         video_path: str,
-        output_path: str
+        output_path: str,
+        task_id: Optional[str] = None,
+        avatar_id: Optional[str] = None
     ) -> str:
         """
-        使用MuseTalk生成说话视频
+        使用MuseTalk生成说话视频，副本已缓存avatar_id时不再上传参考视频
         """
         try:
-            with open(audio_path, 'rb') as audio_file:
-                with open(video_path, 'rb') as video_file:
-                    files = {
-                        'audio': ('audio.wav', audio_file, 'audio/wav'),
-                        'video': ('video.mp4', video_file, 'video/mp4')
-                    }
-                    
-                    response = requests.post(
-                        f"{self.api_url}/inference",
-                        files=files,
-                        timeout=300
-                    )
-            
-            if response.status_code == 200:
-                async with aiofiles.open(output_path, 'wb') as f:
-                    await f.write(response.content)
-                return output_path
-            else:
-                raise Exception(f"MuseTalk API error: {response.status_code}")
+            fields = [('audio', audio_path, 'audio.wav', 'audio/wav')]
+            if not await self._post_inference("/inference", fields, video_path, avatar_id, output_path, task_id):
+                raise Exception("MuseTalk API error: 404")
+            return output_path
                 
         except Exception as e:
             raise Exception(f"Video generation failed: {str(e)}")
     
+    async def probe_streams(self, video_path: str) -> dict:
+        """
+        使用ffprobe读取视频的音视频编码参数
+        """
+        process = await asyncio.create_subprocess_exec(
+            'ffprobe', '-v', 'error',
+            '-show_entries',
+            'stream=codec_type,codec_name,profile,width,height,pix_fmt,r_frame_rate,sample_rate,channels',
+            '-of', 'json',
+            video_path,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise Exception(f"FFprobe error: {stderr.decode()}")
+        
+        streams = {}
+        for stream in json.loads(stdout.decode()).get("streams", []):
+            # 每种类型只取第一条流
+            streams.setdefault(stream.get("codec_type"), stream)
+        return streams
+    
+    async def _run_ffmpeg(self, cmd: list):
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise Exception(f"FFmpeg error: {stderr.decode()}")
+    
     async def merge_videos(
         self,
         video_paths: list[str],
-        output_path: str
+        output_path: str,
+        work_dir: Optional[str] = None
     ) -> str:
         """
-        合并多个视频文件
+        合并多个视频文件，输出moov前置的MP4
+        所有段编码参数一致时直接拼接，否则重新编码
         """
+        output_path = Path(output_path)
+        work_dir = Path(work_dir) if work_dir else output_path.parent
+        # 每次合并使用独立的清单和临时输出，可安全并行
+        merge_id = uuid.uuid4().hex
+        list_file = work_dir / f".concat_{merge_id}.txt"
+        tmp_output = output_path.parent / f".{output_path.stem}_{merge_id}.mp4.tmp"
+        
+        start_time = time.perf_counter()
         try:
-            list_file = TEMP_DIR / "concat_list.txt"
-            
-            with open(list_file, 'w') as f:
-                for video_path in video_paths:
-                    f.write(f"file '{os.path.abspath(video_path)}'\n")
-            
-            cmd = [
-                'ffmpeg',
-                '-f', 'concat',
-                '-safe', '0',
-                '-i', str(list_file),
-                '-c', 'copy',
-                '-y',
-                output_path
-            ]
+            streams = await asyncio.gather(*(self.probe_streams(p) for p in video_paths))
             
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            
-            stdout, stderr = await process.communicate()
-            
-            if process.returncode != 0:
-                raise Exception(f"FFmpeg error: {stderr.decode()}")
+            mode = "copy" if self._streams_compatible(streams) else "reencode"
+            if mode == "copy":
+                with open(list_file, 'w') as f:
+                    for video_path in video_paths:
+                        escaped = os.path.abspath(video_path).replace("'", "'\\''")
+                        f.write(f"file '{escaped}'\n")
+                cmd = [
+                    'ffmpeg', '-v', 'error',
+                    '-f', 'concat',
+                    '-safe', '0',
+                    '-i', str(list_file),
+                    '-c', 'copy'
+                ]
+            else:
+                cmd = self._reencode_command(video_paths, streams)
             
-            os.remove(list_file)
-            return output_path
+            cmd += ['-movflags', '+faststart', '-f', 'mp4', '-y', str(tmp_output)]
+            await self._run_ffmpeg(cmd)
+            os.replace(tmp_output, output_path)
+            MERGE_LATENCY.labels(mode).observe(time.perf_counter() - start_time)
+            return str(output_path)
             
         except Exception as e:
             raise Exception(f"Video merge failed: {str(e)}")
+        finally:
+            list_file.unlink(missing_ok=True)
+            tmp_output.unlink(missing_ok=True)
     
-    async def batch_generate_videos(
-        self,
-        audio_paths: list[str],
-        video_path: str,
-        output_dir: str
-    ) -> list[str]:
+    def _streams_compatible(self, streams: list[dict]) -> bool:
+        """判断各段能否不重新编码直接拼接"""
+        video_keys = ("codec_name", "profile", "width", "height", "pix_fmt", "r_frame_rate")
+        audio_keys = ("codec_name", "sample_rate", "channels")
+        
+        def signature(stream_map: dict) -> tuple:
+            video = stream_map.get("video") or {}
+            audio = stream_map.get("audio")
+            return (
+                tuple(video.get(k) for k in video_keys),
+                tuple(audio.get(k) for k in audio_keys) if audio else None
+            )
+        
+        return all("video" in s for s in streams) and len({signature(s) for s in streams}) == 1
+    
+    def _reencode_command(self, video_paths: list[str], streams: list[dict]) -> list:
         """
-        批量生成说话视频
+        生成用concat滤镜重新编码的命令，各段统一为第一段的分辨率、帧率和采样率
         """
-        output_dir = Path(output_dir)
-        output_dir.mkdir(exist_ok=True)
+        first_video = streams[0]["video"]
+        width, height = first_video["width"], first_video["height"]
+        fps = first_video.get("r_frame_rate", "25/1")
+        has_audio = all("audio" in s for s in streams)
+        sample_rate = streams[0]["audio"].get("sample_rate", "44100") if has_audio else None
+        
+        cmd = ['ffmpeg', '-v', 'error']
+        for video_path in video_paths:
+            cmd += ['-i', video_path]
         
-        tasks = []
-        for i, audio_path in enumerate(audio_paths):
-            output_path = str(output_dir / f"video_{i}.mp4")
-            task = self.generate_talking_video(
-                audio_path,
-                video_path,
-                output_path
+        filters, inputs = [], ""
+        for i in range(len(video_paths)):
+            filters.append(
+                f"[{i}:v]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,fps={fps},format=yuv420p[v{i}]"
             )
-            tasks.append(task)
+            inputs += f"[v{i}]"
+            if has_audio:
+                filters.append(f"[{i}:a]aresample={sample_rate},aformat=channel_layouts=stereo[a{i}]")
+                inputs += f"[a{i}]"
+        filters.append(
+            f"{inputs}concat=n={len(video_paths)}:v=1:a={1 if has_audio else 0}[outv]"
+            + ("[outa]" if has_audio else "")
+        )
         
-        results = await asyncio.gather(*tasks)
-        return results
\ No newline at end of file
+        cmd += ['-filter_complex', ";".join(filters), '-map', '[outv]']
+        if has_audio:
+            cmd += ['-map', '[outa]', '-c:a', 'aac']
+        cmd += ['-c:v', 'libx264', '-pix_fmt', 'yuv420p']
+        return cmd
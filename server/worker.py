@@ -0,0 +1,142 @@
+"""
+合成任务工作进程：从任务代理领取API进程入队的任务并执行
+可在任意节点启动多个，处理能力随工作进程数扩展；需与API进程共享输出、临时、素材目录和任务库
+
+    JOB_BROKER_URL=sqlite python worker.py
+"""
+
+import os
+import sys
+import time
+import socket
+import signal
+import shutil
+import asyncio
+from typing import Dict, Optional
+from config import (
+    TEMP_DIR,
+    JOB_WORKERS,
+    JOB_BROKER_URL,
+    JOB_LEASE_TIME,
+    JOB_MAX_ATTEMPTS,
+    JOB_POLL_INTERVAL,
+    WORKER_METRICS_PORT
+)
+from broker import Broker, Lease, create_broker
+from http_client import http_clients
+from router import backend_routers
+from job_queue import priority_name
+from metrics import QUEUE_WAIT
+from synthesis import process_synthesis, update_task
+
+class SynthesisWorker:
+    """
+    以租约领取任务，执行期间定期续期；续期失败说明任务已被删除或租约已转给其他进程，立即停止执行
+    进程崩溃或失联时租约过期，任务由其他工作进程重新领取
+    """
+
+    def __init__(self, broker: Broker, concurrency: int = JOB_WORKERS, lease_time: float = JOB_LEASE_TIME):
+        self.broker = broker
+        self.concurrency = max(1, concurrency)
+        self.lease_time = lease_time
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.running: Dict[str, asyncio.Task] = {}
+        self._stopping = asyncio.Event()
+
+    async def _claim(self) -> Optional[Lease]:
+        """等待并领取下一个任务，停止时返回None"""
+        while not self._stopping.is_set():
+            lease = await asyncio.to_thread(self.broker.claim, self.worker_id, self.lease_time)
+            if lease is not None:
+                return lease
+            try:
+                await asyncio.wait_for(self._stopping.wait(), JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+        return None
+
+    async def _heartbeat(self, lease: Lease, job: asyncio.Task):
+        while True:
+            await asyncio.sleep(self.lease_time / 3)
+            if not await asyncio.to_thread(self.broker.heartbeat, lease.job_id, self.worker_id, self.lease_time):
+                print(f"[工作进程] 任务 {lease.job_id} 已被取消或转移，停止执行")
+                job.cancel()
+                return
+
+    async def _execute(self, lease: Lease):
+        task_id = lease.payload["task_id"]
+        if lease.attempts > JOB_MAX_ATTEMPTS:
+            # 多次执行都没有正常结束（工作进程崩溃或失联），不再重试
+            update_task(task_id, status="failed", message=f"任务执行 {JOB_MAX_ATTEMPTS} 次均被中断，已放弃")
+            shutil.rmtree(TEMP_DIR / task_id, ignore_errors=True)
+            await asyncio.to_thread(self.broker.ack, lease.job_id, self.worker_id)
+            return
+        if lease.attempts > 1:
+            print(f"[工作进程] 任务 {task_id} 重新投递，第 {lease.attempts} 次执行")
+        QUEUE_WAIT.labels(priority_name(lease.priority)).observe(time.time() - lease.enqueued_at)
+
+        job = asyncio.create_task(process_synthesis(**lease.payload))
+        heartbeat = asyncio.create_task(self._heartbeat(lease, job))
+        try:
+            await job
+        except asyncio.CancelledError:
+            if not job.cancelled():
+                raise
+            return
+        except Exception as e:
+            print(f"[工作进程] 任务 {task_id} 异常: {e}")
+        finally:
+            heartbeat.cancel()
+        await asyncio.to_thread(self.broker.ack, lease.job_id, self.worker_id)
+
+    async def _slot(self):
+        """一个执行槽位：循环领取并执行任务，停止时等当前任务执行完再退出"""
+        while True:
+            lease = await self._claim()
+            if lease is None:
+                return
+            self.running[lease.job_id] = asyncio.current_task()
+            try:
+                await self._execute(lease)
+            finally:
+                del self.running[lease.job_id]
+
+    def stop(self):
+        """不再领取新任务，执行中的任务完成后退出"""
+        if not self._stopping.is_set():
+            print(f"[工作进程] 停止领取任务，等待 {len(self.running)} 个执行中的任务完成")
+            self._stopping.set()
+
+    async def run(self):
+        await http_clients.start()
+        for router in backend_routers:
+            router.start()
+        print(f"[工作进程] {self.worker_id} 已启动，并发 {self.concurrency}，租约 {self.lease_time:g} 秒")
+        try:
+            await asyncio.gather(*(self._slot() for _ in range(self.concurrency)))
+        finally:
+            for router in backend_routers:
+                await router.stop()
+            await http_clients.close()
+        print(f"[工作进程] {self.worker_id} 已退出")
+
+async def main():
+    if not JOB_BROKER_URL:
+        print("[错误] 未设置JOB_BROKER_URL，API进程会自行执行任务，无需启动工作进程")
+        sys.exit(1)
+    if WORKER_METRICS_PORT:
+        from prometheus_client import start_http_server
+        start_http_server(WORKER_METRICS_PORT)
+
+    worker = SynthesisWorker(create_broker(JOB_BROKER_URL))
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, worker.stop)
+        except NotImplementedError:
+            # Windows不支持，Ctrl+C直接退出，执行中的任务在租约过期后重新投递
+            pass
+    await worker.run()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -5,15 +5,18 @@ GPT-SoVITS API包装器
 """
 
 import os
-import sys
-import subprocess
-import tempfile
-import time
+import struct
+import asyncio
 from pathlib import Path
+from typing import AsyncIterator
+import numpy as np
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 import uvicorn
+from tts_engine import BatchingEngine, create_model
 
 app = FastAPI(title="GPT-SoVITS API Wrapper", version="1.0.0")
 
@@ -21,6 +24,22 @@ app = FastAPI(title="GPT-SoVITS API Wrapper", version="1.0.0")
 current_dir = Path(__file__).parent
 gpt_sovits_dir = current_dir / "GPT-SoVITS"
 
+# 输出格式：16位单声道PCM
+SAMPLE_RATE = 32000
+CHANNELS = 1
+SAMPLE_WIDTH = 2
+# 流式输出时每块音频的时长
+CHUNK_SECONDS = float(os.getenv("GPT_SOVITS_CHUNK_SECONDS", "0.5"))
+# 流式WAV头中未知的长度字段
+STREAMING_SIZE = 0xFFFFFFFF
+
+# 常驻合成引擎，并发请求在GPT_SOVITS_BATCH_WAIT秒内合并，每批最多GPT_SOVITS_MAX_BATCH_SIZE条
+engine = BatchingEngine(
+    create_model(os.getenv("GPT_SOVITS_ENGINE_MODEL", "wrapper"), gpt_sovits_dir, SAMPLE_RATE),
+    max_batch_size=int(os.getenv("GPT_SOVITS_MAX_BATCH_SIZE", "8")),
+    max_wait=float(os.getenv("GPT_SOVITS_BATCH_WAIT", "0.01"))
+)
+
 class TTSRequest(BaseModel):
     text: str
     text_language: str = "zh"
@@ -30,91 +49,110 @@ class TTSRequest(BaseModel):
     top_k: int = 5
     top_p: float = 1.0
     temperature: float = 1.0
+    # 是否边生成边返回；media_type为wav（流式时长度字段未知）或raw（裸PCM，格式见响应头）
+    streaming_mode: bool = False
+    media_type: str = "wav"
 
-def run_gpt_sovits_tts(text: str, output_path: str, language: str = "zh") -> bool:
-    """使用命令行方式调用GPT-SoVITS"""
-    try:
-        # 尝试使用webui的推理脚本
-        webui_script = gpt_sovits_dir / "webui.py"
-        if webui_script.exists():
-            # 这里可以实现通过webui的API接口调用
-            pass
-        
-        # 直接使用Python导入（如果可能）
-        sys.path.insert(0, str(gpt_sovits_dir))
-        sys.path.insert(0, str(gpt_sovits_dir / "GPT_SoVITS"))
-        
-        try:
-            # 尝试导入必要的模块
-            from tools.i18n.i18n import I18nAuto
-            i18n = I18nAuto()
-            
-            # 创建简单的音频文件作为临时解决方案
-            # 实际应该调用GPT-SoVITS的推理函数
-            import wave
-            import struct
-            
-            # 生成静音WAV文件（临时解决方案）
-            sample_rate = 32000
-            duration = len(text) * 0.15  # 每个字符0.15秒
-            num_samples = int(duration * sample_rate)
-            
-            with wave.open(output_path, 'wb') as wav_file:
-                wav_file.setnchannels(1)
-                wav_file.setsampwidth(2)
-                wav_file.setframerate(sample_rate)
-                
-                # 生成简单的音频数据
-                for i in range(num_samples):
-                    sample = int(32767 * 0.1 * (i % 1000) / 1000)  # 简单的锯齿波
-                    wav_file.writeframes(struct.pack('h', sample))
-            
-            return True
-            
-        except ImportError as e:
-            print(f"导入错误: {e}")
-            return False
-            
-    except Exception as e:
-        print(f"TTS生成错误: {e}")
-        return False
+@app.on_event("startup")
+async def startup_event():
+    """模型在后台加载并预热，期间/health返回503"""
+    app.state.engine_task = asyncio.create_task(engine.start())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await engine.stop()
+
+async def rechunk(fragments: AsyncIterator[np.ndarray]) -> AsyncIterator[np.ndarray]:
+    """把模型逐段生成的音频整理为CHUNK_SECONDS秒一块发送，结尾不足一块的部分单独发送"""
+    chunk_samples = max(1, int(CHUNK_SECONDS * SAMPLE_RATE)) * CHANNELS
+    buffer = np.empty(0, dtype="<i2")
+    async for fragment in fragments:
+        buffer = np.concatenate([buffer, fragment])
+        while len(buffer) >= chunk_samples:
+            yield buffer[:chunk_samples]
+            buffer = buffer[chunk_samples:]
+    if len(buffer):
+        yield buffer
+
+def wav_header(data_size: int = STREAMING_SIZE) -> bytes:
+    """44字节WAV头，流式输出时长度字段为0xFFFFFFFF，读取方以实际收到的数据为准"""
+    riff_size = STREAMING_SIZE if data_size == STREAMING_SIZE else 36 + data_size
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", riff_size, b"WAVE",
+        b"fmt ", 16, 1, CHANNELS, SAMPLE_RATE, SAMPLE_RATE * CHANNELS * SAMPLE_WIDTH,
+        CHANNELS * SAMPLE_WIDTH, SAMPLE_WIDTH * 8,
+        b"data", data_size
+    )
 
 @app.post("/tts")
 async def text_to_speech(request: TTSRequest):
     """文本转语音接口"""
+    if request.media_type not in ("wav", "raw"):
+        raise HTTPException(status_code=400, detail="media_type必须是wav或raw")
+    
+    # 裸PCM没有文件头，格式通过响应头告知
+    headers = {
+        "X-Sample-Rate": str(SAMPLE_RATE),
+        "X-Channels": str(CHANNELS),
+        "X-Sample-Width": str(SAMPLE_WIDTH)
+    }
+    media_type = "audio/wav" if request.media_type == "wav" else f"audio/L16; rate={SAMPLE_RATE}; channels={CHANNELS}"
+    
     try:
-        # 创建临时输出文件
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp_file:
-            output_path = tmp_file.name
-        
-        # 调用GPT-SoVITS生成音频
-        success = run_gpt_sovits_tts(
-            text=request.text,
-            output_path=output_path,
-            language=request.text_language
-        )
-        
-        if success and os.path.exists(output_path):
-            return FileResponse(
-                output_path,
-                media_type="audio/wav",
-                filename="tts_output.wav"
-            )
+        # 与同时到达的其他请求合并为一批合成
+        if request.streaming_mode:
+            fragments = await engine.submit_stream(request.text, request.text_language)
         else:
-            raise HTTPException(status_code=500, detail="TTS生成失败")
-            
+            samples = await engine.submit(request.text, request.text_language)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    
+    if request.streaming_mode:
+        # 模型每生成一段即发送，不等所在批次全部完成
+        async def stream():
+            if request.media_type == "wav":
+                yield wav_header()
+            async for chunk in rechunk(fragments):
+                yield chunk.tobytes()
+        
+        return StreamingResponse(stream(), media_type=media_type, headers=headers)
+    
+    pcm = samples.tobytes()
+    body = wav_header(len(pcm)) + pcm if request.media_type == "wav" else pcm
+    return Response(body, media_type=media_type, headers=headers)
+
+class EngineCollector:
+    """抓取指标时读取合成引擎的状态"""
+
+    def collect(self):
+        status = engine.get_status()
+        yield GaugeMetricFamily("gpt_sovits_engine_ready", "合成引擎是否就绪", value=1 if status["ready"] else 0)
+        yield GaugeMetricFamily("gpt_sovits_engine_queue_depth", "等待合成的请求数", value=status["queue_depth"])
+        requests_total = CounterMetricFamily("gpt_sovits_engine_requests", "合成请求数", labels=["result"])
+        requests_total.add_metric(["success"], status["completed"])
+        requests_total.add_metric(["error"], status["failed"])
+        yield requests_total
+        yield CounterMetricFamily("gpt_sovits_engine_batches", "送入模型的批次数", value=status["batches"])
+
+REGISTRY.register(EngineCollector())
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus文本格式的运行指标"""
+    return Response(content=generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
 
 @app.get("/health")
 async def health():
-    """健康检查接口"""
-    return {
-        "status": "healthy",
+    """健康检查接口，合成引擎就绪前返回503"""
+    content = {
+        "status": "healthy" if engine.ready else engine.state,
         "service": "GPT-SoVITS",
         "mode": "wrapper",
-        "gpt_sovits_exists": gpt_sovits_dir.exists()
+        "gpt_sovits_exists": gpt_sovits_dir.exists(),
+        "engine": engine.get_status()
     }
+    return JSONResponse(content, status_code=200 if engine.ready else 503)
 
 @app.get("/")
 async def root():
@@ -124,6 +162,7 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "health": "/health",
+            "metrics": "/metrics",
             "tts": "/tts"
         },
         "note": "This is a wrapper for GPT-SoVITS"
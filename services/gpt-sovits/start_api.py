@@ -58,7 +58,7 @@ if os.path.exists(api_script):
         sys.executable,
         api_script,
         '-a', '0.0.0.0',  # 监听所有地址
-        '-p', '9880',     # 端口
+        '-p', os.getenv('GPT_SOVITS_PORT', '9880'),  # 端口
         '-d', 'cuda',     # 设备，如果没有GPU会自动降级到CPU
     ]
     
@@ -0,0 +1,325 @@
+"""
+GPT-SoVITS常驻合成引擎
+模型在服务启动时加载一次，并发到达的合成请求在短时间窗口内合并为一批送入模型
+"""
+
+import os
+import sys
+import time
+import asyncio
+from pathlib import Path
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
+import numpy as np
+
+def sawtooth(num_samples: int) -> np.ndarray:
+    """生成16位锯齿波样本（临时解决方案的占位音频）"""
+    index = np.arange(num_samples)
+    return (32767 * 0.1 * (index % 1000) / 1000).astype("<i2")
+
+def placeholder_stream(
+    texts: List[str],
+    sample_rate: int,
+    delay: float = 0.0,
+    char_delay: float = 0.0
+) -> Iterator[Tuple[int, Optional[np.ndarray]]]:
+    """
+    逐字生成占位音频（每个字符0.15秒），产出(批内序号, 音频片段)
+    每一步为批内所有还没结束的文本各生成一个字，短文本先结束，结束时产出片段None
+    """
+    if delay:
+        time.sleep(delay)
+    audios = [sawtooth(int(len(text) * 0.15 * sample_rate)) for text in texts]
+    step = int(0.15 * sample_rate)
+    for k in range(max(len(text) for text in texts)):
+        if char_delay:
+            time.sleep(char_delay)
+        for i, (text, audio) in enumerate(zip(texts, audios)):
+            if k < len(text):
+                yield i, audio[k * step:None if k == len(text) - 1 else (k + 1) * step]
+            if k == len(text) - 1:
+                yield i, None
+
+def collect_stream(fragments: Iterator[Tuple[int, Optional[np.ndarray]]], count: int) -> List[np.ndarray]:
+    """把流式产出的片段按批内序号拼接为完整音频"""
+    parts: List[List[np.ndarray]] = [[] for _ in range(count)]
+    for index, fragment in fragments:
+        if fragment is not None:
+            parts[index].append(fragment)
+    return [np.concatenate(p) if p else np.empty(0, dtype="<i2") for p in parts]
+
+class StubModel:
+    """
+    测试用桩模型，无需GPU和模型权重
+    每批耗时为固定开销加最长文本的逐字耗时，模拟GPU上批内各条并行计算
+    """
+
+    name = "stub"
+
+    def __init__(self, sample_rate: int, delay: float = 0.0, char_delay: float = 0.0):
+        self.sample_rate = sample_rate
+        self.delay = delay
+        self.char_delay = char_delay
+
+    def load(self):
+        pass
+
+    def warmup(self):
+        self.synthesize_batch(["预热"])
+
+    def synthesize_stream(self, texts: List[str], language: str = "zh") -> Iterator[Tuple[int, Optional[np.ndarray]]]:
+        return placeholder_stream(texts, self.sample_rate, self.delay, self.char_delay)
+
+    def synthesize_batch(self, texts: List[str], language: str = "zh") -> List[np.ndarray]:
+        return collect_stream(self.synthesize_stream(texts, language), len(texts))
+
+class WrapperModel:
+    """
+    包装器模式：启动时导入一次GPT-SoVITS模块，合成时按每个字符0.15秒生成占位音频
+    实际应该调用GPT-SoVITS的流式推理函数
+    """
+
+    name = "wrapper"
+
+    def __init__(self, gpt_sovits_dir: Path, sample_rate: int):
+        self.gpt_sovits_dir = Path(gpt_sovits_dir)
+        self.sample_rate = sample_rate
+        self.i18n = None
+
+    def load(self):
+        """只在启动时修改一次sys.path并导入模块"""
+        sys.path.insert(0, str(self.gpt_sovits_dir))
+        sys.path.insert(0, str(self.gpt_sovits_dir / "GPT_SoVITS"))
+        from tools.i18n.i18n import I18nAuto
+        self.i18n = I18nAuto()
+
+    def warmup(self):
+        self.synthesize_batch(["预热"])
+
+    def synthesize_stream(self, texts: List[str], language: str = "zh") -> Iterator[Tuple[int, Optional[np.ndarray]]]:
+        return placeholder_stream(texts, self.sample_rate)
+
+    def synthesize_batch(self, texts: List[str], language: str = "zh") -> List[np.ndarray]:
+        return collect_stream(self.synthesize_stream(texts, language), len(texts))
+
+class BatchingEngine:
+    """
+    管理模型生命周期，把并发请求合并为批次
+    第一个请求到达后最多再等max_wait秒，凑满max_batch_size条或超时即送入模型；
+    只有语言相同的请求合并为一批，其余留到下一批
+    批次按模型的流式接口执行，流式请求每生成一段即转发，不必等整批结束
+    """
+
+    def __init__(self, model, max_batch_size: int = 8, max_wait: float = 0.01):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.state = "created"
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self.completed = 0
+        self.failed = 0
+        self.batches = 0
+        # 队列和事件在事件循环启动后创建
+        self._queue: Optional[asyncio.Queue] = None
+        self._ready_event: Optional[asyncio.Event] = None
+        self._worker_task: Optional[asyncio.Task] = None
+        # 语言不同、没能并入上一批的请求，下一批优先处理
+        self._carry: List[tuple] = []
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    async def start(self):
+        """
+        加载模型并预热，完成后开始处理请求；加载期间提交的请求在队列中等待
+        """
+        self._queue = asyncio.Queue()
+        self._ready_event = asyncio.Event()
+        try:
+            self.state = "loading"
+            start_time = time.time()
+            await asyncio.to_thread(self.model.load)
+            self.load_seconds = time.time() - start_time
+
+            self.state = "warming_up"
+            start_time = time.time()
+            await asyncio.to_thread(self.model.warmup)
+            self.warmup_seconds = time.time() - start_time
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            print(f"合成引擎启动失败: {e}")
+            # 唤醒已经在等待的请求
+            while not self._queue.empty():
+                self._fail(self._queue.get_nowait(), Exception(f"合成引擎不可用: {self.error}"))
+            self._ready_event.set()
+            return
+
+        self.state = "ready"
+        self._ready_event.set()
+        self._worker_task = asyncio.create_task(self._worker())
+
+    async def stop(self):
+        """停止批处理协程"""
+        if self._worker_task:
+            self._worker_task.cancel()
+            await asyncio.gather(self._worker_task, return_exceptions=True)
+            self._worker_task = None
+        self.state = "stopped"
+
+    def _check(self):
+        if self._queue is None:
+            raise Exception("合成引擎未启动")
+        if self.state == "failed":
+            raise Exception(f"合成引擎不可用: {self.error}")
+
+    async def submit(self, text: str, language: str = "zh") -> np.ndarray:
+        """
+        提交一条文本并等待所在批次完成，返回16位PCM样本
+        """
+        self._check()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(((text, language), future, None))
+        return await future
+
+    async def submit_stream(self, text: str, language: str = "zh") -> AsyncIterator[np.ndarray]:
+        """
+        提交一条文本，返回按生成顺序产出音频片段的异步迭代器
+        模型每生成一段即转发，首段延迟不受批内其他请求长度影响
+        """
+        self._check()
+        future = asyncio.get_running_loop().create_future()
+        fragments: asyncio.Queue = asyncio.Queue()
+        await self._queue.put(((text, language), future, fragments))
+
+        async def iterate():
+            try:
+                while True:
+                    fragment = await fragments.get()
+                    if fragment is None:
+                        return
+                    if isinstance(fragment, Exception):
+                        raise fragment
+                    yield fragment
+            finally:
+                # 调用方提前停止读取（如客户端断开）时，后续片段不再转发
+                future.cancel()
+
+        return iterate()
+
+    def _fail(self, item: tuple, error: Exception):
+        _, future, fragments = item
+        if future.done():
+            return
+        if fragments is None:
+            future.set_exception(error)
+        else:
+            future.set_result(None)
+            fragments.put_nowait(error)
+
+    async def _next(self, timeout: Optional[float] = None):
+        """取下一个未取消的请求，超时返回None"""
+        while True:
+            if self._carry:
+                item = self._carry.pop(0)
+            elif timeout is None:
+                item = await self._queue.get()
+            else:
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    return None
+            if not item[1].done():
+                # 调用方已取消的请求直接丢弃
+                return item
+
+    async def _collect(self) -> List[tuple]:
+        """等待第一个请求，再在max_wait内收集同语言的请求"""
+        batch = [await self._next()]
+        language = batch[0][0][1]
+        carry = []
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            item = await self._next(remaining)
+            if item is None:
+                break
+            if item[0][1] == language:
+                batch.append(item)
+            else:
+                carry.append(item)
+        self._carry.extend(carry)
+        return batch
+
+    def _run_batch(self, loop: asyncio.AbstractEventLoop, batch: List[tuple]) -> List[List[np.ndarray]]:
+        """
+        在线程中执行一批：流式请求的片段立即投递到其队列，片段为None表示该请求已生成完毕，
+        可先于批内其他请求结束；其余请求的片段留到批次结束后拼接
+        """
+        texts = [args[0] for args, _, _ in batch]
+        parts: List[List[np.ndarray]] = [[] for _ in batch]
+        for index, fragment in self.model.synthesize_stream(texts, batch[0][0][1]):
+            _, future, fragments = batch[index]
+            if fragments is None:
+                if fragment is not None:
+                    parts[index].append(fragment)
+            elif not future.done():
+                loop.call_soon_threadsafe(fragments.put_nowait, fragment)
+        return parts
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            try:
+                parts = await asyncio.to_thread(self._run_batch, loop, batch)
+            except Exception as e:
+                self.failed += len(batch)
+                for item in batch:
+                    self._fail(item, e)
+                continue
+            self.batches += 1
+            self.completed += len(batch)
+            # 线程中投递的片段先于本协程恢复执行，结束标记一定排在最后
+            for (_, future, fragments), samples in zip(batch, parts):
+                if future.done():
+                    continue
+                if fragments is None:
+                    future.set_result(np.concatenate(samples) if samples else np.empty(0, dtype="<i2"))
+                else:
+                    future.set_result(None)
+                    fragments.put_nowait(None)
+
+    def get_status(self) -> dict:
+        """获取引擎状态"""
+        return {
+            "model": self.model.name,
+            "state": self.state,
+            "ready": self.ready,
+            "error": self.error,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "queue_depth": (self._queue.qsize() if self._queue else 0) + len(self._carry),
+            "max_batch_size": self.max_batch_size,
+            "max_wait": self.max_wait,
+            "completed": self.completed,
+            "failed": self.failed,
+            "batches": self.batches,
+            "avg_batch_size": self.completed / self.batches if self.batches else 0
+        }
+
+def create_model(model_name: str, gpt_sovits_dir: Path, sample_rate: int):
+    """按名称创建合成模型"""
+    if model_name == "wrapper":
+        return WrapperModel(gpt_sovits_dir, sample_rate)
+    if model_name == "stub":
+        return StubModel(
+            sample_rate,
+            delay=float(os.getenv("GPT_SOVITS_STUB_DELAY", "0")),
+            char_delay=float(os.getenv("GPT_SOVITS_STUB_CHAR_DELAY", "0"))
+        )
+    raise ValueError(f"未知的合成模型: {model_name}")
@@ -100,7 +100,7 @@ install_gpt_sovits() {
     create_venv "GPT-SoVITS" "$GPT_SOVITS_DIR"
     
     # 安装基础依赖
-    pip install fastapi uvicorn requests aiofiles
+    pip install fastapi uvicorn requests aiofiles numpy prometheus_client
     
     # 创建简化的API服务
     cat > "$GPT_SOVITS_DIR/start_api.py" << 'EOF'
@@ -296,7 +296,7 @@ install_musetalk() {
     create_venv "MuseTalk" "$MUSETALK_DIR"
     
     # 安装基础依赖
-    pip install fastapi uvicorn requests aiofiles opencv-python-headless numpy
+    pip install fastapi uvicorn requests aiofiles opencv-python-headless numpy prometheus_client
     
     # 创建简化的API服务
     cat > "$MUSETALK_DIR/start_api.py" << 'EOF'
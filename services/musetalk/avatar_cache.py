@@ -0,0 +1,291 @@
+"""
+MuseTalk数字人预处理缓存
+同一参考视频的帧提取、人脸检测和坐标计算只做一次，后续推理直接复用
+"""
+
+import os
+import json
+import time
+import glob
+import pickle
+import shutil
+import hashlib
+import asyncio
+import subprocess
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Collection, Dict, List, Optional
+
+# 预处理函数: (视频路径, 数字人目录, bbox_shift) -> None
+Preprocessor = Callable[[Path, Path, int], None]
+
+def file_sha256(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def extract_frames(video_path: Path, avatar_dir: Path):
+    """使用ffmpeg将参考视频拆为帧图片"""
+    frames_dir = avatar_dir / "full_imgs"
+    frames_dir.mkdir(exist_ok=True)
+    result = subprocess.run(
+        [
+            'ffmpeg', '-v', 'error',
+            '-i', str(video_path),
+            '-start_number', '0',
+            str(frames_dir / "%08d.png")
+        ],
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise Exception(f"帧提取失败: {result.stderr}")
+
+def musetalk_preprocess(video_path: Path, avatar_dir: Path, bbox_shift: int):
+    """
+    MuseTalk预处理：提取帧并计算人脸关键点和裁剪框
+    """
+    from musetalk.utils.preprocessing import get_landmark_and_bbox
+
+    extract_frames(video_path, avatar_dir)
+    img_list = sorted(glob.glob(str(avatar_dir / "full_imgs" / "*.png")))
+    coord_list, _ = get_landmark_and_bbox(img_list, bbox_shift)
+    with open(avatar_dir / "coords.pkl", 'wb') as f:
+        pickle.dump(coord_list, f)
+
+def passthrough_preprocess(video_path: Path, avatar_dir: Path, bbox_shift: int):
+    """MuseTalk未安装时无需预处理，只保留原视频"""
+
+class Avatar:
+    """一个已预处理的数字人，产物按需载入内存"""
+
+    def __init__(self, avatar_dir: Path, meta: dict):
+        self.avatar_dir = avatar_dir
+        self.meta = meta
+        self._coords = None
+        self._frames = None
+        self._latents = None
+
+    @property
+    def avatar_id(self) -> str:
+        return self.meta["avatar_id"]
+
+    @property
+    def video_path(self) -> Path:
+        return self.avatar_dir / "video.mp4"
+
+    @property
+    def frames_dir(self) -> Path:
+        return self.avatar_dir / "full_imgs"
+
+    @property
+    def coords_path(self) -> Path:
+        return self.avatar_dir / "coords.pkl"
+
+    @property
+    def latents_path(self) -> Path:
+        return self.avatar_dir / "latents.pt"
+
+    def load_coords(self):
+        """载入人脸裁剪坐标"""
+        if self._coords is None and self.coords_path.exists():
+            with open(self.coords_path, 'rb') as f:
+                self._coords = pickle.load(f)
+        return self._coords
+
+    def load_frames(self) -> Optional[List]:
+        """载入全部帧图片"""
+        if self._frames is None and self.frames_dir.exists():
+            import cv2
+            img_list = sorted(glob.glob(str(self.frames_dir / "*.png")))
+            self._frames = [cv2.imread(img_path) for img_path in img_list]
+        return self._frames
+
+    def load_latents(self):
+        """载入VAE潜变量"""
+        if self._latents is None and self.latents_path.exists():
+            import torch
+            self._latents = torch.load(self.latents_path, map_location="cpu")
+        return self._latents
+
+class AvatarCache:
+    """以视频内容哈希和bbox_shift为键的磁盘+内存数字人缓存"""
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        preprocessor: Preprocessor = passthrough_preprocess,
+        memory_size: int = 4
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.preprocessor = preprocessor
+        self.memory_size = max(1, memory_size)
+        self.hits = 0
+        self.misses = 0
+        # 最近使用的数字人保留在内存中，末尾为最新；_memory和_locks只在事件循环中修改
+        self._memory: "OrderedDict[str, Avatar]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_avatar_id(video_sha256: str, bbox_shift: int) -> str:
+        return f"{video_sha256}_{bbox_shift}"
+
+    def _avatar_dir(self, avatar_id: str) -> Path:
+        return self.cache_dir / avatar_id
+
+    def _read_meta(self, avatar_id: str) -> Optional[dict]:
+        meta_path = self._avatar_dir(avatar_id) / "meta.json"
+        if not meta_path.exists():
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_meta(self, avatar_dir: Path, meta: dict):
+        tmp_path = avatar_dir / "meta.json.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, avatar_dir / "meta.json")
+
+    def _remember(self, avatar: Avatar) -> Avatar:
+        self._memory[avatar.avatar_id] = avatar
+        self._memory.move_to_end(avatar.avatar_id)
+        while len(self._memory) > self.memory_size:
+            _, evicted = self._memory.popitem(last=False)
+            # 移出内存时保存最近使用时间，磁盘淘汰按它排序
+            if evicted.avatar_dir.exists():
+                self._write_meta(evicted.avatar_dir, evicted.meta)
+        return avatar
+
+    def get(self, avatar_id: str) -> Optional[Avatar]:
+        """
+        获取已缓存的数字人，不存在时返回None
+        """
+        avatar = self._memory.get(avatar_id)
+        if avatar is None:
+            if "/" in avatar_id or avatar_id.startswith("."):
+                return None
+            meta = self._read_meta(avatar_id)
+            if meta is None:
+                return None
+            avatar = Avatar(self._avatar_dir(avatar_id), meta)
+        avatar.meta["last_used_at"] = time.time()
+        return self._remember(avatar)
+
+    async def get_or_prepare(self, video_path: Path, bbox_shift: int = 0) -> Avatar:
+        """
+        按视频内容查找数字人缓存，未命中时执行一次预处理
+        """
+        video_sha256 = await asyncio.to_thread(file_sha256, video_path)
+        avatar_id = self.make_avatar_id(video_sha256, bbox_shift)
+
+        # 同一数字人并发请求时只预处理一次
+        lock = self._locks.setdefault(avatar_id, asyncio.Lock())
+        async with lock:
+            avatar = self.get(avatar_id)
+            if avatar is not None:
+                self.hits += 1
+                return avatar
+
+            self.misses += 1
+            avatar = await asyncio.to_thread(
+                self._prepare, video_path, avatar_id, video_sha256, bbox_shift
+            )
+            return self._remember(avatar)
+
+    def _prepare(self, video_path: Path, avatar_id: str, video_sha256: str, bbox_shift: int) -> Avatar:
+        avatar_dir = self._avatar_dir(avatar_id)
+        # 先在临时目录中完成预处理，成功后再原子地改名，避免留下半成品
+        work_dir = self.cache_dir / f".{avatar_id}.tmp"
+        if work_dir.exists():
+            shutil.rmtree(work_dir)
+        work_dir.mkdir()
+
+        try:
+            shutil.copyfile(video_path, work_dir / "video.mp4")
+            self.preprocessor(work_dir / "video.mp4", work_dir, bbox_shift)
+
+            now = time.time()
+            meta = {
+                "avatar_id": avatar_id,
+                "video_sha256": video_sha256,
+                "bbox_shift": bbox_shift,
+                "num_frames": len(list((work_dir / "full_imgs").glob("*.png")))
+                if (work_dir / "full_imgs").exists() else None,
+                "size": _dir_size(work_dir),
+                "created_at": now,
+                "last_used_at": now
+            }
+            self._write_meta(work_dir, meta)
+
+            if avatar_dir.exists():
+                shutil.rmtree(avatar_dir)
+            os.replace(work_dir, avatar_dir)
+        except BaseException:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            raise
+
+        return Avatar(avatar_dir, meta)
+
+    def _scan(self) -> List[dict]:
+        """读取磁盘上所有数字人的元数据，只访问文件系统，可在线程中执行"""
+        avatars = []
+        for avatar_dir in sorted(self.cache_dir.iterdir()):
+            if not avatar_dir.is_dir() or avatar_dir.name.startswith("."):
+                continue
+            meta = self._read_meta(avatar_dir.name)
+            if meta:
+                avatars.append(meta)
+        return avatars
+
+    def list_avatars(self) -> List[dict]:
+        """列出所有缓存的数字人"""
+        return [{**meta, "in_memory": meta["avatar_id"] in self._memory} for meta in self._scan()]
+
+    def memory_ids(self) -> List[str]:
+        """内存中（可能正在推理）的数字人"""
+        return list(self._memory)
+
+    def least_recently_used(self, exclude: Collection[str] = ()) -> List[dict]:
+        """
+        按最近使用时间从旧到新列出磁盘上的数字人，exclude中的不参与淘汰
+        只访问文件系统，可在线程中执行；exclude应在事件循环中取得
+        """
+        avatars = [meta for meta in self._scan() if meta["avatar_id"] not in exclude]
+        return sorted(avatars, key=lambda a: a.get("last_used_at", 0))
+
+    def _remove_files(self, avatar_id: str) -> bool:
+        if "/" in avatar_id or avatar_id.startswith("."):
+            return False
+        avatar_dir = self._avatar_dir(avatar_id)
+        if not avatar_dir.exists():
+            return False
+        shutil.rmtree(avatar_dir, ignore_errors=True)
+        return True
+
+    async def evict(self, avatar_id: str) -> bool:
+        """
+        从内存和磁盘删除数字人缓存
+        内存状态在事件循环中修改，删除文件在线程中进行
+        """
+        self._memory.pop(avatar_id, None)
+        lock = self._locks.get(avatar_id)
+        if lock is not None and not lock.locked():
+            del self._locks[avatar_id]
+        return await asyncio.to_thread(self._remove_files, avatar_id)
+
+    def get_stats(self) -> dict:
+        """获取缓存统计信息"""
+        return {
+            "avatars": len(self.list_avatars()),
+            "in_memory": len(self._memory),
+            "memory_size": self.memory_size,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+def _dir_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
@@ -0,0 +1,362 @@
+"""
+MuseTalk常驻推理引擎
+模型在服务启动时加载一次，推理请求通过工作队列串行送入模型
+"""
+
+import os
+import copy
+import time
+import shutil
+import asyncio
+import tempfile
+import threading
+import subprocess
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+from prometheus_client import Histogram
+from avatar_cache import Avatar, musetalk_preprocess, passthrough_preprocess
+
+INFERENCE_LATENCY = Histogram(
+    "musetalk_inference_seconds", "单次推理耗时（不含排队）", ["result"],
+    buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+)
+
+_chdir_lock = threading.Lock()
+
+@contextmanager
+def working_directory(path: Path):
+    """
+    临时切换工作目录，退出时恢复
+    工作目录是进程级的，服务自身的路径都已解析为绝对路径，切换期间不受影响
+    """
+    with _chdir_lock:
+        previous = os.getcwd()
+        os.chdir(path)
+        try:
+            yield
+        finally:
+            os.chdir(previous)
+
+class StubModel:
+    """测试用桩模型，无需GPU和模型权重，按配置延迟后输出参考视频"""
+
+    name = "stub"
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+
+    def load(self):
+        pass
+
+    def warmup(self):
+        pass
+
+    def preprocess(self, video_path: Path, avatar_dir: Path, bbox_shift: int):
+        passthrough_preprocess(video_path, avatar_dir, bbox_shift)
+
+    def infer(self, avatar: Avatar, audio_path: Path, output_path: Path):
+        if self.delay:
+            time.sleep(self.delay)
+        shutil.copyfile(avatar.video_path, output_path)
+
+class FFmpegMuxModel:
+    """MuseTalk未安装时的后备方案：直接将音频合并到参考视频"""
+
+    name = "ffmpeg"
+
+    def load(self):
+        if shutil.which("ffmpeg") is None:
+            raise Exception("找不到ffmpeg")
+
+    def warmup(self):
+        pass
+
+    def preprocess(self, video_path: Path, avatar_dir: Path, bbox_shift: int):
+        passthrough_preprocess(video_path, avatar_dir, bbox_shift)
+
+    def infer(self, avatar: Avatar, audio_path: Path, output_path: Path):
+        cmd = [
+            'ffmpeg',
+            '-i', str(avatar.video_path),
+            '-i', str(audio_path),
+            '-c:v', 'copy',
+            '-c:a', 'aac',
+            '-map', '0:v:0',
+            '-map', '1:a:0',
+            '-shortest',
+            '-y',
+            str(output_path)
+        ]
+
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0 or not output_path.exists():
+            raise Exception(f"视频合成失败: {result.stderr}")
+
+class MuseTalkModel:
+    """常驻内存的MuseTalk模型"""
+
+    name = "musetalk"
+
+    def __init__(self, musetalk_dir: Path, batch_size: int = 8, fps: int = 25, use_float16: bool = True):
+        self.musetalk_dir = Path(musetalk_dir)
+        self.batch_size = batch_size
+        self.fps = fps
+        self.use_float16 = use_float16
+        self.device = None
+        self.audio_processor = None
+        self.vae = None
+        self.unet = None
+        self.pe = None
+        self.timesteps = None
+
+    def load(self):
+        """加载全部模型权重，只在启动时执行一次"""
+        import torch
+
+        # MuseTalk使用相对路径查找模型文件，导入时就会加载人脸检测、人脸解析模型，
+        # 只在加载期间切换到MuseTalk目录，并在此处完成导入
+        with working_directory(self.musetalk_dir):
+            from musetalk.utils.utils import load_all_model
+            import musetalk.utils.preprocessing  # noqa: F401
+            import musetalk.utils.blending  # noqa: F401
+            self.audio_processor, self.vae, self.unet, self.pe = load_all_model()
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.timesteps = torch.tensor([0], device=self.device)
+
+        if self.use_float16 and self.device.type == "cuda":
+            self.pe = self.pe.half()
+            self.vae.vae = self.vae.vae.half()
+            self.unet.model = self.unet.model.half()
+        self.pe = self.pe.to(self.device)
+
+    def warmup(self):
+        """用全零输入跑一次前向，完成CUDA内核初始化"""
+        import torch
+
+        with torch.no_grad():
+            dtype = self.unet.model.dtype
+            audio_feature = torch.zeros(1, 50, 384, device=self.device, dtype=dtype)
+            latent = torch.zeros(1, 8, 32, 32, device=self.device, dtype=dtype)
+            pred_latents = self.unet.model(
+                latent, self.timesteps, encoder_hidden_states=self.pe(audio_feature)
+            ).sample
+            self.vae.decode_latents(pred_latents)
+
+    def preprocess(self, video_path: Path, avatar_dir: Path, bbox_shift: int):
+        """
+        在帧和坐标之外额外缓存VAE潜变量
+        """
+        import cv2
+        import torch
+        from musetalk.utils.preprocessing import coord_placeholder
+
+        musetalk_preprocess(video_path, avatar_dir, bbox_shift)
+        avatar = Avatar(avatar_dir, {"avatar_id": avatar_dir.name})
+
+        latents = []
+        for bbox, frame in zip(avatar.load_coords(), avatar.load_frames()):
+            if bbox == coord_placeholder:
+                continue
+            x1, y1, x2, y2 = bbox
+            crop_frame = cv2.resize(frame[y1:y2, x1:x2], (256, 256), interpolation=cv2.INTER_LANCZOS4)
+            latents.append(self.vae.get_latents_for_unet(crop_frame).cpu())
+        torch.save(latents, avatar.latents_path)
+
+    def infer(self, avatar: Avatar, audio_path: Path, output_path: Path):
+        import cv2
+        import torch
+        import numpy as np
+        from musetalk.utils.utils import datagen
+        from musetalk.utils.blending import get_image
+
+        coord_list = avatar.load_coords()
+        frame_list = avatar.load_frames()
+        latent_list = avatar.load_latents()
+        if not coord_list or not frame_list or not latent_list:
+            raise Exception(f"数字人预处理数据不完整: {avatar.avatar_id}")
+
+        # 正序+倒序循环，保证长音频时画面连续
+        coord_cycle = coord_list + coord_list[::-1]
+        frame_cycle = frame_list + frame_list[::-1]
+        latent_cycle = latent_list + latent_list[::-1]
+
+        whisper_feature = self.audio_processor.audio2feat(str(audio_path))
+        whisper_chunks = self.audio_processor.feature2chunks(feature_array=whisper_feature, fps=self.fps)
+
+        res_frames = []
+        with torch.no_grad():
+            for whisper_batch, latent_batch in datagen(whisper_chunks, latent_cycle, self.batch_size):
+                audio_feature = torch.from_numpy(whisper_batch).to(
+                    device=self.device, dtype=self.unet.model.dtype
+                )
+                audio_feature = self.pe(audio_feature)
+                latent_batch = latent_batch.to(device=self.device, dtype=self.unet.model.dtype)
+                pred_latents = self.unet.model(
+                    latent_batch, self.timesteps, encoder_hidden_states=audio_feature
+                ).sample
+                res_frames.extend(self.vae.decode_latents(pred_latents))
+
+        frames_dir = Path(tempfile.mkdtemp(dir=output_path.parent))
+        try:
+            for i, res_frame in enumerate(res_frames):
+                x1, y1, x2, y2 = coord_cycle[i % len(coord_cycle)]
+                ori_frame = copy.deepcopy(frame_cycle[i % len(frame_cycle)])
+                try:
+                    res_frame = cv2.resize(res_frame.astype(np.uint8), (x2 - x1, y2 - y1))
+                except Exception:
+                    continue
+                combine_frame = get_image(ori_frame, res_frame, [x1, y1, x2, y2])
+                cv2.imwrite(str(frames_dir / f"{i:08d}.png"), combine_frame)
+
+            cmd = [
+                'ffmpeg', '-v', 'error',
+                '-r', str(self.fps),
+                '-i', str(frames_dir / "%08d.png"),
+                '-i', str(audio_path),
+                '-c:v', 'libx264',
+                '-pix_fmt', 'yuv420p',
+                '-c:a', 'aac',
+                '-shortest',
+                '-y',
+                str(output_path)
+            ]
+            result = subprocess.run(cmd, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise Exception(f"视频编码失败: {result.stderr}")
+        finally:
+            shutil.rmtree(frames_dir, ignore_errors=True)
+
+class InferenceEngine:
+    """管理模型生命周期和推理工作队列"""
+
+    def __init__(self, model, workers: int = 1):
+        self.model = model
+        self.workers = max(1, workers)
+        self.state = "created"
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self.completed = 0
+        self.failed = 0
+        # 队列和事件在事件循环启动后创建
+        self._queue: Optional[asyncio.Queue] = None
+        self._ready_event: Optional[asyncio.Event] = None
+        self._worker_tasks = []
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    async def start(self):
+        """
+        加载模型并预热，完成后启动工作协程；加载期间提交的请求在队列中等待
+        """
+        self._queue = asyncio.Queue()
+        self._ready_event = asyncio.Event()
+        try:
+            self.state = "loading"
+            start_time = time.time()
+            await asyncio.to_thread(self.model.load)
+            self.load_seconds = time.time() - start_time
+
+            self.state = "warming_up"
+            start_time = time.time()
+            await asyncio.to_thread(self.model.warmup)
+            self.warmup_seconds = time.time() - start_time
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            print(f"推理引擎启动失败: {e}")
+            # 唤醒已经在等待的请求
+            while not self._queue.empty():
+                _, future = self._queue.get_nowait()
+                if not future.done():
+                    future.set_exception(Exception(f"推理引擎不可用: {self.error}"))
+            self._ready_event.set()
+            return
+
+        self.state = "ready"
+        self._ready_event.set()
+        for _ in range(self.workers):
+            self._worker_tasks.append(asyncio.create_task(self._worker()))
+
+    async def stop(self):
+        """停止工作协程"""
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks.clear()
+        self.state = "stopped"
+
+    async def wait_ready(self):
+        """
+        等待模型加载和预热结束，启动失败时抛出异常
+        """
+        if self._ready_event is None:
+            raise Exception("推理引擎未启动")
+        await self._ready_event.wait()
+        if self.state != "ready":
+            raise Exception(f"推理引擎不可用: {self.error}")
+
+    async def submit(self, avatar: Avatar, audio_path: Path, output_path: Path) -> Path:
+        """
+        提交一次推理并等待结果
+        """
+        if self._queue is None:
+            raise Exception("推理引擎未启动")
+        if self.state == "failed":
+            raise Exception(f"推理引擎不可用: {self.error}")
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(((avatar, audio_path, output_path), future))
+        await future
+        return output_path
+
+    async def _worker(self):
+        while True:
+            args, future = await self._queue.get()
+            if future.done():
+                # 调用方已取消
+                continue
+            start_time = time.perf_counter()
+            try:
+                await asyncio.to_thread(self.model.infer, *args)
+                self.completed += 1
+                INFERENCE_LATENCY.labels("success").observe(time.perf_counter() - start_time)
+                if not future.done():
+                    future.set_result(None)
+            except Exception as e:
+                self.failed += 1
+                INFERENCE_LATENCY.labels("error").observe(time.perf_counter() - start_time)
+                if not future.done():
+                    future.set_exception(e)
+
+    def get_status(self) -> dict:
+        """获取引擎状态"""
+        return {
+            "model": self.model.name,
+            "state": self.state,
+            "ready": self.ready,
+            "error": self.error,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "workers": self.workers,
+            "completed": self.completed,
+            "failed": self.failed
+        }
+
+def create_model(model_name: str, musetalk_dir: Path):
+    """按名称创建推理模型"""
+    if model_name == "musetalk":
+        return MuseTalkModel(
+            musetalk_dir,
+            batch_size=int(os.getenv("MUSETALK_BATCH_SIZE", "8")),
+            fps=int(os.getenv("MUSETALK_FPS", "25"))
+        )
+    if model_name == "stub":
+        return StubModel(delay=float(os.getenv("MUSETALK_STUB_DELAY", "0")))
+    if model_name == "ffmpeg":
+        return FFmpegMuxModel()
+    raise ValueError(f"未知的推理模型: {model_name}")
@@ -0,0 +1,121 @@
+"""
+MuseTalk服务磁盘清理
+请求临时目录在响应发送后删除，异常退出或客户端断开遗留的目录由后台定期清除；
+磁盘使用率超过高水位时按最近使用时间淘汰数字人缓存
+"""
+
+import time
+import shutil
+import asyncio
+import tempfile
+from pathlib import Path
+from typing import Set
+from avatar_cache import AvatarCache, _dir_size
+
+class TempDirs:
+    """请求临时目录的创建、删除和过期清理"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        # 正在被请求使用的目录，不论多久都不清理
+        self._active: Set[Path] = set()
+
+    def create(self) -> Path:
+        path = Path(tempfile.mkdtemp(prefix="req_", dir=self.root))
+        self._active.add(path)
+        return path
+
+    def remove(self, path: Path):
+        self._active.discard(path)
+        shutil.rmtree(path, ignore_errors=True)
+
+    def sweep(self, max_age: float) -> tuple:
+        """删除超过max_age秒未修改且不在使用中的目录，返回(目录数, 释放字节数)"""
+        count, reclaimed = 0, 0
+        deadline = time.time() - max_age
+        for path in self.root.iterdir():
+            if path in self._active or not path.name.startswith("req_"):
+                continue
+            try:
+                if path.stat().st_mtime >= deadline:
+                    continue
+            except FileNotFoundError:
+                continue
+            reclaimed += _dir_size(path) if path.is_dir() else path.stat().st_size
+            shutil.rmtree(path, ignore_errors=True)
+            count += 1
+        return count, reclaimed
+
+class ServiceJanitor:
+    """定期清理遗留的临时目录，磁盘紧张时淘汰最久未使用的数字人"""
+
+    def __init__(
+        self,
+        temp_dirs: TempDirs,
+        avatar_cache: AvatarCache,
+        temp_expire_time: float = 3600,
+        high_watermark: float = 0.9,
+        low_watermark: float = 0.8
+    ):
+        self.temp_dirs = temp_dirs
+        self.avatar_cache = avatar_cache
+        self.temp_expire_time = temp_expire_time
+        self.high_watermark = high_watermark
+        self.low_watermark = min(low_watermark, high_watermark)
+        self.reclaimed_bytes = {"temp": 0, "avatar": 0}
+
+    def _disk_usage(self) -> float:
+        usage = shutil.disk_usage(self.avatar_cache.cache_dir)
+        return 1 - usage.free / usage.total
+
+    async def run_once(self) -> dict:
+        """
+        执行一轮清理，返回清理报告
+        扫描和删除文件在线程中进行，数字人缓存的内存状态只在事件循环中读取和修改
+        """
+        temp_count, temp_bytes = await asyncio.to_thread(self.temp_dirs.sweep, self.temp_expire_time)
+        self.reclaimed_bytes["temp"] += temp_bytes
+
+        evicted, avatar_bytes = 0, 0
+        usage = await asyncio.to_thread(self._disk_usage)
+        if usage >= self.high_watermark:
+            print(f"[磁盘清理] 磁盘使用率 {usage:.1%} 超过高水位，淘汰最久未使用的数字人")
+            candidates = await asyncio.to_thread(
+                self.avatar_cache.least_recently_used, set(self.avatar_cache.memory_ids())
+            )
+            for meta in candidates:
+                if usage <= self.low_watermark:
+                    break
+                # 扫描期间可能又被请求载入内存
+                if meta["avatar_id"] in self.avatar_cache.memory_ids():
+                    continue
+                if await self.avatar_cache.evict(meta["avatar_id"]):
+                    evicted += 1
+                    avatar_bytes += meta.get("size") or 0
+                usage = await asyncio.to_thread(self._disk_usage)
+            self.reclaimed_bytes["avatar"] += avatar_bytes
+
+        return {
+            "temp_dirs": temp_count,
+            "evicted_avatars": evicted,
+            "reclaimed_bytes": temp_bytes + avatar_bytes,
+            "disk_usage": round(await asyncio.to_thread(self._disk_usage), 4)
+        }
+
+    async def cleanup_loop(self, interval: float):
+        """启动时立即清理一次，之后定期清理"""
+        while True:
+            try:
+                report = await self.run_once()
+                if report["reclaimed_bytes"]:
+                    print(
+                        f"[磁盘清理] 释放 {report['reclaimed_bytes']} 字节: 临时目录 {report['temp_dirs']} 个, "
+                        f"数字人 {report['evicted_avatars']} 个; 磁盘使用率 {report['disk_usage']:.1%}"
+                    )
+                await asyncio.sleep(interval)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"[磁盘清理] 错误: {e}")
+                await asyncio.sleep(interval)
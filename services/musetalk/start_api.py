@@ -6,18 +6,26 @@ MuseTalk API服务
 
 import os
 import sys
-import subprocess
-import tempfile
-import shutil
+import asyncio
+import zipfile
 from pathlib import Path
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import FileResponse
+from typing import List, Optional
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi.responses import FileResponse, JSONResponse, Response
+from starlette.background import BackgroundTask
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 import uvicorn
 import importlib.util
+from avatar_cache import AvatarCache
+from engine import InferenceEngine, create_model
+from janitor import TempDirs, ServiceJanitor
 
 # 获取路径
-current_dir = Path(__file__).parent
+current_dir = Path(__file__).resolve().parent
 musetalk_dir = current_dir / "MuseTalk"
+avatar_cache_dir = Path(os.getenv("MUSETALK_AVATAR_CACHE_DIR", str(current_dir / "avatar_cache")))
+temp_root = Path(os.getenv("MUSETALK_TEMP_DIR", str(current_dir / "temp")))
 
 # 创建FastAPI应用
 app = FastAPI(title="MuseTalk API", version="1.0.0")
@@ -30,9 +38,33 @@ if musetalk_installed:
     sys.path.insert(0, str(musetalk_dir))
     os.environ['PYTHONPATH'] = f"{musetalk_dir}:{os.environ.get('PYTHONPATH', '')}"
 
+# 常驻推理引擎，未安装MuseTalk时使用ffmpeg后备方案
+engine_model = os.getenv("MUSETALK_ENGINE_MODEL", "musetalk" if musetalk_installed else "ffmpeg")
+engine = InferenceEngine(
+    create_model(engine_model, musetalk_dir),
+    workers=int(os.getenv("MUSETALK_ENGINE_WORKERS", "1"))
+)
+
+# 数字人预处理缓存
+avatar_cache = AvatarCache(
+    avatar_cache_dir,
+    preprocessor=engine.model.preprocess,
+    memory_size=int(os.getenv("MUSETALK_AVATAR_MEMORY_SIZE", "4"))
+)
+
+# 请求临时目录和磁盘清理
+temp_dirs = TempDirs(temp_root)
+janitor = ServiceJanitor(
+    temp_dirs,
+    avatar_cache,
+    temp_expire_time=float(os.getenv("MUSETALK_TEMP_EXPIRE_TIME", "3600")),
+    high_watermark=float(os.getenv("MUSETALK_DISK_HIGH_WATERMARK", "0.9")),
+    low_watermark=float(os.getenv("MUSETALK_DISK_LOW_WATERMARK", "0.8"))
+)
+
 @app.on_event("startup")
 async def startup_event():
-    """启动时检查依赖"""
+    """启动时检查依赖并在后台加载推理引擎"""
     if musetalk_installed:
         # 检查必要的依赖
         required_modules = ['cv2', 'numpy', 'torch', 'torchvision']
@@ -48,117 +80,222 @@ async def startup_event():
     else:
         print("警告: MuseTalk未安装")
         print("请运行 musetalk_setup.sh 安装MuseTalk")
+    
+    # 模型加载在后台进行，期间/health返回503
+    app.state.engine_task = asyncio.create_task(engine.start())
+    app.state.janitor_task = asyncio.create_task(
+        janitor.cleanup_loop(float(os.getenv("MUSETALK_CLEANUP_INTERVAL", "600")))
+    )
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """关闭时停止推理引擎和磁盘清理"""
+    app.state.janitor_task.cancel()
+    await engine.stop()
+
+async def save_upload(upload: UploadFile, path: Path):
+    """分块保存上传文件"""
+    with open(path, "wb") as f:
+        while chunk := await upload.read(1024 * 1024):
+            f.write(chunk)
+
+async def resolve_avatar(
+    video: Optional[UploadFile],
+    avatar_id: Optional[str],
+    bbox_shift: int,
+    temp_dir: Path
+):
+    """
+    按avatar_id查找已缓存的数字人，或保存上传的视频并预处理
+    """
+    if avatar_id:
+        avatar = avatar_cache.get(avatar_id)
+        if avatar is None:
+            raise HTTPException(status_code=404, detail="数字人缓存不存在")
+        return avatar
+    
+    if video is None:
+        raise HTTPException(status_code=400, detail="需要上传参考视频或指定avatar_id")
+    
+    video_path = temp_dir / "video.mp4"
+    await save_upload(video, video_path)
+    
+    # 预处理依赖已加载的模型
+    await engine.wait_ready()
+    
+    # 同一参考视频只做一次预处理
+    return await avatar_cache.get_or_prepare(video_path, bbox_shift)
 
 @app.post("/inference")
 async def generate_video(
     audio: UploadFile = File(...),
-    video: UploadFile = File(...)
+    video: Optional[UploadFile] = File(None),
+    avatar_id: Optional[str] = Form(None),
+    bbox_shift: int = Form(0)
 ):
-    """视频合成接口"""
-    temp_dir = Path(tempfile.mkdtemp())
+    """视频合成接口，参考视频可直接上传，也可引用已缓存的avatar_id"""
+    temp_dir = temp_dirs.create()
     
     try:
-        # 保存上传的文件
         audio_path = temp_dir / "audio.wav"
-        video_path = temp_dir / "video.mp4"
         output_dir = temp_dir / "results"
         output_dir.mkdir(exist_ok=True)
         
-        with open(audio_path, "wb") as f:
-            content = await audio.read()
-            f.write(content)
-            
-        with open(video_path, "wb") as f:
-            content = await video.read()
-            f.write(content)
+        await save_upload(audio, audio_path)
+        avatar = await resolve_avatar(video, avatar_id, bbox_shift, temp_dir)
+        
+        output_path = output_dir / "output.mp4"
+        await engine.submit(avatar, audio_path, output_path)
+        
+        # 响应发送完毕后再删除临时目录
+        return FileResponse(
+            output_path,
+            media_type="video/mp4",
+            filename="synthesized_video.mp4",
+            background=BackgroundTask(temp_dirs.remove, temp_dir)
+        )
+        
+    except HTTPException:
+        temp_dirs.remove(temp_dir)
+        raise
+    except Exception as e:
+        temp_dirs.remove(temp_dir)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/inference/batch")
+async def generate_video_batch(
+    audios: List[UploadFile] = File(...),
+    video: Optional[UploadFile] = File(None),
+    avatar_id: Optional[str] = Form(None),
+    bbox_shift: int = Form(0)
+):
+    """
+    批量视频合成接口：一个参考视频配多段音频，结果按顺序打包为
+    不压缩的zip（segment_0.mp4, segment_1.mp4, ...）
+    """
+    temp_dir = temp_dirs.create()
+    
+    try:
+        output_dir = temp_dir / "results"
+        output_dir.mkdir(exist_ok=True)
+        
+        audio_paths = []
+        for i, audio in enumerate(audios):
+            audio_path = temp_dir / f"audio_{i}.wav"
+            await save_upload(audio, audio_path)
+            audio_paths.append(audio_path)
+        
+        avatar = await resolve_avatar(video, avatar_id, bbox_shift, temp_dir)
+        
+        output_paths = [output_dir / f"segment_{i}.mp4" for i in range(len(audio_paths))]
+        await asyncio.gather(*[
+            engine.submit(avatar, audio_path, output_path)
+            for audio_path, output_path in zip(audio_paths, output_paths)
+        ])
+        
+        # 视频本身已压缩，打包时不再压缩
+        archive_path = temp_dir / "segments.zip"
+        with zipfile.ZipFile(archive_path, "w", compression=zipfile.ZIP_STORED) as archive:
+            for output_path in output_paths:
+                archive.write(output_path, output_path.name)
+        
+        return FileResponse(
+            archive_path,
+            media_type="application/zip",
+            filename="segments.zip",
+            headers={"X-Avatar-Id": avatar.avatar_id},
+            background=BackgroundTask(temp_dirs.remove, temp_dir)
+        )
+        
+    except HTTPException:
+        temp_dirs.remove(temp_dir)
+        raise
+    except Exception as e:
+        temp_dirs.remove(temp_dir)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/avatars")
+async def list_avatars():
+    """列出已缓存的数字人"""
+    return {
+        "avatars": avatar_cache.list_avatars(),
+        "stats": avatar_cache.get_stats()
+    }
+
+@app.post("/avatars/prewarm")
+async def prewarm_avatar(
+    video: UploadFile = File(...),
+    bbox_shift: int = Form(0)
+):
+    """预先完成参考视频的预处理"""
+    temp_dir = temp_dirs.create()
+    try:
+        await engine.wait_ready()
         
-        if musetalk_installed:
-            # 使用MuseTalk进行推理
-            inference_script = musetalk_dir / "inference.py"
-            
-            if inference_script.exists():
-                cmd = [
-                    sys.executable,
-                    str(inference_script),
-                    "--video_path", str(video_path),
-                    "--audio_path", str(audio_path),
-                    "--bbox_shift", "0",
-                    "--result_dir", str(output_dir)
-                ]
-                
-                env = os.environ.copy()
-                env["PYTHONPATH"] = str(musetalk_dir)
-                
-                print(f"执行MuseTalk推理: {' '.join(cmd)}")
-                
-                result = subprocess.run(
-                    cmd,
-                    env=env,
-                    capture_output=True,
-                    text=True,
-                    cwd=str(musetalk_dir)
-                )
-                
-                if result.returncode == 0:
-                    # 查找生成的视频文件
-                    output_files = list(output_dir.glob("*.mp4"))
-                    if output_files:
-                        output_path = output_files[0]
-                        return FileResponse(
-                            output_path,
-                            media_type="video/mp4",
-                            filename="synthesized_video.mp4"
-                        )
-                    else:
-                        raise Exception("MuseTalk未生成输出文件")
-                else:
-                    error_msg = f"MuseTalk推理失败: {result.stderr}"
-                    print(error_msg)
-                    raise Exception(error_msg)
-            else:
-                raise Exception(f"找不到MuseTalk推理脚本: {inference_script}")
-        else:
-            # MuseTalk未安装，使用ffmpeg合并音视频
-            output_path = temp_dir / "output.mp4"
-            cmd = [
-                'ffmpeg',
-                '-i', str(video_path),
-                '-i', str(audio_path),
-                '-c:v', 'copy',
-                '-c:a', 'aac',
-                '-map', '0:v:0',
-                '-map', '1:a:0',
-                '-shortest',
-                '-y',
-                str(output_path)
-            ]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0 and output_path.exists():
-                return FileResponse(
-                    output_path,
-                    media_type="video/mp4",
-                    filename="synthesized_video.mp4"
-                )
-            else:
-                raise Exception(f"视频合成失败: {result.stderr}")
+        video_path = temp_dir / "video.mp4"
+        await save_upload(video, video_path)
         
+        avatar = await avatar_cache.get_or_prepare(video_path, bbox_shift)
+        return avatar.meta
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        # 延迟清理临时文件，让响应能够完成
-        pass
+        temp_dirs.remove(temp_dir)
+
+@app.post("/cleanup")
+async def run_cleanup():
+    """立即执行一轮磁盘清理并返回清理报告"""
+    return await janitor.run_once()
+
+@app.delete("/avatars/{avatar_id}")
+async def evict_avatar(avatar_id: str):
+    """删除数字人缓存"""
+    if not await avatar_cache.evict(avatar_id):
+        raise HTTPException(status_code=404, detail="数字人缓存不存在")
+    return {"message": "数字人缓存已删除"}
+
+class ServiceCollector:
+    """抓取指标时读取推理引擎和数字人缓存的状态"""
+
+    def collect(self):
+        status = engine.get_status()
+        yield GaugeMetricFamily("musetalk_engine_ready", "推理引擎是否就绪", value=1 if status["ready"] else 0)
+        yield GaugeMetricFamily("musetalk_engine_queue_depth", "等待推理的请求数", value=status["queue_depth"])
+        requests_total = CounterMetricFamily("musetalk_engine_requests", "推理请求数", labels=["result"])
+        requests_total.add_metric(["success"], status["completed"])
+        requests_total.add_metric(["error"], status["failed"])
+        yield requests_total
+
+        stats = avatar_cache.get_stats()
+        lookups = CounterMetricFamily("musetalk_avatar_cache_lookups", "数字人缓存查询次数", labels=["result"])
+        lookups.add_metric(["hit"], stats["hits"])
+        lookups.add_metric(["miss"], stats["misses"])
+        yield lookups
+        yield GaugeMetricFamily("musetalk_avatar_cache_avatars", "磁盘上缓存的数字人数量", value=stats["avatars"])
+
+        reclaimed = CounterMetricFamily("musetalk_janitor_reclaimed_bytes", "磁盘清理释放的字节数", labels=["reason"])
+        for reason, value in janitor.reclaimed_bytes.items():
+            reclaimed.add_metric([reason], value)
+        yield reclaimed
+
+REGISTRY.register(ServiceCollector())
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus文本格式的运行指标"""
+    return Response(content=generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
 
 @app.get("/health")
 async def health():
-    """健康检查接口"""
-    return {
-        "status": "healthy",
+    """健康检查接口，推理引擎就绪前返回503"""
+    content = {
+        "status": "healthy" if engine.ready else engine.state,
         "service": "MuseTalk",
         "musetalk_installed": musetalk_installed,
-        "port": 9881
+        "port": 9881,
+        "engine": engine.get_status()
     }
+    return JSONResponse(content, status_code=200 if engine.ready else 503)
 
 @app.get("/")
 async def root():
@@ -168,7 +305,9 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "health": "/health",
-            "inference": "/inference"
+            "inference": "/inference",
+            "inference_batch": "/inference/batch",
+            "avatars": "/avatars"
         },
         "musetalk_installed": musetalk_installed
     }
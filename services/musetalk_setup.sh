@@ -45,7 +45,7 @@ echo "安装依赖..."
 pip install --upgrade pip
 pip install torch torchvision torchaudio --index-url https://download.pytorch.org/whl/cu118
 pip install -r requirements.txt
-pip install fastapi uvicorn python-multipart
+pip install fastapi uvicorn python-multipart prometheus_client
 
 # 下载预训练模型
 echo "下载预训练模型..."
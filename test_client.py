@@ -6,7 +6,10 @@
 
 import os
 import sys
+import json
 import time
+import shutil
+import tarfile
 import requests
 import argparse
 from pathlib import Path
@@ -31,8 +34,8 @@ class TestClient:
             print(f"[✗] 无法连接到服务器: {e}")
             return False
     
-    def test_synthesis(self, video_path, texts, ref_audio_path=None, ref_text=None, language="zh"):
-        """测试视频合成功能"""
+    def test_synthesis(self, video_path, texts, ref_audio_path=None, ref_text=None, language="zh", max_retries=10):
+        """测试视频合成功能，服务端队列已满(429)时最多重试max_retries次"""
         print("\n[*] 开始测试视频合成功能")
         print(f"    视频文件: {video_path}")
         print(f"    文本内容: {texts}")
@@ -63,12 +66,21 @@ class TestClient:
         # 发送请求
         print("\n[*] 上传文件并创建任务...")
         try:
-            response = self.session.post(
-                f"{self.server_url}/synthesize",
-                files=files,
-                data=data,
-                timeout=30
-            )
+            for attempt in range(max_retries + 1):
+                for f in files.values():
+                    f.seek(0)
+                response = self.session.post(
+                    f"{self.server_url}/synthesize",
+                    files=files,
+                    data=data,
+                    timeout=30
+                )
+                if response.status_code != 429 or attempt == max_retries:
+                    break
+                # 任务队列已满，按服务端建议的时间等待后重新提交
+                retry_after = int(response.headers.get('Retry-After', '5'))
+                print(f"[!] 服务器繁忙，{retry_after} 秒后重试")
+                time.sleep(retry_after)
             
             if response.status_code == 200:
                 task_info = response.json()
@@ -87,10 +99,51 @@ class TestClient:
             for f in files.values():
                 f.close()
     
+    def iter_task_events(self, task_id, timeout=120):
+        """
+        逐条产出任务的Server-Sent Events (事件类型, 数据)，任务结束后停止
+        服务端不支持推送时不产出任何事件
+        """
+        response = self.session.get(
+            f"{self.server_url}/task/{task_id}/events", stream=True, timeout=(5, timeout)
+        )
+        if response.status_code != 200:
+            return
+        
+        with response:
+            event, data = None, []
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    data.append(line[5:].strip())
+                elif not line and data:
+                    payload = json.loads("\n".join(data))
+                    data = []
+                    yield event, payload
+                    if event == "status" and payload['status'] in ('completed', 'failed'):
+                        return
+    
+    def watch_task_events(self, task_id, timeout=120):
+        """通过Server-Sent Events等待任务结束，服务端不支持或连接中断时直接返回"""
+        try:
+            for event, payload in self.iter_task_events(task_id, timeout):
+                if event == "segment":
+                    print(f"[*] 第 {payload['index'] + 1} 段{'语音' if payload['stage'] == 'audio' else '视频'}完成")
+                elif event == "merged":
+                    print("[*] 视频合并完成")
+                elif event == "status":
+                    print(f"[*] 状态: {payload['status']} - {payload.get('message', '')}")
+        except Exception as e:
+            print(f"[!] 进度推送中断，改为轮询: {e}")
+    
     def check_task_status(self, task_id):
         """检查任务状态"""
         print(f"\n[*] 检查任务状态: {task_id}")
         
+        # 先等待推送的结束事件，再用一次查询取得完整结果；不支持推送时退化为轮询
+        self.watch_task_events(task_id)
+        
         max_retries = 60  # 最多等待60次，每次2秒
         retry_count = 0
         
@@ -123,11 +176,34 @@ class TestClient:
         print("[✗] 任务超时")
         return None
     
-    def download_results(self, result_urls, output_dir="./test_output"):
+    def download_bundle(self, task_id, output_dir):
+        """一次请求下载任务的全部结果（tar），边下载边解包，不支持时返回None"""
+        response = self.session.get(f"{self.server_url}/task/{task_id}/bundle", stream=True)
+        if response.status_code != 200:
+            print(f"[!] 打包下载不可用({response.status_code})，改为逐个下载")
+            return None
+        
+        downloaded_files = []
+        with tarfile.open(fileobj=response.raw, mode='r|') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                save_path = os.path.join(output_dir, os.path.basename(member.name))
+                with open(save_path, 'wb') as f:
+                    shutil.copyfileobj(tar.extractfile(member), f, 1024 * 1024)
+                print(f"[✓] 已保存: {save_path}")
+                downloaded_files.append(save_path)
+        return downloaded_files
+    
+    def download_results(self, result_urls, output_dir="./test_output", task_id=None):
         """下载结果文件"""
         print(f"\n[*] 下载结果文件到: {output_dir}")
         
         os.makedirs(output_dir, exist_ok=True)
+        if task_id:
+            downloaded_files = self.download_bundle(task_id, output_dir)
+            if downloaded_files is not None:
+                return downloaded_files
         downloaded_files = []
         
         for url in result_urls:
@@ -140,7 +216,7 @@ class TestClient:
                 
                 if response.status_code == 200:
                     with open(save_path, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=8192):
+                        for chunk in response.iter_content(chunk_size=1024 * 1024):
                             if chunk:
                                 f.write(chunk)
                     print(f"[✓] 已保存: {save_path}")
@@ -177,7 +253,7 @@ class TestClient:
             return False
         
         # 4. 下载结果
-        downloaded_files = self.download_results(status['result_urls'])
+        downloaded_files = self.download_results(status['result_urls'], task_id=status['task_id'])
         
         print("\n" + "="*50)
         print(f"[✓] 测试完成! 共生成 {len(downloaded_files)} 个文件")
@@ -0,0 +1,44 @@
+import io
+import os
+import sys
+import asyncio
+import hashlib
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "server"))
+os.environ.setdefault("ASSETS_DIR", tempfile.mkdtemp())
+
+from fastapi import UploadFile
+from asset_store import AssetStore
+
+def test_json_suffix_does_not_overwrite_metadata(tmp_path):
+    """文件名为.json时数据文件不能与元数据文件同名"""
+    store = AssetStore(tmp_path)
+    data = b'{"not": "metadata"}'
+    meta = asyncio.run(store.save_upload(UploadFile(io.BytesIO(data), filename="foo.json"), "audio"))
+
+    assert meta["suffix"] == ".wav"
+    assert store.resolve(meta["asset_id"], "audio").read_bytes() == data
+    assert store.get(meta["asset_id"])["kind"] == "audio"
+
+def test_allowed_suffix_is_kept(tmp_path):
+    store = AssetStore(tmp_path)
+    meta = asyncio.run(store.save_upload(UploadFile(io.BytesIO(b"video"), filename="clip.MOV"), "video"))
+    assert meta["suffix"] == ".mov"
+
+def test_chunked_upload_suffix_is_whitelisted(tmp_path):
+    store = AssetStore(tmp_path)
+    data = b"audio data"
+    upload = store.create_upload("audio", "../evil.json", len(data))
+
+    async def chunks():
+        yield data
+
+    async def run():
+        await store.write_chunk(upload["upload_id"], 0, chunks())
+        return await store.finalize_upload(upload["upload_id"], hashlib.sha256(data).hexdigest())
+
+    meta = asyncio.run(run())
+    assert meta["suffix"] == ".wav"
+    assert store.resolve(meta["asset_id"], "audio").read_bytes() == data
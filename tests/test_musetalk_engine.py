@@ -0,0 +1,107 @@
+import os
+import sys
+import asyncio
+import tempfile
+import threading
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "services" / "musetalk"))
+os.environ.setdefault("MUSETALK_ENGINE_MODEL", "stub")
+os.environ.setdefault("MUSETALK_AVATAR_CACHE_DIR", tempfile.mkdtemp())
+os.environ.setdefault("MUSETALK_TEMP_DIR", tempfile.mkdtemp())
+
+import start_api
+from avatar_cache import Avatar
+from engine import InferenceEngine, StubModel
+
+class GatedModel(StubModel):
+    """放行前load一直阻塞，模拟正在加载的模型"""
+
+    def __init__(self, error: str = None):
+        super().__init__()
+        self.release = threading.Event()
+        self.error = error
+
+    def load(self):
+        self.release.wait(5)
+        if self.error:
+            raise Exception(self.error)
+
+def make_avatar(tmp_path: Path) -> Avatar:
+    avatar_dir = tmp_path / "avatar"
+    avatar_dir.mkdir()
+    (avatar_dir / "video.mp4").write_bytes(b"reference video")
+    return Avatar(avatar_dir, {"avatar_id": "avatar"})
+
+def api_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=start_api.app), base_url="http://test")
+
+def test_health_is_503_until_model_loaded(monkeypatch):
+    async def scenario():
+        model = GatedModel()
+        engine = InferenceEngine(model)
+        monkeypatch.setattr(start_api, "engine", engine)
+        starting = asyncio.create_task(engine.start())
+        async with api_client() as client:
+            await asyncio.sleep(0.05)
+            response = await client.get("/health")
+            assert response.status_code == 503
+            assert response.json()["engine"]["state"] == "loading"
+
+            model.release.set()
+            await starting
+            response = await client.get("/health")
+            assert response.status_code == 200
+            assert response.json()["engine"]["ready"] is True
+        await engine.stop()
+
+    asyncio.run(scenario())
+
+def test_load_failure_fails_waiting_requests(tmp_path):
+    async def scenario():
+        model = GatedModel(error="模型权重缺失")
+        engine = InferenceEngine(model)
+        starting = asyncio.create_task(engine.start())
+        await asyncio.sleep(0.05)
+        avatar = make_avatar(tmp_path)
+        waiting = asyncio.create_task(engine.submit(avatar, tmp_path / "audio.wav", tmp_path / "out.mp4"))
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+
+        model.release.set()
+        await starting
+        assert engine.state == "failed"
+        with pytest.raises(Exception, match="模型权重缺失"):
+            await waiting
+        # 启动失败后新的请求直接失败，不再排队
+        with pytest.raises(Exception, match="推理引擎不可用"):
+            await engine.submit(avatar, tmp_path / "audio.wav", tmp_path / "out.mp4")
+        with pytest.raises(Exception, match="推理引擎不可用"):
+            await engine.wait_ready()
+
+    asyncio.run(scenario())
+
+def test_inference_through_stub(monkeypatch):
+    async def scenario():
+        engine = InferenceEngine(StubModel())
+        monkeypatch.setattr(start_api, "engine", engine)
+        await engine.start()
+        async with api_client() as client:
+            response = await client.post(
+                "/inference",
+                files={
+                    "audio": ("audio.wav", b"audio", "audio/wav"),
+                    "video": ("video.mp4", b"reference video", "video/mp4")
+                }
+            )
+        await engine.stop()
+        return response
+
+    response = asyncio.run(scenario())
+    # 桩模型原样输出参考视频
+    assert response.status_code == 200
+    assert response.content == b"reference video"
+    assert start_api.engine.get_status()["completed"] == 1
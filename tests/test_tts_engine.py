@@ -0,0 +1,144 @@
+import sys
+import time
+import asyncio
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "services" / "gpt-sovits"))
+
+from tts_engine import BatchingEngine, StubModel
+
+SAMPLE_RATE = 32000
+
+class RecordingModel(StubModel):
+    """记录每批送入模型的文本和语言，gate未放行时批次一直阻塞"""
+
+    def __init__(self, char_delay: float = 0.0):
+        super().__init__(SAMPLE_RATE, char_delay=char_delay)
+        self.batches = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def synthesize_stream(self, texts, language="zh"):
+        self.gate.wait(5)
+        self.batches.append((list(texts), language))
+        return super().synthesize_stream(texts, language)
+
+class FailingModel(StubModel):
+    """为第一条文本产出一段音频后抛出异常"""
+
+    def __init__(self):
+        super().__init__(SAMPLE_RATE)
+
+    def warmup(self):
+        pass
+
+    def synthesize_stream(self, texts, language="zh"):
+        yield 0, next(super().synthesize_stream(texts, language))[1]
+        raise RuntimeError("显存不足")
+
+def run_with_engine(model, scenario, max_wait: float = 0.05):
+    async def main():
+        engine = BatchingEngine(model, max_batch_size=8, max_wait=max_wait)
+        await engine.start()
+        try:
+            return await scenario(engine)
+        finally:
+            await engine.stop()
+
+    return asyncio.run(main())
+
+async def read_stream(engine, text, language="zh"):
+    fragments = await engine.submit_stream(text, language)
+    parts = [fragment async for fragment in fragments]
+    return parts, time.monotonic()
+
+def test_concurrent_submits_share_one_batch():
+    model = RecordingModel()
+
+    async def scenario(engine):
+        results = await asyncio.gather(*(engine.submit("字" * n) for n in range(1, 6)))
+        return results, engine.get_status()
+
+    results, status = run_with_engine(model, scenario)
+    assert status["batches"] == 1 and status["completed"] == 5
+    assert sorted(model.batches[-1][0]) == sorted("字" * n for n in range(1, 6))
+    assert [len(samples) for samples in results] == [int(n * 0.15 * SAMPLE_RATE) for n in range(1, 6)]
+
+def test_mixed_languages_split_into_batches():
+    model = RecordingModel()
+
+    async def scenario(engine):
+        await asyncio.gather(
+            engine.submit("你好", "zh"),
+            engine.submit("hello", "en"),
+            engine.submit("世界", "zh"),
+            engine.submit("world", "en")
+        )
+        return engine.get_status()
+
+    status = run_with_engine(model, scenario)
+    # 预热不经过批处理，只有两批请求
+    assert status["batches"] == 2
+    batches = {language: sorted(texts) for texts, language in model.batches[1:]}
+    assert batches == {"zh": ["世界", "你好"], "en": ["hello", "world"]}
+
+def test_cancelled_request_is_dropped():
+    model = RecordingModel()
+
+    async def scenario(engine):
+        model.gate.clear()
+        first = asyncio.create_task(engine.submit("第一批"))
+        await asyncio.sleep(0.1)
+        cancelled = asyncio.create_task(engine.submit("已取消"))
+        await asyncio.sleep(0.01)
+        cancelled.cancel()
+        kept = asyncio.create_task(engine.submit("保留"))
+        await asyncio.sleep(0.01)
+        model.gate.set()
+        await asyncio.gather(first, kept)
+
+    run_with_engine(model, scenario)
+    assert model.batches[-1] == (["保留"], "zh")
+    assert all("已取消" not in texts for texts, _ in model.batches)
+
+def test_short_stream_ends_before_long_one_in_same_batch():
+    model = RecordingModel(char_delay=0.02)
+
+    async def scenario(engine):
+        short, long = await asyncio.gather(read_stream(engine, "短句"), read_stream(engine, "长" * 40))
+        return short, long, await engine.submit("短句"), engine.get_status()
+
+    (short_parts, short_end), (_, long_end), samples, status = run_with_engine(model, scenario)
+    assert status["batches"] == 2
+    assert sorted(model.batches[1][0]) == ["短句", "长" * 40]
+    # 短文本生成完毕即结束，不等同批的长文本
+    assert long_end - short_end > 0.3
+    assert b"".join(part.tobytes() for part in short_parts) == samples.tobytes()
+
+def test_model_error_reaches_every_waiter():
+    async def scenario(engine):
+        stream = await engine.submit_stream("流式")
+        received = []
+
+        async def consume():
+            async for fragment in stream:
+                received.append(fragment)
+
+        results = await asyncio.gather(
+            consume(), engine.submit("一"), engine.submit("二"), return_exceptions=True
+        )
+        return results, received, engine.get_status()
+
+    results, received, status = run_with_engine(FailingModel(), scenario)
+    assert all(isinstance(result, RuntimeError) and "显存不足" in str(result) for result in results)
+    # 流式请求先收到出错前已生成的片段
+    assert len(received) == 1
+    assert status["failed"] == 3 and status["batches"] == 0
+
+def test_submit_before_start_fails():
+    engine = BatchingEngine(StubModel(SAMPLE_RATE))
+    with pytest.raises(Exception, match="合成引擎未启动"):
+        asyncio.run(engine.submit("你好"))